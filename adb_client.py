@@ -0,0 +1,287 @@
+"""
+Pure-Python client for the adb server's host protocol (TCP port 5037).
+
+Talks to the already running adb server directly instead of spawning the
+`adb` binary: `host:devices`, `host:transport:<serial>`, `shell:`,
+`shell,v2:` and `exec:` (what `adb exec-out` uses) are supported.
+
+Every service consumes its socket, so the per-device pool keeps sockets that
+have already switched to the device's transport. A background worker tops
+the pool back up after each use, which takes the connect and transport
+round trips off the hot path.
+
+Calls with a timeout track one monotonic deadline from connecting to the
+last byte read, so a server that trickles data or stops answering
+mid-request raises AdbTimeout once the deadline passes.
+"""
+
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+
+ADB_SERVER_HOST = os.environ.get("ADB_SERVER_HOST", "127.0.0.1")
+ADB_SERVER_PORT = int(os.environ.get("ANDROID_ADB_SERVER_PORT", 5037))
+POOL_SIZE = int(os.environ.get("ADB_POOL_SIZE", 2))
+
+# shell,v2 packet ids
+SHELL_STDIN = 0
+SHELL_STDOUT = 1
+SHELL_STDERR = 2
+SHELL_EXIT = 3
+SHELL_CLOSE_STDIN = 4
+
+
+class AdbProtocolError(Exception):
+    """The adb server answered FAIL or the connection broke mid-request."""
+
+
+class AdbTimeout(Exception):
+    """An adb call did not finish before its deadline."""
+
+
+def remaining(deadline):
+    """Seconds left until deadline (time.monotonic()), None without one."""
+    if deadline is None:
+        return None
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise AdbTimeout("adb server did not answer before the deadline")
+    return left
+
+
+def recv(sock, size, deadline=None):
+    """One sock.recv that gives up at deadline; without one the socket's own timeout applies."""
+    try:
+        if deadline is not None:
+            sock.settimeout(remaining(deadline))
+        return sock.recv(size)
+    except socket.timeout:
+        raise AdbTimeout("adb server did not answer before the deadline")
+
+
+def recv_exact(sock, size, deadline=None):
+    data = bytearray()
+    while len(data) < size:
+        chunk = recv(sock, size - len(data), deadline)
+        if not chunk:
+            raise AdbProtocolError(f"connection closed after {len(data)} of {size} bytes")
+        data += chunk
+    return bytes(data)
+
+
+def read_length_prefixed(sock, deadline=None):
+    length = int(recv_exact(sock, 4, deadline), 16)
+    return recv_exact(sock, length, deadline).decode("utf-8", errors="replace")
+
+
+def send_request(sock, request, deadline=None):
+    """Send one host request and wait for OKAY, raising on FAIL."""
+    payload = request.encode("utf-8")
+    try:
+        if deadline is not None:
+            sock.settimeout(remaining(deadline))
+        sock.sendall(b"%04x" % len(payload) + payload)
+    except socket.timeout:
+        raise AdbTimeout("adb server did not take the request before the deadline")
+    status = recv_exact(sock, 4, deadline)
+    if status == b"OKAY":
+        return
+    if status == b"FAIL":
+        raise AdbProtocolError(read_length_prefixed(sock, deadline))
+    raise AdbProtocolError(f"unexpected status {status!r} for {request}")
+
+
+def read_shell_v2(sock, deadline=None):
+    """Demultiplex a shell,v2 stream into (stdout, stderr, exit_code)."""
+    out, err, exit_code = bytearray(), bytearray(), None
+    while True:
+        try:
+            header = recv_exact(sock, 5, deadline)
+        except AdbProtocolError:
+            break
+        packet_id, length = struct.unpack("<BI", header)
+        data = recv_exact(sock, length, deadline) if length else b""
+        if packet_id == SHELL_STDOUT:
+            out += data
+        elif packet_id == SHELL_STDERR:
+            err += data
+        elif packet_id == SHELL_EXIT:
+            exit_code = data[0] if data else None
+            break
+    return out, err, exit_code
+
+
+def read_all(sock, deadline=None):
+    data = bytearray()
+    while True:
+        chunk = recv(sock, 65536, deadline)
+        if not chunk:
+            return bytes(data)
+        data += chunk
+
+
+class AdbClient:
+    """adb host protocol client with a pool of transport-bound sockets."""
+
+    def __init__(self, host=ADB_SERVER_HOST, port=ADB_SERVER_PORT, pool_size=POOL_SIZE, timeout=None):
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = {}
+        self._features = {}
+        self._lock = threading.Lock()
+        self._refills = queue.Queue()
+        self._refill_thread = None
+
+    def connect(self, deadline=None):
+        timeout = remaining(deadline) if deadline is not None else self.timeout
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=timeout)
+        except socket.timeout:
+            raise AdbTimeout(f"adb server at {self.host}:{self.port} did not accept the connection in time")
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def host_request(self, request, deadline=None):
+        """Run a host:* request that answers with one length-prefixed blob."""
+        sock = self.connect(deadline)
+        try:
+            send_request(sock, request, deadline)
+            return read_length_prefixed(sock, deadline)
+        finally:
+            sock.close()
+
+    def devices(self):
+        """Return [(serial, state), ...] like `adb devices`."""
+        result = []
+        for line in self.host_request("host:devices").splitlines():
+            parts = line.split("\t")
+            if len(parts) >= 2:
+                result.append((parts[0], parts[1]))
+        return result
+
+    def features(self, serial, deadline=None):
+        if serial not in self._features:
+            try:
+                reply = self.host_request(f"host-serial:{serial}:features" if serial else "host:features",
+                                          deadline)
+            except AdbProtocolError:
+                reply = ""
+            self._features[serial] = set(reply.strip().split(","))
+        return self._features[serial]
+
+    def _open_transport(self, serial, deadline=None):
+        sock = self.connect(deadline)
+        try:
+            send_request(sock, f"host:transport:{serial}" if serial else "host:transport-any", deadline)
+        except Exception:
+            sock.close()
+            raise
+        return sock
+
+    def _take_warm(self, serial):
+        with self._lock:
+            warm = self._pool.get(serial)
+            return warm.pop() if warm else None
+
+    def _schedule_refill(self, serial):
+        with self._lock:
+            if self._refill_thread is None:
+                self._refill_thread = threading.Thread(target=self._refill_worker)
+                self._refill_thread.daemon = True
+                self._refill_thread.start()
+        self._refills.put(serial)
+
+    def _refill_worker(self):
+        while True:
+            serial = self._refills.get()
+            with self._lock:
+                if len(self._pool.get(serial, [])) >= self.pool_size:
+                    continue
+            try:
+                sock = self._open_transport(serial)
+            except (OSError, AdbProtocolError):
+                continue
+            with self._lock:
+                self._pool.setdefault(serial, []).append(sock)
+
+    def open_service(self, serial, service, deadline=None):
+        """Open a device service and return its socket, ready for reading.
+
+        Raises AdbTimeout if the service is not open by deadline.
+        """
+        warm = self._take_warm(serial)
+        if warm is not None:
+            try:
+                send_request(warm, service, deadline)
+                self._schedule_refill(serial)
+                return warm
+            except (OSError, AdbProtocolError):
+                # Device may have gone away since the socket was warmed up;
+                # retry on a fresh connection to get the real error.
+                warm.close()
+            except AdbTimeout:
+                warm.close()
+                raise
+        sock = self._open_transport(serial, deadline)
+        try:
+            send_request(sock, service, deadline)
+        except Exception:
+            sock.close()
+            raise
+        self._schedule_refill(serial)
+        return sock
+
+    def shell(self, serial, command, timeout=None):
+        """Run command and return (stdout, stderr, exit_code) as text.
+
+        Devices without shell_v2 merge stderr into stdout and report no
+        exit code. With timeout, AdbTimeout is raised when the command
+        has not finished that many seconds after the call.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        if "shell_v2" in self.features(serial, deadline):
+            sock = self.open_service(serial, f"shell,v2,raw:{command}", deadline)
+            try:
+                out, err, exit_code = read_shell_v2(sock, deadline)
+            finally:
+                sock.close()
+        else:
+            sock = self.open_service(serial, f"shell:{command}", deadline)
+            try:
+                out, err, exit_code = read_all(sock, deadline), b"", None
+            finally:
+                sock.close()
+        return (out.decode("utf-8", errors="replace"),
+                err.decode("utf-8", errors="replace"),
+                exit_code)
+
+    def exec_out(self, serial, command, timeout=None):
+        """Open a binary-safe `exec-out` stream; the caller reads and closes it.
+
+        timeout bounds opening the stream, not reading it.
+        """
+        deadline = time.monotonic() + timeout if timeout else None
+        return self.open_service(serial, f"exec:{command}", deadline)
+
+    def forget(self, serial):
+        """Drop warm sockets and cached features of serial."""
+        with self._lock:
+            socks = self._pool.pop(serial, [])
+            self._features.pop(serial, None)
+        for sock in socks:
+            sock.close()
+
+    def close(self):
+        with self._lock:
+            socks = [s for warm in self._pool.values() for s in warm]
+            self._pool.clear()
+        for sock in socks:
+            sock.close()
+
+
+client = AdbClient()
@@ -0,0 +1,376 @@
+"""
+Shared adb helpers.
+
+Shell commands are sent through a small per-device pool of long-lived
+`adb shell` sessions instead of spawning a new adb process for every call.
+Each command is framed with sentinel lines that carry its exit code, so
+stdout and stderr can be demultiplexed back into one result per command.
+
+ADB_BACKEND selects how commands reach the device:
+  session    - pooled persistent `adb shell` processes (default)
+  native     - speak the adb server protocol directly (see adb_client)
+  subprocess - one `adb` process per command
+
+Every call has a deadline chosen by its command kind (COMMAND_TIMEOUTS) and
+raises AdbTimeout when it passes. Transient transport errors (device
+offline, connection closed) are retried a few times with jittered backoff,
+and each device has a circuit breaker (see device_health) so a dead phone
+fails fast instead of holding up every caller.
+"""
+
+import atexit
+import itertools
+import os
+import queue
+import random
+import subprocess
+import threading
+import time
+import uuid
+
+import adb_client
+import device_health
+import metrics
+from adb_client import AdbTimeout
+from device_health import DeviceUnavailable
+
+DEVICE_CMD = "adb"
+
+# Set ADB_PERSISTENT_SHELL=0 to fall back to one adb process per command
+PERSISTENT_SHELL = os.environ.get("ADB_PERSISTENT_SHELL", "1") != "0"
+ADB_BACKEND = os.environ.get("ADB_BACKEND", "session" if PERSISTENT_SHELL else "subprocess")
+SESSIONS_PER_DEVICE = int(os.environ.get("ADB_SESSIONS_PER_DEVICE", 2))
+
+# How long to stop trying sessions for a device after one fails
+SESSION_RETRY_DELAY = 30
+
+# Deadline in seconds per command kind (see metrics.command_kind). Multi-line
+# scripts and dd write whole fill or clear batches, so they get the longest.
+# ADB_TIMEOUTS overrides single kinds, e.g. "du=300,df=5".
+COMMAND_TIMEOUTS = {
+    "devices": 10, "root": 30, "wait-for-device": 60,
+    "df": 15, "id": 15, "getprop": 15, "touch": 15, "stat": 30, "ls": 30,
+    "pm": 60, "cat": 60, "truncate": 60, "dumpsys": 60,
+    "du": 180, "find": 180, "rm": 300, "fallocate": 300,
+    "dd": 900, "tar": 900, "script": 900,
+}
+DEFAULT_TIMEOUT = 120
+for _item in filter(None, os.environ.get("ADB_TIMEOUTS", "").split(",")):
+    _kind, _, _seconds = _item.partition("=")
+    COMMAND_TIMEOUTS[_kind.strip()] = float(_seconds)
+
+# Transport errors worth retrying; anything else is the command's own result
+TRANSIENT_ERRORS = ("device offline", "error: closed", "protocol fault", "device still authorizing",
+                    "device still connecting", "connection reset", "no devices/emulators found")
+RETRIES = int(os.environ.get("ADB_RETRIES", 2))
+RETRY_BASE_DELAY = 0.25
+PROBE_TIMEOUT = 5
+
+# adb host commands that do not talk to a device
+HOST_COMMANDS = {"devices", "start-server", "kill-server"}
+
+
+class AdbSessionError(Exception):
+    """The shell session died or could not be used."""
+
+
+def command_timeout(command):
+    return COMMAND_TIMEOUTS.get(metrics.command_kind(command), DEFAULT_TIMEOUT)
+
+
+def is_transient(err):
+    err = (err or "").lower()
+    return any(pattern in err for pattern in TRANSIENT_ERRORS) or (
+        err.startswith("error: device") and "not found" in err)
+
+
+def adb_base(device):
+    return [DEVICE_CMD] + (["-s", device] if device else [])
+
+
+def shell_quote(text):
+    return "'" + text.replace("'", "'\\''") + "'"
+
+
+class ShellSession:
+    """One long-lived `adb shell` process running framed commands."""
+
+    def __init__(self, device):
+        self.device = device
+        self.proc = subprocess.Popen(
+            adb_base(device) + ["shell"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+            errors="replace",
+            bufsize=1,
+        )
+        self.merged_stderr = False
+        self._prefix = f"__CM_{uuid.uuid4().hex[:8]}"
+        self._ids = itertools.count()
+        self._stdout = queue.Queue()
+        self._stderr = queue.Queue()
+        for stream, lines in ((self.proc.stdout, self._stdout), (self.proc.stderr, self._stderr)):
+            reader = threading.Thread(target=self._read, args=(stream, lines))
+            reader.daemon = True
+            reader.start()
+
+    @staticmethod
+    def _read(stream, lines):
+        for line in stream:
+            lines.put(line.rstrip("\n"))
+        lines.put(None)
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def run(self, command, timeout=None):
+        """Run command in a subshell and return (stdout, stderr, exit_code)."""
+        deadline = time.time() + timeout if timeout else None
+        marker = f"{self._prefix}_{next(self._ids)}"
+        # The command runs in its own `sh -c` so an `exit` or syntax error
+        # cannot take the session down. The stderr marker is written first so
+        # devices without shell protocol v2 (stderr merged into stdout) can be
+        # detected while reading stdout.
+        script = (
+            f"sh -c {shell_quote(command)} </dev/null\n"
+            f"__cm_rc=$?\n"
+            f"printf '\\n{marker}_E\\n' >&2\n"
+            f"printf '\\n{marker} %d\\n' $__cm_rc\n"
+        )
+        try:
+            self.proc.stdin.write(script)
+            self.proc.stdin.flush()
+        except (OSError, ValueError) as e:
+            raise AdbSessionError(str(e))
+
+        out_lines, exit_code = [], None
+        while exit_code is None:
+            line = self._next(self._stdout, deadline)
+            if line.startswith(marker + " "):
+                exit_code = int(line.split()[-1])
+            elif line == marker + "_E":
+                self.merged_stderr = True
+                if out_lines and out_lines[-1] == "":
+                    out_lines.pop()
+            else:
+                out_lines.append(line)
+
+        err_lines = []
+        if not self.merged_stderr:
+            while True:
+                line = self._next(self._stderr, deadline)
+                if line == marker + "_E":
+                    break
+                err_lines.append(line)
+        return "\n".join(out_lines), "\n".join(err_lines), exit_code
+
+    def _next(self, lines, deadline=None):
+        try:
+            line = lines.get(timeout=max(0.0, deadline - time.time()) if deadline else None)
+        except queue.Empty:
+            raise AdbTimeout(f"adb shell on '{self.device}' timed out")
+        if line is None:
+            lines.put(None)
+            raise AdbSessionError(f"adb shell session for '{self.device}' closed")
+        return line
+
+    def close(self):
+        try:
+            self.proc.stdin.close()
+        except OSError:
+            pass
+        try:
+            self.proc.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+
+    def kill(self):
+        """Drop a session whose command is still running."""
+        self.proc.kill()
+        self.proc.wait()
+
+
+class ShellPool:
+    """Per-device pool of ShellSession objects shared by all modules."""
+
+    def __init__(self, size=SESSIONS_PER_DEVICE):
+        self.size = max(1, size)
+        self._idle = {}
+        self._open = {}
+        self._disabled_until = {}
+        self._cond = threading.Condition()
+
+    def available(self, device):
+        return time.time() >= self._disabled_until.get(device, 0)
+
+    def _acquire(self, device, deadline=None):
+        with self._cond:
+            while True:
+                idle = self._idle.setdefault(device, [])
+                while idle:
+                    session = idle.pop()
+                    if session.alive():
+                        return session
+                    self._open[device] -= 1
+                if self._open.get(device, 0) < self.size:
+                    self._open[device] = self._open.get(device, 0) + 1
+                    break
+                if deadline and time.time() >= deadline:
+                    raise AdbTimeout(f"no free adb shell session for '{device}'")
+                self._cond.wait(timeout=max(0.0, deadline - time.time()) if deadline else None)
+        try:
+            return ShellSession(device)
+        except OSError as e:
+            self._discard(device)
+            raise AdbSessionError(str(e))
+
+    def _release(self, device, session):
+        with self._cond:
+            self._idle.setdefault(device, []).append(session)
+            self._cond.notify()
+
+    def _discard(self, device):
+        with self._cond:
+            self._open[device] = max(0, self._open.get(device, 1) - 1)
+            self._cond.notify()
+
+    def run(self, device, command, timeout=None):
+        deadline = time.time() + timeout if timeout else None
+        try:
+            session = self._acquire(device, deadline)
+        except AdbSessionError:
+            self._disabled_until[device] = time.time() + SESSION_RETRY_DELAY
+            raise
+        try:
+            result = session.run(command, max(0.001, deadline - time.time()) if deadline else None)
+        except AdbTimeout:
+            # The command is still running in it, so the session is lost
+            session.kill()
+            self._discard(device)
+            raise
+        except AdbSessionError:
+            session.close()
+            self._discard(device)
+            self._disabled_until[device] = time.time() + SESSION_RETRY_DELAY
+            raise
+        self._release(device, session)
+        return result
+
+    def close_device(self, device):
+        """Close the idle sessions of device, e.g. after adbd restarted."""
+        with self._cond:
+            sessions = self._idle.pop(device, [])
+            self._open[device] = max(0, self._open.get(device, 0) - len(sessions))
+            self._cond.notify_all()
+        for session in sessions:
+            session.close()
+
+    def close_all(self):
+        with self._cond:
+            sessions = [s for idle in self._idle.values() for s in idle]
+            self._idle.clear()
+            self._open.clear()
+        for session in sessions:
+            session.close()
+
+
+pool = ShellPool()
+atexit.register(pool.close_all)
+
+
+def run_adb(device, command, timeout=None):
+    """Run an adb command for device and return (stdout, stderr).
+
+    Raises AdbTimeout when the command's deadline (timeout, or its kind's
+    default) passes and DeviceUnavailable while the device's breaker is
+    open.
+    """
+    if command and command[0] in HOST_COMMANDS:
+        return _timed_run(device, command, timeout or command_timeout(command))[:2]
+
+    health = device_health.breaker(device)
+    if health.before_call():
+        try:
+            out, err, _ = _timed_run(device, ["shell", "echo", "ok"], PROBE_TIMEOUT)
+        except AdbTimeout as e:
+            out, err = "", str(e)
+        except Exception as e:
+            health.failure(e)
+            raise
+        if out != "ok":
+            health.failure(err or "no answer")
+            raise DeviceUnavailable(f"Device {device or 'default device'} did not answer the health probe: {err}")
+        health.success()
+    timeout = timeout or command_timeout(command)
+    for attempt in range(RETRIES + 1):
+        try:
+            out, err, exit_code = _timed_run(device, command, timeout)
+        except AdbTimeout as e:
+            health.failure(e)
+            raise
+        if not (exit_code != 0 and not out and is_transient(err)):
+            health.success()
+            return out, err
+        if attempt < RETRIES:
+            # Full jitter, so callers retrying a flapping device spread out
+            time.sleep(random.uniform(0, RETRY_BASE_DELAY * 2 ** attempt))
+            reset_device(device)
+    health.failure(err)
+    return out, err
+
+
+def _timed_run(device, command, timeout):
+    started = time.perf_counter()
+    try:
+        out, err, exit_code = _run_adb(device, command, timeout)
+    except AdbTimeout:
+        metrics.observe_adb(device, command, time.perf_counter() - started, False)
+        raise
+    metrics.observe_adb(device, command, time.perf_counter() - started,
+                        exit_code == 0 if exit_code is not None else not err)
+    return out, err, exit_code
+
+
+def _run_adb(device, command, timeout=None):
+    is_shell = len(command) > 1 and command[0] == "shell"
+    if is_shell and ADB_BACKEND == "native":
+        try:
+            out, err, exit_code = adb_client.client.shell(device, " ".join(command[1:]), timeout)
+            return out.strip(), err.strip(), exit_code
+        except AdbTimeout:
+            raise AdbTimeout(f"adb shell on '{device}' timed out after {timeout}s")
+        except (OSError, adb_client.AdbProtocolError) as e:
+            print(f"adb server protocol failed on {device or 'default device'}, falling back: {e}")
+    elif is_shell and ADB_BACKEND == "session" and pool.available(device):
+        try:
+            out, err, exit_code = pool.run(device, " ".join(command[1:]), timeout)
+            return out.strip(), err.strip(), exit_code
+        except AdbSessionError as e:
+            print(f"Shell session failed on {device or 'default device'}, falling back: {e}")
+    try:
+        result = subprocess.run(adb_base(device) + command, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise AdbTimeout(f"adb {command[0]} on '{device}' timed out after {timeout}s")
+    return result.stdout.strip(), result.stderr.strip(), result.returncode
+
+
+def reset_device(device):
+    """Drop pooled connections to device; needed after adbd restarts."""
+    pool.close_device(device)
+    adb_client.client.forget(device)
+
+
+def list_devices():
+    if ADB_BACKEND == "native":
+        try:
+            return [serial for serial, state in adb_client.client.devices() if state == "device"]
+        except (OSError, adb_client.AdbProtocolError) as e:
+            print(f"adb server protocol failed, falling back: {e}")
+    out, _ = run_adb("", ["devices"])
+    devices = []
+    for line in out.splitlines()[1:]:
+        if line.strip() and "device" in line:
+            devices.append(line.split()[0])
+    return devices
@@ -1,24 +1,111 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, g, Response, stream_with_context
 from flask_socketio import SocketIO, emit
 import subprocess
 import threading
 import time
 import os
 import json
+import random
+import heapq
+import functools
 from datetime import datetime
 
+def socketio_async_mode():
+    """eventlet when run.py monkey patched the process for it, threads otherwise"""
+    mode = os.environ.get('SOCKETIO_ASYNC_MODE')
+    if mode:
+        return mode
+    try:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('socket'):
+            return 'eventlet'
+    except ImportError:
+        pass
+    # eventlet without monkey patching would block its hub on every adb call
+    return 'threading'
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'cache_manage_secret_key'
-socketio = SocketIO(app, cors_allowed_origins="*")
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=socketio_async_mode())
 
 # Import our existing modules
-from cache_fill import list_devices, fill_cache
-from calculate_cache import get_packages, get_cache_size, enable_root
-from storage_fill_clean import fill_storage, clean_storage, show_free_storage
+from cache_fill import fill_cache, fill_packages
+from calculate_cache import get_packages, get_cache_size, get_cache_sizes, enable_root, STREAM_FIRST_CHUNK_LEN
+from storage_fill_clean import fill_storage, fill_to_target, clean_storage, show_free_storage, parse_df, run_adb
+from multi_device import ALL_DEVICES, run_on_devices, device_slot
+from device import connected_devices as list_devices, get_device
+from package_index import index as package_index
+from cache_clear import clear_caches
+from cache_export import CacheExport, COMPRESSIONS, archive_name, backup_caches
+from cache_growth import GrowthSimulator, load_profile, profile_from_history, size_sampler
+from memory_monitor import MAX_PACKAGES, read_memory
+from jobs import JobManager
+from monitor_scheduler import MonitorScheduler
+from live_updates import LiveUpdates, FIELDS
+from timeseries import HistoryStore, resolutions as history_resolutions
+from cache_watch import CacheWatchRegistry
+from fill_engine import DEFAULT_STRATEGY, STRATEGIES
+from scan_index import ScanIndex
+from result_cache import ResultCache
+import device_health
+import metrics
+
+# Background jobs for long running requests sent with "async": true
+jobs = JobManager(emit=socketio.emit)
+
+# Read results shared by identical concurrent requests and reused for a few
+# seconds; anything that changes a device drops that device's results
+results = ResultCache()
+RESULT_TTLS = {
+    'devices': float(os.environ.get('DEVICES_CACHE_TTL', 2)),
+    'storage_free': float(os.environ.get('STORAGE_FREE_CACHE_TTL', 2)),
+    'calculate': float(os.environ.get('CALCULATE_CACHE_TTL', 10)),
+}
+
+def invalidates_results(func):
+    """Drop the device's cached read results around an operation that changes it"""
+    @functools.wraps(func)
+    def run(device, *args, **kwargs):
+        results.invalidate(device)
+        try:
+            return func(device, *args, **kwargs)
+        finally:
+            results.invalidate(device)
+    return run
 
-# Global variables to control monitoring
-monitoring_active = False
-cache_monitoring_active = False
+@app.before_request
+def start_request_metrics():
+    g.metrics_endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    g.metrics_started = time.perf_counter()
+    g.adb_summary = metrics.RequestSummary()
+    g.metrics_tokens = (metrics.current_endpoint.set(g.metrics_endpoint),
+                        metrics.current_summary.set(g.adb_summary))
+
+@app.after_request
+def finish_request_metrics(response):
+    endpoint = g.get('metrics_endpoint')
+    if endpoint is None:
+        return response
+    summary = g.adb_summary
+    metrics.http_requests.inc(endpoint, str(response.status_code))
+    metrics.http_seconds.observe(time.perf_counter() - g.metrics_started, endpoint)
+    metrics.request_adb_calls.observe(summary.calls, endpoint)
+    metrics.request_adb_seconds.observe(summary.seconds, endpoint)
+    response.headers['X-Adb-Calls'] = str(summary.calls)
+    response.headers['X-Adb-Time'] = f'{summary.seconds:.3f}'
+    return response
+
+@app.teardown_request
+def reset_request_metrics(exc=None):
+    tokens = g.pop('metrics_tokens', None)
+    if tokens:
+        metrics.current_endpoint.reset(tokens[0])
+        metrics.current_summary.reset(tokens[1])
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """adb, request and monitor metrics in the Prometheus text format"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
 def index():
@@ -28,11 +115,104 @@ def index():
 def get_devices():
     """Get list of connected devices"""
     try:
-        devices = list_devices()
-        return jsonify({'success': True, 'devices': devices})
+        devices = results.get(('devices',), None, RESULT_TTLS['devices'], list_devices)
+        # Devices whose breaker is open may have dropped off the list; keep reporting them
+        health = device_health.health()
+        health.update(device_health.health(devices))
+        return jsonify({'success': True, 'devices': devices, 'health': health})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def target_result(device, func, *args, **kwargs):
+    """Run func for one device, or for every connected device when device is 'all'."""
+    if device != ALL_DEVICES:
+        outcome = run_on_devices(func, [device], *args, **kwargs)[device]
+        if not outcome['success']:
+            return {'success': False, 'error': outcome['error']}
+        return outcome['result']
+    
+    devices = list_devices()
+    if not devices:
+        return {'success': False, 'error': 'No devices connected'}
+    
+    per_device = {}
+    for dev, outcome in run_on_devices(func, devices, *args, **kwargs).items():
+        body = outcome['result'] if outcome['success'] else {'success': False, 'error': outcome['error']}
+        body['elapsed_s'] = outcome['elapsed_s']
+        per_device[dev] = body
+    
+    return {
+        'success': any(body['success'] for body in per_device.values()),
+        'device_count': len(devices),
+        'results': per_device
+    }
+
+def shared_target_result(name, device, func, *args):
+    """target_result, shared with identical requests for the TTL of name"""
+    return results.get((name,) + args, device, RESULT_TTLS[name],
+                       lambda: target_result(device, func, *args),
+                       cacheable=lambda result: result.get('success'))
+
+def run_for_target(device, func, *args, cache=None):
+    """Respond with func's result, or with a job id when the request asks for async.
+    
+    With cache (a RESULT_TTLS name), synchronous results are shared through
+    the result cache.
+    """
+    data = request.get_json(silent=True) or {}
+    if data.get('async'):
+        job = jobs.submit(request.path, target_result, device, func, *args, params=data)
+        return jsonify({'success': True, 'job_id': job.id, 'status': job.status})
+    if cache:
+        return jsonify(shared_target_result(cache, device, func, *args))
+    return jsonify(target_result(device, func, *args))
+
+def optional_user(data, device=None):
+    """Android user id from the request, or None for every user.
+    
+    With device, a user that does not exist on it (on any device for "all")
+    raises ValueError instead of sizing nothing.
+    """
+    user = data.get('user')
+    if user in (None, ''):
+        return None
+    user = int(user)
+    if device:
+        for serial in (list_devices() if device == ALL_DEVICES else [device]):
+            if user not in get_device(serial).users():
+                raise ValueError(f'Android user {user} does not exist on {serial}')
+    return user
+
+@invalidates_results
+def fill_cache_for_device(device, package_count, file_size_mb, keyword, strategy, user=0, progress=None):
+    # Get packages with keyword filter
+    all_packages = get_packages(keyword, device) if keyword else get_packages('.', device)
+    
+    if not all_packages:
+        return {'success': False, 'error': f'No packages found matching keyword "{keyword}"'}
+    
+    # Select random packages from filtered list
+    selected_packages = random.sample(all_packages, min(package_count, len(all_packages)))
+    
+    # Fill cache for selected packages, several files per shell call
+    report = fill_packages(device, selected_packages, file_size_mb, strategy, progress, user)
+    filled_count = len(report['filled_packages'])
+    
+    message = f'Cache filled for {filled_count} packages'
+    if keyword:
+        message += f' (filtered by keyword: "{keyword}")'
+    
+    return {
+        'success': True, 
+        'message': message,
+        'filled_count': filled_count,
+        'total_filtered_packages': len(all_packages),
+        'keyword_used': keyword,
+        'user': user,
+        'strategy': strategy,
+        'mb_per_s': report['mb_per_s']
+    }
+
 @app.route('/api/cache/fill', methods=['POST'])
 def api_fill_cache():
     """Fill cache for selected packages"""
@@ -42,104 +222,277 @@ def api_fill_cache():
         package_count = int(data.get('package_count', 10))
         file_size_mb = int(data.get('file_size_mb', 5))
         keyword = data.get('keyword', '')
+        strategy = data.get('strategy', DEFAULT_STRATEGY)
+        user = optional_user(data, device) or 0
         
         if not device:
             return jsonify({'success': False, 'error': 'Device not specified'})
+        if strategy not in STRATEGIES:
+            return jsonify({'success': False, 'error': f'Unknown strategy "{strategy}"'})
         
-        # Get packages with keyword filter
-        from calculate_cache import get_packages
-        all_packages = get_packages(keyword) if keyword else get_packages('.')
-        
-        if not all_packages:
-            return jsonify({'success': False, 'error': f'No packages found matching keyword "{keyword}"'})
-        
-        # Select random packages from filtered list
-        import random
-        selected_packages = random.sample(all_packages, min(package_count, len(all_packages)))
-        
-        # Fill cache for selected packages
-        from cache_fill import create_file_in_cache
-        filled_count = 0
-        
-        for package in selected_packages:
-            try:
-                create_file_in_cache(device, package, file_size_mb)
-                filled_count += 1
-            except Exception as e:
-                print(f"Failed to fill cache for {package}: {e}")
-        
-        message = f'Cache filled for {filled_count} packages'
-        if keyword:
-            message += f' (filtered by keyword: "{keyword}")'
+        return run_for_target(device, fill_cache_for_device, package_count, file_size_mb, keyword, strategy, user)
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@invalidates_results
+def grow_cache_for_device(device, packages, package_filter, package_count, rate_mb_s, duration_s, profile,
+                          sizes, strategy, user=0, min_free_mb=None, progress=None):
+    if not packages:
+        candidates = get_packages(package_filter or '.', device)
+        packages = random.sample(candidates, min(package_count, len(candidates)))
+    if not packages:
+        return {'success': False, 'error': 'No packages found to grow'}
+    
+    simulator = GrowthSimulator(device, packages, rate_mb_s, duration_s, profile, sizes, strategy, user, min_free_mb)
+    
+    def report(figures):
+        # Live figures go out as the job's progress item
+        if progress:
+            progress(device, int(figures['elapsed_s']), int(duration_s), figures)
+    
+    summary = simulator.run(report)
+    summary['success'] = True
+    return summary
+
+@app.route('/api/cache/grow', methods=['POST'])
+def api_grow_cache():
+    """Grow caches at a target rate for a while, as a background job
+    
+    rate_mb_s is shared by the packages; profile ([[offset_s, mb_per_s], ...])
+    or replay ({package, start, end} of a recorded cache monitor) vary it
+    over time instead. Live figures arrive as job_progress events.
+    """
+    try:
+        data = request.get_json()
+        device = data.get('device')
+        duration_s = float(data.get('duration_s', 60))
+        sizes = data.get('sizes', 'fixed:1m')
+        strategy = data.get('strategy', DEFAULT_STRATEGY)
+        rate_mb_s = float(data['rate_mb_s']) if data.get('rate_mb_s') is not None else None
+        min_free_mb = float(data['min_free_mb']) if data.get('min_free_mb') is not None else None
         
-        return jsonify({
-            'success': True, 
-            'message': message,
-            'filled_count': filled_count,
-            'total_filtered_packages': len(all_packages),
-            'keyword_used': keyword
-        })
+        if not device:
+            return jsonify({'success': False, 'error': 'Device not specified'})
+        if strategy not in STRATEGIES:
+            return jsonify({'success': False, 'error': f'Unknown strategy "{strategy}"'})
+        size_sampler(sizes)
+        
+        profile = load_profile(data['profile']) if data.get('profile') else None
+        replay = data.get('replay')
+        if replay:
+            start = float(replay.get('start', 0))
+            if start < 0:
+                start = time.time() + start
+            _, columns = history.query(replay.get('device', device), history_metric('cache', replay.get('package')),
+                                       int(start), int(replay.get('end', time.time())))
+            if columns is None:
+                return jsonify({'success': False, 'error': 'No history recorded for the replayed package'})
+            profile = profile_from_history(columns)
+        if rate_mb_s is None and not profile:
+            return jsonify({'success': False, 'error': 'Specify rate_mb_s, profile or replay'})
+        
+        job = jobs.submit(request.path, target_result, device, grow_cache_for_device,
+                          data.get('packages'), data.get('package_filter', ''), int(data.get('package_count', 5)),
+                          rate_mb_s, duration_s, profile, sizes, strategy, optional_user(data, device) or 0, min_free_mb,
+                          per_device_slot=False, params=data)
+        return jsonify({'success': True, 'job_id': job.id, 'status': job.status})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+# Last known cache sizes; calculate only re-sizes packages whose cache changed
+scan_index = ScanIndex()
+
+def package_size_entry(pkg, size_kb):
+    return {
+        'package': pkg,
+        'size_kb': size_kb,
+        'size_mb': round(size_kb / 1024, 2)
+    }
+
+def calculate_cache_for_device(device, package_filter, user=None, full=False, top_n=None, progress=None):
+    enable_root(device)
+    packages = get_packages(package_filter, device)
+    
+    if not packages:
+        return {'success': False, 'error': f'No packages found containing "{package_filter}"'}
+    
+    sizes, scan_stats = scan_index.scan(device, packages, user, progress, full)
+    total_size = sum(sizes.values())
+    
+    # Sort by size (descending); with top_n only the largest are kept
+    if top_n:
+        largest = heapq.nlargest(top_n, sizes.items(), key=lambda item: item[1])
+    else:
+        largest = sorted(sizes.items(), key=lambda item: item[1], reverse=True)
+    package_sizes = [package_size_entry(pkg, size_kb) for pkg, size_kb in largest]
+    
+    return {
+        'success': True,
+        'packages': package_sizes,
+        'total_size_kb': total_size,
+        'total_size_mb': round(total_size / 1024, 2),
+        'package_count': len(packages),
+        'rescanned_count': scan_stats['rescanned'],
+        'reused_count': scan_stats['reused']
+    }
+
+def calculate_cache_events(device, package_filter, user=None, full=False, top_n=None):
+    """Yield lists of result events, one list per device round trip.
+    
+    Packages answered from the scan index come first, then every du chunk
+    as soon as it returns; the first chunk is kept small so results start
+    after one round trip. With top_n only packages entering the current top
+    n are sent. Every list ends with a progress event carrying the running
+    total; the last event is the summary.
+    """
+    with device_slot(device):
+        enable_root(device)
+        packages = get_packages(package_filter, device)
+        if not packages:
+            yield [{'type': 'error', 'error': f'No packages found containing "{package_filter}"'}]
+            return
+        yield [{'type': 'start', 'device': device, 'package_count': len(packages)}]
+        
+        heap, total_size, done = [], 0, 0
+        for chunk, reused in scan_index.scan_iter(device, packages, user, full, STREAM_FIRST_CHUNK_LEN):
+            events = []
+            for pkg, size_kb in chunk.items():
+                total_size += size_kb
+                done += 1
+                if top_n:
+                    if len(heap) < top_n:
+                        heapq.heappush(heap, (size_kb, pkg))
+                    elif size_kb > heap[0][0]:
+                        heapq.heappushpop(heap, (size_kb, pkg))
+                    else:
+                        continue
+                event = package_size_entry(pkg, size_kb)
+                event.update({'type': 'package', 'from_index': reused})
+                events.append(event)
+            events.append({'type': 'progress', 'done': done, 'total_size_kb': total_size})
+            yield events
+        
+        summary = {
+            'type': 'summary',
+            'success': True,
+            'device': device,
+            'total_size_kb': total_size,
+            'total_size_mb': round(total_size / 1024, 2),
+            'package_count': len(packages)
+        }
+        if top_n:
+            summary['packages'] = [package_size_entry(pkg, size_kb) for size_kb, pkg in sorted(heap, reverse=True)]
+        yield [summary]
+
+def ndjson_stream(events):
+    try:
+        for batch in events:
+            yield ''.join(json.dumps(event) + '\n' for event in batch)
+    except Exception as e:
+        yield json.dumps({'type': 'error', 'error': str(e)}) + '\n'
+
 @app.route('/api/cache/calculate', methods=['POST'])
 def api_calculate_cache():
-    """Calculate cache sizes for packages"""
+    """Calculate cache sizes for packages
+    
+    top_n keeps only the largest packages in the response. With
+    "stream": true the results come back as NDJSON lines while the scan
+    runs (single device only).
+    """
     try:
         data = request.get_json()
+        device = data.get('device') or ''
         package_filter = data.get('package_filter', '.')
         
-        enable_root()
-        packages = get_packages(package_filter)
-        
-        if not packages:
-            return jsonify({'success': False, 'error': f'No packages found containing "{package_filter}"'})
-        
-        package_sizes = []
-        total_size = 0
-        
-        for pkg in packages:
-            size_kb = get_cache_size(pkg)
-            total_size += size_kb
-            package_sizes.append({
-                'package': pkg,
-                'size_kb': size_kb,
-                'size_mb': round(size_kb / 1024, 2)
-            })
+        full = bool(data.get('full', False))
+        top_n = int(data['top_n']) if data.get('top_n') else None
         
-        # Sort by size (descending)
-        package_sizes.sort(key=lambda x: x['size_kb'], reverse=True)
+        if data.get('stream'):
+            if device == ALL_DEVICES:
+                return jsonify({'success': False, 'error': 'Streaming works on a single device'})
+            events = calculate_cache_events(device, package_filter, optional_user(data, device), full, top_n)
+            return Response(stream_with_context(ndjson_stream(events)), mimetype='application/x-ndjson')
         
-        return jsonify({
-            'success': True,
-            'packages': package_sizes,
-            'total_size_kb': total_size,
-            'total_size_mb': round(total_size / 1024, 2),
-            'package_count': len(packages)
-        })
+        # full asks for a fresh scan, so it never reuses a shared result
+        return run_for_target(device, calculate_cache_for_device, package_filter, optional_user(data, device), full, top_n,
+                              cache=None if full else 'calculate')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@invalidates_results
+def fill_storage_for_device(device, size_mb, count, strategy, progress=None):
+    report = fill_storage(device, size_mb, strategy, count, progress)
+    if report['failed'] and not report['written']:
+        return {'success': False, 'error': f'Could not write any of the {count} fill file(s)'}
+    written = len(report['written'])
+    total_mb = size_mb * written
+    return {
+        'success': True,
+        'message': f'Storage filled with {written} file(s) x {size_mb}MB = {total_mb}MB',
+        'failed_count': len(report['failed']),
+        'strategy': strategy,
+        'mb_per_s': report['mb_per_s']
+    }
+
+@invalidates_results
+def fill_storage_to_target_for_device(device, target_free_mb, target_percent, strategy, progress=None):
+    report = fill_to_target(device, target_free_mb, target_percent, strategy, progress)
+    written_mb = round(report['bytes'] / (1024 * 1024), 2)
+    before = storage_info(*report['before'])
+    after = storage_info(*report['after'])
+    result = {
+        'success': report['reached'],
+        'message': f'Wrote {written_mb}MB, free storage {before["free_mb"]}MB -> {after["free_mb"]}MB',
+        'written_mb': written_mb,
+        'corrections': report['corrections'],
+        'before': before,
+        'after': after,
+        'strategy': strategy,
+        'mb_per_s': report['mb_per_s']
+    }
+    if not report['reached']:
+        result['error'] = f'Target of {round(report["target_free_kb"] / 1024, 2)}MB free not reached'
+    return result
+
 @app.route('/api/storage/fill', methods=['POST'])
 def api_fill_storage():
-    """Fill device storage"""
+    """Fill device storage
+
+    Either size_mb x count, or a target: target_free_mb (MB left free) or
+    target_percent (percent of storage used).
+    """
     try:
         data = request.get_json()
         device = data.get('device')
         size_mb = int(data.get('size_mb', 100))
         count = int(data.get('count', 1))
+        strategy = data.get('strategy', DEFAULT_STRATEGY)
+        target_free_mb = data.get('target_free_mb')
+        target_percent = data.get('target_percent')
         
         if not device:
             return jsonify({'success': False, 'error': 'Device not specified'})
+        if strategy not in STRATEGIES:
+            return jsonify({'success': False, 'error': f'Unknown strategy "{strategy}"'})
+        
+        if target_free_mb is not None or target_percent is not None:
+            if target_percent is not None and not 0 <= float(target_percent) <= 100:
+                return jsonify({'success': False, 'error': 'target_percent must be between 0 and 100'})
+            if target_free_mb is not None and float(target_free_mb) < 0:
+                return jsonify({'success': False, 'error': 'target_free_mb must not be negative'})
+            return run_for_target(device, fill_storage_to_target_for_device,
+                                  target_free_mb, target_percent, strategy)
         
         count = max(1, min(count, 100))
-        for _ in range(count):
-            fill_storage(device, size_mb)
-        total_mb = size_mb * count
-        return jsonify({'success': True, 'message': f'Storage filled with {count} file(s) x {size_mb}MB = {total_mb}MB'})
+        return run_for_target(device, fill_storage_for_device, size_mb, count, strategy)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@invalidates_results
+def clean_storage_for_device(device, progress=None):
+    clean_storage(device)
+    return {'success': True, 'message': 'Storage cleaned successfully'}
+
 @app.route('/api/storage/clean', methods=['POST'])
 def api_clean_storage():
     """Clean fill files from storage"""
@@ -150,11 +503,37 @@ def api_clean_storage():
         if not device:
             return jsonify({'success': False, 'error': 'Device not specified'})
         
-        clean_storage(device)
-        return jsonify({'success': True, 'message': 'Storage cleaned successfully'})
+        return run_for_target(device, clean_storage_for_device)
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def storage_info(total_kb, used_kb, free_kb):
+    return {
+        'total_kb': total_kb,
+        'used_kb': used_kb,
+        'free_kb': free_kb,
+        'total_mb': round(total_kb / 1024, 2),
+        'used_mb': round(used_kb / 1024, 2),
+        'free_mb': round(free_kb / 1024, 2),
+        'usage_percent': round((used_kb / total_kb) * 100, 2)
+    }
+
+def free_storage_for_device(device, progress=None):
+    out, err = run_adb(device, ["shell", "df", "/sdcard"])
+    
+    if err:
+        return {'success': False, 'error': err}
+    
+    parsed = parse_df(out)
+    if parsed:
+        return {
+            'success': True,
+            'storage': storage_info(*parsed),
+            'raw_output': out
+        }
+    
+    return {'success': False, 'error': 'Could not parse storage information'}
+
 @app.route('/api/storage/free', methods=['POST'])
 def api_get_free_storage():
     """Get free storage information"""
@@ -165,41 +544,90 @@ def api_get_free_storage():
         if not device:
             return jsonify({'success': False, 'error': 'Device not specified'})
         
-        # Get storage info using our existing function
-        from storage_fill_clean import run_adb
-        out, err = run_adb(device, ["shell", "df", "/sdcard"])
-        
-        if err:
-            return jsonify({'success': False, 'error': err})
-        
-        # Parse the output
-        lines = out.strip().split('\n')
-        if len(lines) >= 2:
-            # Second line contains the actual data
-            data_line = lines[1].split()
-            if len(data_line) >= 4:
-                total_kb = int(data_line[1])
-                used_kb = int(data_line[2])
-                free_kb = int(data_line[3])
-                
-                return jsonify({
-                    'success': True,
-                    'storage': {
-                        'total_kb': total_kb,
-                        'used_kb': used_kb,
-                        'free_kb': free_kb,
-                        'total_mb': round(total_kb / 1024, 2),
-                        'used_mb': round(used_kb / 1024, 2),
-                        'free_mb': round(free_kb / 1024, 2),
-                        'usage_percent': round((used_kb / total_kb) * 100, 2)
-                    },
-                    'raw_output': out
-                })
-        
-        return jsonify({'success': False, 'error': 'Could not parse storage information'})
+        return run_for_target(device, free_storage_for_device, cache='storage_free')
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+def backup_before_clear(device, packages, min_cache_mb, max_cache_mb, user):
+    """Archive the caches that are about to be cleared; returns (packages, manifest)"""
+    if min_cache_mb is not None or max_cache_mb is not None:
+        sizes = get_cache_sizes(packages, device, user=user)
+        min_kb = float(min_cache_mb) * 1024 if min_cache_mb is not None else None
+        max_kb = float(max_cache_mb) * 1024 if max_cache_mb is not None else None
+        packages = [pkg for pkg in packages
+                    if (min_kb is None or sizes.get(pkg, 0) >= min_kb)
+                    and (max_kb is None or sizes.get(pkg, 0) <= max_kb)]
+    return packages, backup_caches(device, packages, user)
+
+@invalidates_results
+def clear_all_cache_for_device(device, include_filter, exclude_filter, min_cache_mb, max_cache_mb, user=None,
+                               backup=False, progress=None):
+    # Enable root access
+    enable_root(device)
+    
+    # Get all packages, applying include/exclude name filters
+    packages = package_index.filter(device, include=include_filter, exclude=exclude_filter)
+    
+    if not packages:
+        return {'success': False, 'error': 'No packages found after applying filters'}
+    
+    # Opt-in: archive the caches first and clear nothing if that fails
+    backup_manifest = None
+    if backup:
+        try:
+            packages, backup_manifest = backup_before_clear(device, packages, min_cache_mb, max_cache_mb, user)
+        except Exception as e:
+            return {'success': False, 'error': f'Backup failed, nothing was cleared: {e}'}
+        if not packages:
+            return {'success': False, 'error': 'No packages left after applying size filters'}
+    
+    # Size the caches, apply the size filters and clear them on the device
+    # with one script per chunk of packages
+    report = clear_caches(device, packages, min_cache_mb, max_cache_mb, progress, user)
+    
+    cleared_count = len(report['cleared'])
+    failed_packages = [f"{package}: {reason}" for package, reason in report['failed']]
+    skipped_packages = []
+    for package, size_kb in report['skipped']:
+        size_mb = size_kb / 1024.0
+        if min_cache_mb is not None and size_mb < float(min_cache_mb):
+            skipped_packages.append(f"{package} (size {round(size_mb,2)} MB < min {min_cache_mb} MB)")
+        else:
+            skipped_packages.append(f"{package} (size {round(size_mb,2)} MB > max {max_cache_mb} MB)")
+    
+    result_message = f"Cache cleared for {cleared_count} applications"
+    if failed_packages:
+        result_message += f". Failed for {len(failed_packages)} applications"
+    if skipped_packages:
+        result_message += f". Skipped {len(skipped_packages)} applications by filters"
+    
+    result = {
+        'success': True,
+        'message': result_message,
+        'cleared_count': cleared_count,
+        'total_packages': len(packages),
+        'failed_packages': failed_packages[:10],  # Limit to first 10 failures
+        'skipped_packages': skipped_packages[:10],
+        'freed_kb': report['freed_kb'],
+        'freed_mb': round(report['freed_kb'] / 1024, 2),
+        'filters': {
+            'include_filter': include_filter,
+            'exclude_filter': exclude_filter,
+            'min_cache_mb': min_cache_mb,
+            'max_cache_mb': max_cache_mb,
+            'user': user
+        }
+    }
+    if backup_manifest:
+        result['backup'] = {
+            'path': backup_manifest['path'],
+            'files': backup_manifest['files'],
+            'bytes': backup_manifest['bytes'],
+            'archive_bytes': backup_manifest['archive_bytes'],
+            'mb_per_s': backup_manifest['mb_per_s']
+        }
+    return result
+
 @app.route('/api/cache/clear_all', methods=['POST'])
 def api_clear_all_cache():
     """Clear cache for all applications"""
@@ -214,155 +642,243 @@ def api_clear_all_cache():
         if not device:
             return jsonify({'success': False, 'error': 'Device not specified'})
         
-        # Enable root access
-        enable_root()
-        
-        # Get all packages
-        packages = get_packages('.')
-
-        # Apply include/exclude name filters
-        if include_filter:
-            packages = [p for p in packages if include_filter in p]
-        if exclude_filter:
-            packages = [p for p in packages if exclude_filter not in p]
-        
-        if not packages:
-            return jsonify({'success': False, 'error': 'No packages found after applying filters'})
-        
-        cleared_count = 0
-        failed_packages = []
-        skipped_packages = []
+        return run_for_target(device, clear_all_cache_for_device,
+                              include_filter, exclude_filter, min_cache_mb, max_cache_mb, optional_user(data, device),
+                              bool(data.get('backup', False)))
         
-        # Clear cache for each package
-        from storage_fill_clean import run_adb
-        
-        for package in packages:
-            try:
-                # Size-based filtering if requested
-                if min_cache_mb is not None or max_cache_mb is not None:
-                    size_kb = get_cache_size(package)
-                    size_mb = size_kb / 1024.0
-                    if min_cache_mb is not None and size_mb < float(min_cache_mb):
-                        skipped_packages.append(f"{package} (size {round(size_mb,2)} MB < min {min_cache_mb} MB)")
-                        continue
-                    if max_cache_mb is not None and size_mb > float(max_cache_mb):
-                        skipped_packages.append(f"{package} (size {round(size_mb,2)} MB > max {max_cache_mb} MB)")
-                        continue
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+def export_stream(export):
+    with device_slot(export.device):
+        yield from export
 
-                # Clear cache from both directories
-                cache_paths = [
-                    f"/data/data/{package}/cache",
-                    f"/data/user/0/{package}/cache"
-                ]
-                
-                for cache_path in cache_paths:
-                    # Remove all files in cache directory
-                    cmd = f"rm -rf {cache_path}/*"
-                    out, err = run_adb(device, ["shell", cmd])
-                    
-                    if err and "No such file or directory" not in err:
-                        print(f"Warning clearing {cache_path}: {err}")
-                
-                cleared_count += 1
-                
-            except Exception as e:
-                failed_packages.append(f"{package}: {str(e)}")
-                print(f"Failed to clear cache for {package}: {e}")
+@app.route('/api/cache/export', methods=['POST'])
+def api_export_cache():
+    """Download the caches of packages as one tar archive
+    
+    packages lists the packages, or package_filter selects them like
+    calculate. compression is "none" (default) or "gzip". The archive is
+    streamed while the device produces it and ends with MANIFEST.json.
+    """
+    try:
+        data = request.get_json()
+        device = data.get('device')
+        compression = data.get('compression', 'none')
         
-        result_message = f"Cache cleared for {cleared_count} applications"
-        if failed_packages:
-            result_message += f". Failed for {len(failed_packages)} applications"
-        if skipped_packages:
-            result_message += f". Skipped {len(skipped_packages)} applications by filters"
+        if not device or device == ALL_DEVICES:
+            return jsonify({'success': False, 'error': 'Device not specified'})
+        if compression not in COMPRESSIONS:
+            return jsonify({'success': False, 'error': f'Unknown compression "{compression}"'})
         
-        return jsonify({
-            'success': True,
-            'message': result_message,
-            'cleared_count': cleared_count,
-            'total_packages': len(packages),
-            'failed_packages': failed_packages[:10],  # Limit to first 10 failures
-            'skipped_packages': skipped_packages[:10],
-            'filters': {
-                'include_filter': include_filter,
-                'exclude_filter': exclude_filter,
-                'min_cache_mb': min_cache_mb,
-                'max_cache_mb': max_cache_mb
-            }
-        })
+        packages = data.get('packages') or get_packages(data.get('package_filter', '.'), device)
+        if not packages:
+            return jsonify({'success': False, 'error': 'No packages to export'})
         
+        export = CacheExport(device, packages, optional_user(data, device), compression)
+        name = archive_name(device, compression)
+        return Response(stream_with_context(export_stream(export)),
+                        mimetype='application/gzip' if compression == 'gzip' else 'application/x-tar',
+                        headers={'Content-Disposition': f'attachment; filename="{name}"'})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/jobs')
+def api_list_jobs():
+    """List background jobs, newest first"""
+    return jsonify({'success': True, 'jobs': [job.to_dict() for job in jobs.list()]})
+
+@app.route('/api/jobs/<job_id>')
+def api_get_job(job_id):
+    """Get status, progress and result of a background job"""
+    job = jobs.get(job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """Cancel a queued or running background job"""
+    if not jobs.cancel(job_id):
+        return jsonify({'success': False, 'error': 'Job not found or already finished'})
+    return jsonify({'success': True, 'message': 'Cancellation requested'})
+
+def history_metric(metric, package=None):
+    return f'{metric}:{package}' if package else metric
+
+def sample_storage(device, package=None):
+    out, err = run_adb(device, ["shell", "df", "/sdcard"])
+    parsed = parse_df(out) if not err and out else None
+    if not parsed:
+        return None
+    history.record(device, 'storage', time.time(), parsed[2])
+    storage_data = {'timestamp': datetime.now().isoformat()}
+    storage_data.update(storage_info(*parsed))
+    return storage_data
+
+def cache_payload(device, package_name, size_kb):
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'package_name': package_name,
+        'size_kb': size_kb,
+        'size_mb': round(size_kb / 1024, 2),
+        'device': device
+    }
+
+def sample_cache(device, package_name):
+    size_kb = get_cache_size(package_name, device, user=0)
+    history.record(device, history_metric('cache', package_name), time.time(), size_kb)
+    return cache_payload(device, package_name, size_kb)
+
+# Monitor samples, memory-mapped under HISTORY_DIR when it is set
+history = HistoryStore(os.environ.get('HISTORY_DIR'))
+
+# Monitor samples go to one Socket.IO room per target, batched and compact
+live = LiveUpdates(socketio)
+
+def emit_cache_size(device, package_name, size_kb, sids):
+    history.record(device, history_metric('cache', package_name), time.time(), size_kb)
+    live.publish('cache', device, package_name, cache_payload(device, package_name, size_kb))
+
+def sample_memory(device, packages=None):
+    """Memory and PSI of device; packages is a comma separated list whose RSS to add"""
+    names = packages.split(',') if packages else []
+    sample = read_memory(device, names)
+    if not sample:
+        return None
+    history.record(device, 'memory', time.time(), sample['available_kb'])
+    memory_data = {'timestamp': datetime.now().isoformat(), 'device': device, 'packages': names}
+    memory_data.update(sample)
+    return memory_data
+
+# Event-driven cache monitors (mode "watch"), one watcher per device/package
+cache_watches = CacheWatchRegistry(on_size=emit_cache_size)
+
+# One shared poller for every client's monitors
+monitors = MonitorScheduler(emit=socketio.emit, live=live)
+monitors.register('storage', sample_storage, 'storage_update', 'monitoring_error')
+monitors.register('cache', sample_cache, 'cache_update', 'cache_monitoring_error')
+monitors.register('memory', sample_memory, 'memory_update', 'monitoring_error')
+
+@app.route('/api/history')
+def api_history():
+    """Recorded monitor samples in columnar form.
+    
+    metric=storage returns free KB of /sdcard, metric=memory available RAM
+    in KB, metric=cache&package=... the package's cache size in KB. Raw samples come back as t/v columns,
+    downsampled ones as t/min/max/avg.
+    """
+    device = request.args.get('device')
+    metric = request.args.get('metric', 'storage')
+    package = request.args.get('package')
+    resolution = request.args.get('resolution', 'auto')
+    
+    if not device:
+        return jsonify({'success': False, 'error': 'Device not specified'})
+    if resolution != 'auto' and resolution not in history_resolutions():
+        return jsonify({'success': False, 'error': f'Unknown resolution "{resolution}"'})
+    
+    start = request.args.get('start', 0, type=int)
+    end = request.args.get('end', int(time.time()), type=int)
+    resolution, columns = history.query(device, history_metric(metric, package), start, end, resolution)
+    if columns is None:
+        return jsonify({'success': False, 'error': 'No history recorded for this target'})
+    
+    return jsonify({
+        'success': True,
+        'device': device,
+        'metric': metric,
+        'package': package,
+        'resolution': resolution,
+        'columns': columns
+    })
+
+@app.route('/api/cache/trends')
+def api_cache_trends():
+    """Packages whose cache grew the most, from the calculate scan index
+    
+    Without since, growth is what each package's latest scan changed; with
+    since (epoch seconds, or negative for seconds ago) it is the growth since
+    that time.
+    """
+    device = request.args.get('device')
+    since = request.args.get('since', type=float)
+    limit = request.args.get('limit', 10, type=int)
+    
+    if not device:
+        return jsonify({'success': False, 'error': 'Device not specified'})
+    if since is not None and since < 0:
+        since = time.time() + since
+    
+    user = optional_user(request.args)
+    growers = scan_index.trends(device, user, since, limit)
+    return jsonify({
+        'success': True,
+        'device': device,
+        'since': since,
+        'total_growth_kb': sum(g['growth_kb'] for g in growers),
+        'packages': growers
+    })
+
+@app.route('/api/monitors')
+def api_monitors():
+    """List the targets currently being polled"""
+    return jsonify({
+        'success': True,
+        'monitors': monitors.targets(),
+        'watchers': cache_watches.watchers(),
+        'delivery': live.stats()
+    })
+
 @socketio.on('connect')
 def handle_connect():
     print('Client connected')
 
 @socketio.on('disconnect')
 def handle_disconnect():
-    global monitoring_active, cache_monitoring_active
-    monitoring_active = False
-    cache_monitoring_active = False
+    monitors.unsubscribe(request.sid)
+    cache_watches.unsubscribe(request.sid)
+    live.leave(request.sid)
     print('Client disconnected')
 
 @socketio.on('start_monitoring')
 def handle_start_monitoring(data):
-    global monitoring_active
     device = data.get('device')
     if not device:
         emit('monitoring_error', {'error': 'Device not specified'})
         return
     
-    monitoring_active = True
-    
-    def monitor_storage():
-        while monitoring_active:
-            try:
-                from storage_fill_clean import run_adb
-                out, err = run_adb(device, ["shell", "df", "/sdcard"])
-                
-                if not err and out:
-                    lines = out.strip().split('\n')
-                    if len(lines) >= 2:
-                        data_line = lines[1].split()
-                        if len(data_line) >= 4:
-                            total_kb = int(data_line[1])
-                            used_kb = int(data_line[2])
-                            free_kb = int(data_line[3])
-                            
-                            storage_data = {
-                                'timestamp': datetime.now().isoformat(),
-                                'total_kb': total_kb,
-                                'used_kb': used_kb,
-                                'free_kb': free_kb,
-                                'total_mb': round(total_kb / 1024, 2),
-                                'used_mb': round(used_kb / 1024, 2),
-                                'free_mb': round(free_kb / 1024, 2),
-                                'usage_percent': round((used_kb / total_kb) * 100, 2)
-                            }
-                            
-                            socketio.emit('storage_update', storage_data)
-            except Exception as e:
-                socketio.emit('monitoring_error', {'error': str(e)})
-                break
-            
-            time.sleep(2)  # Update every 2 seconds
-    
-    # Start monitoring in a separate thread
-    monitor_thread = threading.Thread(target=monitor_storage)
-    monitor_thread.daemon = True
-    monitor_thread.start()
-    
-    emit('monitoring_started', {'message': 'Storage monitoring started'})
+    # Join the room first: the first sample is published as soon as it is taken
+    live.join(request.sid, 'storage', device)
+    monitors.subscribe(request.sid, device, 'storage')
+    started = {'message': 'Storage monitoring started', 'fields': FIELDS['storage']}
+    
+    # memory: true adds RAM and memory pressure, plus the RSS of up to
+    # MAX_PACKAGES packages, sampled alongside storage
+    if data.get('memory'):
+        packages = data.get('packages') or []
+        if isinstance(packages, str):
+            packages = [p.strip() for p in packages.split(',') if p.strip()]
+        packages = packages[:MAX_PACKAGES]
+        key = ','.join(packages) or None
+        live.join(request.sid, 'memory', device, key)
+        monitors.subscribe(request.sid, device, 'memory', key)
+        started.update({'message': 'Storage and memory monitoring started',
+                        'memory_fields': FIELDS['memory'], 'packages': packages})
+    else:
+        monitors.unsubscribe(request.sid, 'memory')
+        live.leave(request.sid, 'memory')
+    emit('monitoring_started', started)
 
 @socketio.on('stop_monitoring')
 def handle_stop_monitoring():
-    global monitoring_active
-    monitoring_active = False
+    for metric in ('storage', 'memory'):
+        monitors.unsubscribe(request.sid, metric)
+        live.leave(request.sid, metric)
     emit('monitoring_stopped', {'message': 'Storage monitoring stopped'})
 
 @socketio.on('start_cache_monitoring')
 def handle_start_cache_monitoring(data):
-    global cache_monitoring_active
     device = data.get('device')
     package_name = data.get('package_name')
     
@@ -374,45 +890,70 @@ def handle_start_cache_monitoring(data):
         emit('cache_monitoring_error', {'error': 'Package name not specified'})
         return
     
-    cache_monitoring_active = True
-    
-    def monitor_cache():
-        while cache_monitoring_active:
-            try:
-                # Enable root access for cache monitoring
-                enable_root()
-                
-                # Get cache size for the specific package
-                size_kb = get_cache_size(package_name)
-                size_mb = round(size_kb / 1024, 2)
-                
-                cache_data = {
-                    'timestamp': datetime.now().isoformat(),
-                    'package_name': package_name,
-                    'size_kb': size_kb,
-                    'size_mb': size_mb,
-                    'device': device
-                }
-                
-                socketio.emit('cache_update', cache_data)
-                
-            except Exception as e:
-                socketio.emit('cache_monitoring_error', {'error': str(e)})
-                break
-            
-            time.sleep(2)  # Update every 2 seconds
-    
-    # Start monitoring in a separate thread
-    monitor_thread = threading.Thread(target=monitor_cache)
-    monitor_thread.daemon = True
-    monitor_thread.start()
-    
-    emit('cache_monitoring_started', {'message': f'Cache monitoring started for {package_name}'})
+    # Enable root access for cache monitoring
+    enable_root(device)
+    
+    # "watch" follows file changes on the device instead of re-running du;
+    # "inotify" and "delta" (find -newer) force one of its two strategies
+    mode = data.get('mode', 'du')
+    watch_modes = {'watch': 'auto', 'inotify': 'inotify', 'delta': 'poll'}
+    # Join the room first: a watcher publishes its initial size only once
+    live.join(request.sid, 'cache', device, package_name)
+    if mode in watch_modes:
+        monitors.unsubscribe(request.sid, 'cache')
+        try:
+            watcher = cache_watches.subscribe(request.sid, device, package_name, watch_modes[mode])
+        except Exception as e:
+            live.leave(request.sid, 'cache')
+            emit('cache_monitoring_error', {'error': str(e)})
+            return
+        message = f'Cache monitoring started for {package_name} ({watcher.mode} mode)'
+    else:
+        cache_watches.unsubscribe(request.sid)
+        monitors.subscribe(request.sid, device, 'cache', package_name)
+        message = f'Cache monitoring started for {package_name}'
+    emit('cache_monitoring_started', {'message': message, 'fields': FIELDS['cache']})
+
+@socketio.on('monitor_ack')
+def handle_monitor_ack(seq=None):
+    live.ack(request.sid)
+
+@socketio.on('calculate_cache')
+def handle_calculate_cache(data):
+    """Stream calculate results to this client as cache_calculate_result events"""
+    device = data.get('device')
+    if not device or device == ALL_DEVICES:
+        emit('cache_calculate_result', {'events': [{'type': 'error', 'error': 'Device not specified'}]})
+        return
+    
+    sid = request.sid
+    top_n = int(data['top_n']) if data.get('top_n') else None
+    try:
+        user = optional_user(data, device)
+    except ValueError as e:
+        emit('cache_calculate_result', {'device': device, 'events': [{'type': 'error', 'error': str(e)}]})
+        return
+    events = calculate_cache_events(device, data.get('package_filter', '.'), user,
+                                    bool(data.get('full', False)), top_n)
+    
+    def run():
+        metrics.current_endpoint.set('socket:calculate_cache')
+        try:
+            for batch in events:
+                socketio.emit('cache_calculate_result', {'device': device, 'events': batch}, to=sid)
+        except Exception as e:
+            socketio.emit('cache_calculate_result',
+                          {'device': device, 'events': [{'type': 'error', 'error': str(e)}]}, to=sid)
+    
+    thread = threading.Thread(target=run, name=f'calculate-{device}')
+    thread.daemon = True
+    thread.start()
 
 @socketio.on('stop_cache_monitoring')
 def handle_stop_cache_monitoring():
-    global cache_monitoring_active
-    cache_monitoring_active = False
+    monitors.unsubscribe(request.sid, 'cache')
+    cache_watches.unsubscribe(request.sid)
+    live.leave(request.sid, 'cache')
     emit('cache_monitoring_stopped', {'message': 'Cache monitoring stopped'})
 
 if __name__ == '__main__':
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Benchmark the panel against simulated devices (see fake_adb.py).
+
+Every scenario runs one /api endpoint, CLI or socket monitor against the
+fake devices (in order, so later scenarios see the caches and files left by
+earlier ones) and records its wall time, the adb calls it issued and the
+bytes sent to and read from the devices. Results can be saved as a baseline
+and later runs compared against it; a scenario that got slower than the
+threshold, or issues more adb calls, is reported as a regression and makes
+the script exit with status 1.
+
+    python benchmark.py --save baseline.json
+    python benchmark.py --compare baseline.json --threshold 20
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import fake_adb
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Changes below these are noise, not regressions
+MIN_TIME_DELTA = 0.05
+MONITOR_UPDATES = 3
+MONITOR_TIMEOUT = 30
+
+
+def api(client, path, body=None):
+    def call():
+        response = client.post(path, json=body) if body is not None else client.get(path)
+        result = response.get_json()
+        if not result.get('success'):
+            raise RuntimeError(f"{path} failed: {result.get('error')}")
+    return call
+
+
+def cli(*args):
+    def call():
+        result = subprocess.run([sys.executable] + list(args), cwd=HERE, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"{' '.join(args)} failed: {result.stderr.strip()[-200:]}")
+    return call
+
+
+def monitor(app_module, metric, start, data):
+    def call():
+        client = app_module.socketio.test_client(app_module.app)
+        try:
+            client.emit(start, data)
+            updates, deadline = 0, time.time() + MONITOR_TIMEOUT
+            while updates < MONITOR_UPDATES:
+                if time.time() > deadline:
+                    raise RuntimeError(f"only {updates} {metric} updates in {MONITOR_TIMEOUT}s")
+                for message in client.get_received():
+                    if message['name'].endswith('_error'):
+                        raise RuntimeError(message['args'][0].get('error'))
+                    if message['name'] == 'monitor_batch':
+                        frame = message['args'][0]
+                        updates += sum(1 for update in frame['u'] if update[0] == metric)
+                        client.emit('monitor_ack', frame['seq'])
+                time.sleep(0.02)
+        finally:
+            client.disconnect()
+    return call
+
+
+def scenarios(app_module, devices, package):
+    """[(name, callable)] in the order they run; later ones see earlier state."""
+    client = app_module.app.test_client()
+    device = devices[0]
+    return [
+        ("api_devices", api(client, '/api/devices')),
+        ("api_calculate", api(client, '/api/cache/calculate', {'device': device})),
+        ("api_calculate_all", api(client, '/api/cache/calculate', {'device': 'all'})),
+        ("api_fill_cache", api(client, '/api/cache/fill',
+                               {'device': device, 'package_count': 20, 'file_size_mb': 1})),
+        ("api_clear_all", api(client, '/api/cache/clear_all', {'device': device})),
+        ("api_storage_free", api(client, '/api/storage/free', {'device': device})),
+        ("api_storage_fill", api(client, '/api/storage/fill',
+                                 {'device': device, 'size_mb': 4, 'count': 5})),
+        ("api_storage_clean", api(client, '/api/storage/clean', {'device': device})),
+        ("cli_calculate", cli("calculate_cache.py", "-s", device)),
+        ("cli_cache_fill", cli("cache_fill.py", "fill", "10", "1")),
+        ("cli_storage_fill", cli("storage_fill_clean.py", "fill", "4")),
+        ("cli_storage_clean", cli("storage_fill_clean.py", "clean")),
+        ("monitor_storage", monitor(app_module, 'storage', 'start_monitoring', {'device': device})),
+        ("monitor_cache", monitor(app_module, 'cache', 'start_cache_monitoring',
+                                  {'device': device, 'package_name': package})),
+    ]
+
+
+def measure(home, func, repeat):
+    runs = []
+    for _ in range(repeat):
+        fake_adb.reset_calls(home)
+        started = time.perf_counter()
+        func()
+        wall = time.perf_counter() - started
+        runs.append(dict(fake_adb.read_calls(home), wall_s=wall))
+    return {
+        'wall_s': round(statistics.median(r['wall_s'] for r in runs), 4),
+        'adb_calls': statistics.median_low(r['calls'] for r in runs),
+        'bytes_sent': statistics.median_low(r['bytes_sent'] for r in runs),
+        'bytes_received': statistics.median_low(r['bytes_received'] for r in runs),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Return the names of scenarios that regressed against baseline."""
+    regressions = []
+    print(f"\n📊 Compared with baseline (threshold {threshold}%):\n")
+    print(f"{'scenario':<20} {'wall s':>9} {'base s':>9} {'change':>8} {'calls':>7} {'base':>6}")
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            print(f"{name:<20} {result['wall_s']:>9.3f} {'-':>9} {'new':>8}")
+            continue
+        change = (result['wall_s'] - base['wall_s']) / base['wall_s'] * 100 if base['wall_s'] else 0.0
+        slower = change > threshold and result['wall_s'] - base['wall_s'] > MIN_TIME_DELTA
+        more_calls = result['adb_calls'] > base['adb_calls']
+        mark = "❌" if slower or more_calls else "✅"
+        if slower or more_calls:
+            regressions.append(name)
+        print(f"{name:<20} {result['wall_s']:>9.3f} {base['wall_s']:>9.3f} {change:>7.1f}% "
+              f"{result['adb_calls']:>7} {base['adb_calls']:>6} {mark}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cache panel against simulated devices")
+    parser.add_argument("--devices", type=int, default=2, help="Number of fake devices (default: 2)")
+    parser.add_argument("--packages", type=int, default=200, help="Packages per fake device (default: 200)")
+    parser.add_argument("--latency", type=float, default=0.01,
+                        help="Seconds added to every adb call (default: 0.01)")
+    parser.add_argument("--capacity-mb", type=int, default=8192, help="Fake storage size (default: 8192)")
+    parser.add_argument("--backend", choices=["session", "subprocess", "native"], default="session",
+                        help="ADB_BACKEND to benchmark (default: session)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario; the median is kept")
+    parser.add_argument("--only", action="append", help="Run only this scenario (repeatable)")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Compare with a JSON file written by --save")
+    parser.add_argument("--threshold", type=float, default=20,
+                        help="Percent slowdown counted as a regression (default: 20)")
+    args = parser.parse_args()
+
+    home = tempfile.mkdtemp(prefix="cache-bench-")
+    bin_dir = fake_adb.setup(home, args.devices, args.packages, args.capacity_mb, args.latency)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ.get("PATH", "")
+    os.environ["ADB_BACKEND"] = args.backend
+    if args.backend == "native":
+        os.environ["ANDROID_ADB_SERVER_PORT"] = str(fake_adb.serve(home))
+    os.environ.setdefault("MONITOR_INTERVAL", "0.2")
+    config = fake_adb.load_config(home)
+    print(f"🧪 {args.devices} fake device(s), {args.packages} packages, {args.latency}s latency, "
+          f"{args.backend} backend, work dir {home}")
+
+    import app as app_module
+
+    results, failed = {}, []
+    for name, func in scenarios(app_module, config['devices'], "com.fake.app0001"):
+        if args.only and name not in args.only:
+            continue
+        try:
+            results[name] = measure(home, func, args.repeat)
+        except Exception as e:
+            print(f"❌ {name}: {e}")
+            failed.append(name)
+            continue
+        r = results[name]
+        print(f"⏱️  {name:<20} {r['wall_s']:>8.3f}s {r['adb_calls']:>6} adb calls "
+              f"{r['bytes_sent']:>9} B sent {r['bytes_received']:>9} B received")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+        print(f"\n💾 Results saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ Regressions: {', '.join(regressions)}")
+            sys.exit(1)
+        print("\n✅ No regressions")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
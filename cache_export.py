@@ -0,0 +1,350 @@
+#!/usr/bin/env python3
+"""
+Export package caches as one tar stream.
+
+`adb pull` copies file by file with a round trip each, which crawls on
+caches made of thousands of small files. Here the device runs a single
+`tar -c` over every requested cache directory and the archive comes back
+through `adb exec-out` (binary-safe, no pty). It is passed on in
+CHUNK_SIZE buffers, to a file or an HTTP response, and is never held in
+memory as a whole. It can be gzip-compressed on the fly on the host.
+
+While the stream passes through, the tar headers are read to build a
+manifest (path, size and mtime of every entry, totals per package). The
+manifest is appended to the archive as MANIFEST.json, and its totals are
+returned.
+
+    python cache_export.py -s <serial> -o caches.tar.gz --gzip com.example.app ...
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import tarfile
+import threading
+import time
+import zlib
+from datetime import datetime
+
+import adb_client
+import device_health
+import metrics
+from adb_shell import ADB_BACKEND, AdbTimeout, adb_base, shell_quote
+from calculate_cache import MAX_SHELL_CMD_LEN, chunk_args
+from device import get_device
+
+CHUNK_SIZE = 1024 * 1024
+BLOCK = 512
+# Abort when the device sends nothing for this long
+IDLE_TIMEOUT = float(os.environ.get("EXPORT_IDLE_TIMEOUT", 60))
+GZIP_LEVEL = 1
+DATA_ROOT = "/data"
+MANIFEST_NAME = "MANIFEST.json"
+# Path list for tar -T when the directories do not fit on one command line
+LIST_FILE = "/data/local/tmp/.cm_export_list"
+BACKUP_DIR = os.environ.get("CACHE_BACKUP_DIR") or os.path.join(
+    os.path.expanduser("~"), ".cache_panel", "backups")
+COMPRESSIONS = ("none", "gzip")
+
+
+class TarIndex:
+    """Reads tar headers from a byte stream as it passes through.
+
+    feed() returns the bytes of a chunk that belong to archive members; the
+    end-of-archive blocks are left out so more members can be appended. A
+    header block split across chunks is held back until it is complete, so
+    the first zero block is never passed on, wherever the chunks end.
+    """
+
+    def __init__(self):
+        self.entries = []
+        self.ended = False
+        self._header = b""
+        self._skip = 0
+        self._capture = None
+        self._long_name = None
+
+    def feed(self, data):
+        kept = []
+        pos = 0
+        while pos < len(data) and not self.ended:
+            if self._skip:
+                step = min(self._skip, len(data) - pos)
+                if self._capture is not None:
+                    self._capture += data[pos:pos + step]
+                kept.append(data[pos:pos + step])
+                self._skip -= step
+                pos += step
+                if not self._skip and self._capture is not None:
+                    self._long_name, self._capture = self._capture, None
+                continue
+            step = min(BLOCK - len(self._header), len(data) - pos)
+            self._header += data[pos:pos + step]
+            pos += step
+            if len(self._header) == BLOCK:
+                header, self._header = self._header, b""
+                if header == bytes(BLOCK):
+                    self.ended = True
+                    break
+                kept.append(header)
+                self._parse(header)
+        return b"".join(kept)
+
+    def _parse(self, header):
+        name = header[0:100].split(b"\0", 1)[0]
+        prefix = header[345:500].split(b"\0", 1)[0] if header[257:262] == b"ustar" else b""
+        size = int(header[124:136].split(b"\0", 1)[0].strip() or b"0", 8)
+        kind = header[156:157]
+        self._skip = (size + BLOCK - 1) // BLOCK * BLOCK
+        if kind in (b"L", b"x"):
+            # GNU long name or pax header for the next member
+            self._capture = b""
+            return
+        if self._long_name is not None:
+            name = _long_name(self._long_name)
+            prefix, self._long_name = b"", None
+        path = (prefix + b"/" + name if prefix else name).decode("utf-8", "replace")
+        if path.startswith("./"):
+            path = path[2:]
+        self.entries.append({
+            'path': f"{DATA_ROOT}/{path}".rstrip("/"),
+            'type': "dir" if kind == b"5" else "file" if kind in (b"0", b"\0") else "other",
+            'size': size if kind in (b"0", b"\0") else 0,
+            'mtime': int(header[136:148].split(b"\0", 1)[0].strip() or b"0", 8)
+        })
+
+
+def package_of(path):
+    """Package owning a cache path under /data/data or /data/user/<N>."""
+    parts = path[len(DATA_ROOT) + 1:].split("/")
+    if len(parts) > 1 and parts[0] == "data":
+        return parts[1]
+    if len(parts) > 2 and parts[0] == "user":
+        return parts[2]
+    return None
+
+
+def _long_name(data):
+    """Name from a GNU long-name block or a pax `path=` record."""
+    if b" path=" in data:
+        return data.split(b" path=", 1)[1].split(b"\n", 1)[0]
+    return data.split(b"\0", 1)[0]
+
+
+class _ExecOut:
+    """Binary exec-out stream with an idle timeout."""
+
+    def __init__(self, device, command):
+        self.device = device
+        self._sock = self._proc = None
+        if ADB_BACKEND == "native":
+            try:
+                self._sock = adb_client.client.exec_out(device, command, IDLE_TIMEOUT)
+                self._sock.settimeout(IDLE_TIMEOUT)
+                return
+            except (OSError, adb_client.AdbProtocolError) as e:
+                print(f"adb server protocol failed on {device or 'default device'}, falling back: {e}")
+        self._proc = subprocess.Popen(adb_base(device) + ["exec-out", command],
+                                      stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        self._last_read = time.time()
+        self.timed_out = False
+        watchdog = threading.Thread(target=self._watch)
+        watchdog.daemon = True
+        watchdog.start()
+
+    def _watch(self):
+        while self._proc.poll() is None:
+            if time.time() - self._last_read > IDLE_TIMEOUT:
+                self.timed_out = True
+                self._proc.kill()
+                return
+            time.sleep(1)
+
+    def read(self, size):
+        if self._sock is not None:
+            try:
+                return self._sock.recv(size)
+            except socket.timeout:
+                raise AdbTimeout(f"tar stream from '{self.device}' stalled for {IDLE_TIMEOUT}s")
+        data = self._proc.stdout.read1(size)
+        self._last_read = time.time()
+        if not data and self.timed_out:
+            raise AdbTimeout(f"tar stream from '{self.device}' stalled for {IDLE_TIMEOUT}s")
+        return data
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+        elif self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+
+class CacheExport:
+    """One tar stream of the caches of packages on device.
+
+    Iterate it for the archive's bytes; afterwards manifest holds the
+    per-package totals. compression is "none" or "gzip".
+    """
+
+    def __init__(self, device, packages, user=None, compression="none", progress=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError(f'Unknown compression "{compression}"')
+        self.device = device
+        self.packages = list(packages)
+        self.user = user
+        self.compression = compression
+        self.progress = progress
+        self.manifest = None
+
+    def _existing_dirs(self):
+        """Cache directories that exist, so tar does not fail on missing ones."""
+        dev = get_device(self.device)
+        dev.ensure_root()
+        dirs = [d for pkg in self.packages for d in dev.cache_dirs(pkg, self.user)]
+        found = []
+        for chunk in chunk_args(dirs, base_len=100):
+            out = dev.shell(f"for d in {' '.join(chunk)}; do [ -d \"$d\" ] && echo \"$d\"; done")
+            found.extend(line.strip() for line in out.splitlines() if line.strip())
+        return found
+
+    def __iter__(self):
+        started = time.time()
+        dirs = self._existing_dirs()
+        index = TarIndex()
+        gzip = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31) if self.compression == "gzip" else None
+        raw_bytes, sent = 0, 0
+
+        def out(data):
+            return gzip.compress(data) if gzip else data
+
+        if dirs:
+            stream = _ExecOut(self.device, self._tar_command(dirs))
+            health = device_health.breaker(self.device)
+            reported, current = 0, None
+            try:
+                while not index.ended:
+                    data = stream.read(CHUNK_SIZE)
+                    if not data:
+                        break
+                    raw_bytes += len(data)
+                    chunk = out(index.feed(data))
+                    if chunk:
+                        sent += len(chunk)
+                        yield chunk
+                    for entry in index.entries[reported:]:
+                        pkg = package_of(entry['path'])
+                        if self.progress and pkg != current and pkg in self.packages:
+                            current = pkg
+                            self.progress(self.device, self.packages.index(pkg) + 1, len(self.packages), pkg)
+                    reported = len(index.entries)
+            except AdbTimeout as e:
+                health.failure(e)
+                raise
+            finally:
+                stream.close()
+                metrics.observe_adb(self.device, ["exec-out", "tar"], time.time() - started, index.ended)
+            if not index.ended:
+                raise RuntimeError(f"tar stream from '{self.device}' ended early after {raw_bytes} bytes")
+            health.success()
+
+        self.manifest = self._build_manifest(index.entries, dirs, raw_bytes, time.time() - started)
+        tail = _manifest_member(self.manifest, index.entries)
+        chunk = out(tail) + (gzip.flush() if gzip else b"")
+        sent += len(chunk)
+        yield chunk
+        self.manifest['archive_bytes'] = sent
+
+    def _tar_command(self, dirs):
+        relative = [d[len(DATA_ROOT) + 1:] for d in dirs]
+        args = " ".join(shell_quote(path) for path in relative)
+        if len(args) < MAX_SHELL_CMD_LEN - 100:
+            return f"tar -cf - -C {DATA_ROOT} {args} 2>/dev/null"
+        dev = get_device(self.device)
+        dev.shell(f"rm -f {LIST_FILE}")
+        for chunk in chunk_args(relative, base_len=len(LIST_FILE) + 20):
+            dev.shell(f"printf '%s\\n' {' '.join(chunk)} >> {LIST_FILE}")
+        return f"tar -cf - -C {DATA_ROOT} -T {LIST_FILE} 2>/dev/null"
+
+    def _build_manifest(self, entries, dirs, raw_bytes, seconds):
+        packages = {pkg: {'files': 0, 'bytes': 0} for pkg in self.packages}
+        for entry in entries:
+            totals = packages.get(package_of(entry['path']))
+            if totals is not None and entry['type'] == "file":
+                totals['files'] += 1
+                totals['bytes'] += entry['size']
+        return {
+            'device': self.device,
+            'created': datetime.now().isoformat(),
+            'user': self.user,
+            'compression': self.compression,
+            'directories': dirs,
+            'packages': packages,
+            'files': sum(p['files'] for p in packages.values()),
+            'bytes': sum(p['bytes'] for p in packages.values()),
+            'tar_bytes': raw_bytes,
+            'seconds': round(seconds, 3),
+            'mb_per_s': round(raw_bytes / (1024 * 1024) / seconds, 2) if seconds > 0 else 0.0
+        }
+
+    def save(self, path):
+        """Write the archive to path and return the manifest."""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        partial = path + ".part"
+        try:
+            with open(partial, "wb") as f:
+                for chunk in self:
+                    f.write(chunk)
+            os.replace(partial, path)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        self.manifest['path'] = path
+        return self.manifest
+
+
+def _manifest_member(manifest, entries):
+    """MANIFEST.json as a tar member, followed by the end-of-archive blocks."""
+    data = json.dumps(dict(manifest, entries=entries), indent=1).encode()
+    info = tarfile.TarInfo(MANIFEST_NAME)
+    info.size = len(data)
+    info.mtime = int(time.time())
+    padding = (BLOCK - len(data) % BLOCK) % BLOCK
+    return info.tobuf(tarfile.GNU_FORMAT) + data + bytes(padding) + bytes(2 * BLOCK)
+
+
+def archive_name(device, compression="none"):
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    return f"cache-{device or 'device'}-{stamp}.tar" + (".gz" if compression == "gzip" else "")
+
+
+def backup_caches(device, packages, user=None, progress=None):
+    """Export packages' caches to a gzip archive under BACKUP_DIR; return its manifest."""
+    export = CacheExport(device, packages, user, "gzip", progress)
+    return export.save(os.path.join(BACKUP_DIR, archive_name(device, "gzip")))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export package caches from a device as one tar archive")
+    parser.add_argument("packages", nargs="+", help="Packages whose cache to export")
+    parser.add_argument("-s", "--device", default="",
+                        help="Device serial (default: the only connected device)")
+    parser.add_argument("-o", "--output", help="Archive path (default: cache-<device>-<time>.tar[.gz])")
+    parser.add_argument("-z", "--gzip", action="store_true", help="Compress the archive with gzip")
+    parser.add_argument("-u", "--user", type=int, help="Android user id (default: every user)")
+    args = parser.parse_args()
+
+    compression = "gzip" if args.gzip else "none"
+    path = args.output or archive_name(args.device, compression)
+    print(f"📦 Exporting the cache of {len(args.packages)} package(s) to {path}...")
+    manifest = CacheExport(args.device, args.packages, args.user, compression).save(path)
+    print(f"✅ {manifest['files']} files, {round(manifest['bytes'] / (1024 * 1024), 2)} MB "
+          f"in {manifest['seconds']}s ({manifest['mb_per_s']} MB/s)")
+    for pkg, totals in manifest['packages'].items():
+        print(f"  {pkg}: {totals['files']} files, {round(totals['bytes'] / 1024, 2)} KB")
+
+
+if __name__ == "__main__":
+    main()
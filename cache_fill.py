@@ -1,10 +1,13 @@
 import os
 import random
 import string
-import subprocess
 import sys
 
-DEVICE_CMD = "adb"
+from adb_shell import list_devices
+from device import get_device
+from multi_device import run_on_devices, print_device_summary
+from package_index import index as package_index
+from fill_engine import DEFAULT_STRATEGY, STRATEGIES, fill_files
 
 FILL_FILE_PREFIX = "fillfile_"
 
@@ -12,55 +15,47 @@ FILL_FILE_PREFIX = "fillfile_"
 DEFAULT_FILE_SIZE_MB = 5
 DEFAULT_PACKAGE_COUNT = 10
 
-def run_adb(device, command):
-    full_cmd = [DEVICE_CMD, "-s", device] + command
-    result = subprocess.run(full_cmd, capture_output=True, text=True)
-    return result.stdout.strip(), result.stderr.strip()
-
-def list_devices():
-    out, _ = run_adb("", ["devices"])
-    devices = []
-    for line in out.splitlines()[1:]:
-        if line.strip() and "device" in line:
-            devices.append(line.split()[0])
-    return devices
-
 def list_packages(device):
-    out, _ = run_adb(device, ["shell", "pm", "list", "packages"])
-    return [line.replace("package:", "").strip() for line in out.splitlines()]
+    return package_index.packages(device)
 
 def generate_random_name():
     return FILL_FILE_PREFIX + "".join(random.choices(string.ascii_lowercase + string.digits, k=6))
 
-def create_file_in_cache(device, package, size_mb):
+def cache_file_path(device, package, file_name, user=0):
+    return f"{get_device(device).cache_dir(package, user)}/{file_name}"
+
+def fill_packages(device, packages, size_mb, strategy=DEFAULT_STRATEGY, progress=None, user=0):
+    """Write a fill file into the cache of every package, batching the writes."""
     size_bytes = size_mb * 1024 * 1024
-    file_name = generate_random_name()
-    file_paths = [
-        f"/data/data/{package}/cache/{file_name}",
-        f"/data/user/0/{package}/cache/{file_name}",
-    ]
-    for path in file_paths:
-        print(f"Creating {size_mb}MB file at {path} on {device}...")
-        cmd = f"dd if=/dev/zero of={path} bs={size_bytes} count=1"
-        out, err = run_adb(device, ["shell", cmd])
-        if err:
-            print(f"Error creating file in {package}: {err}")
-        else:
-            print(f"Created file {path} successfully.")
+    files, owners = [], {}
+    for package in packages:
+        path = cache_file_path(device, package, generate_random_name(), user)
+        files.append((path, size_bytes))
+        owners[path] = package
+    print(f"Creating {len(files)} x {size_mb}MB files on {device} ({strategy})...")
+    report = fill_files(device, files, strategy, progress)
+    for path in report['failed']:
+        print(f"Error creating file {path}")
+    report['filled_packages'] = sorted({owners[path] for path in report['written']})
+    print(f"Filled {len(report['filled_packages'])} packages on {device}: "
+          f"{report['bytes'] // (1024 * 1024)} MB at {report['mb_per_s']} MB/s")
+    return report
+
+def create_file_in_cache(device, package, size_mb, strategy=DEFAULT_STRATEGY):
+    return fill_packages(device, [package], size_mb, strategy)
 
-def fill_cache(device, package_count, file_size_mb):
+def fill_cache(device, package_count, file_size_mb, strategy=DEFAULT_STRATEGY):
     packages = list_packages(device)
     if not packages:
         print("No packages found.")
         return
     selected = random.sample(packages, min(package_count, len(packages)))
     print(f"Selected packages: {selected}")
-    for pkg in selected:
-        create_file_in_cache(device, pkg, file_size_mb)
+    return fill_packages(device, selected, file_size_mb, strategy)
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python cache_fill.py fill [package_count] [file_size_mb]")
+        print(f"Usage: python cache_fill.py fill [package_count] [file_size_mb] [{'|'.join(STRATEGIES)}]")
         sys.exit(1)
 
     action = sys.argv[1]
@@ -69,10 +64,11 @@ if __name__ == "__main__":
         print("No devices connected.")
         sys.exit(1)
 
-    for device in devices:
-        if action == "fill":
-            package_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PACKAGE_COUNT
-            file_size_mb = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_FILE_SIZE_MB
-            fill_cache(device, package_count, file_size_mb)
-        else:
-            print("Unknown action. Only 'fill' is supported.")
+    if action == "fill":
+        package_count = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_PACKAGE_COUNT
+        file_size_mb = int(sys.argv[3]) if len(sys.argv) > 3 else DEFAULT_FILE_SIZE_MB
+        strategy = sys.argv[4] if len(sys.argv) > 4 else DEFAULT_STRATEGY
+        results = run_on_devices(fill_cache, devices, package_count, file_size_mb, strategy)
+        print_device_summary(results)
+    else:
+        print("Unknown action. Only 'fill' is supported.")
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Sustained, rate-controlled cache growth.
+
+`fill_cache` writes one burst and stops; the OS cache trimmer reacts to
+pressure that keeps building. The simulator grows the caches of a set of
+packages at a target rate for a given time, either a fixed MB/s or a
+profile of rates over time (for example replayed from a recorded cache
+monitor).
+
+Each package draws from its own token bucket holding its share of the rate
+(at most BURST_SECONDS worth of tokens), so a slow or failing package does
+not starve the others. File sizes are drawn from a distribution:
+
+    fixed:1m              every file 1 MB
+    uniform:64k-4m        evenly between 64 KB and 4 MB
+    lognormal:256k:1.0    median 256 KB, sigma 1.0 (many small, some large)
+
+Every TICK the files the buckets allow, across all packages, are written by
+one shell script (see fill_engine), so the whole simulation uses a single
+device session. The device's slot (see multi_device) is only held for each
+of these writes, so other operations on the device keep running. Every REPORT_INTERVAL the target and achieved rates and the
+free space of /data are reported.
+
+    python cache_growth.py -s <serial> --rate 5 --duration 120 --sizes lognormal:256k:1 com.example.app ...
+"""
+
+import argparse
+import json
+import math
+import random
+import time
+
+from adb_shell import run_adb
+from cache_fill import cache_file_path, generate_random_name
+from fill_engine import DEFAULT_STRATEGY, STRATEGIES, fill_files
+from multi_device import device_slot
+from storage_fill_clean import parse_df
+
+TICK = 0.5
+REPORT_INTERVAL = 2.0
+BURST_SECONDS = 1.0
+
+# Upper bound of files per shell script, to keep each tick short
+MAX_FILES_PER_TICK = 200
+
+MB = 1024 * 1024
+UNITS = {"": 1, "b": 1, "k": 1024, "m": MB, "g": 1024 * MB}
+
+
+def parse_size(text):
+    """Bytes in "512", "64k", "4m" or "1g"."""
+    text = text.strip().lower()
+    unit = text[-1] if text and text[-1] in UNITS else ""
+    return int(float(text[:len(text) - len(unit)]) * UNITS[unit])
+
+
+def size_sampler(spec, rng=random):
+    """Function returning file sizes in bytes, drawn according to spec."""
+    kind, _, args = spec.partition(":")
+    try:
+        if kind == "fixed":
+            size = parse_size(args)
+            sampler = lambda: size
+        elif kind == "uniform":
+            low, high = (parse_size(part) for part in args.split("-"))
+            sampler = lambda: rng.randint(low, high)
+        elif kind == "lognormal":
+            median, _, sigma = args.partition(":")
+            mu, sigma = math.log(parse_size(median)), float(sigma or 1.0)
+            sampler = lambda: int(rng.lognormvariate(mu, sigma))
+        else:
+            raise ValueError(f"unknown distribution '{kind}'")
+    except ValueError as e:
+        raise ValueError(f"Bad size distribution '{spec}' ({e}); "
+                         f"use fixed:1m, uniform:64k-4m or lognormal:256k:1.0")
+    return lambda: max(1, sampler())
+
+
+def profile_from_history(columns):
+    """Growth profile [(offset_s, mb_per_s), ...] from recorded cache sizes.
+
+    columns are /api/history columns of a cache monitor: t with v (raw) or
+    avg (downsampled) in KB. Shrinking steps count as no growth.
+    """
+    ts = columns.get('t') or []
+    values = columns.get('v') or columns.get('avg') or []
+    profile = []
+    for i in range(1, len(ts)):
+        seconds = ts[i] - ts[i - 1]
+        if seconds > 0:
+            grown_kb = max(0, values[i] - values[i - 1])
+            profile.append((ts[i - 1] - ts[0], grown_kb / 1024 / seconds))
+    return profile
+
+
+def load_profile(data):
+    """Profile from [[offset_s, mb_per_s], ...] or from /api/history output."""
+    if isinstance(data, dict):
+        return profile_from_history(data.get('columns', data))
+    return sorted((float(offset), float(rate)) for offset, rate in data)
+
+
+def profile_rate(profile, elapsed):
+    """Rate of the profile step elapsed falls in; the profile repeats."""
+    if not profile:
+        return 0.0
+    span = profile[-1][0] + (profile[-1][0] - profile[-2][0] if len(profile) > 1 else 1)
+    offset = elapsed % span if span > 0 else 0
+    rate = profile[0][1]
+    for start, step_rate in profile:
+        if start > offset:
+            break
+        rate = step_rate
+    return rate
+
+
+class TokenBucket:
+    """Bytes per second with bursts of up to capacity bytes.
+
+    A file larger than the capacity may be taken once the bucket is full;
+    the bucket then goes into debt, so the long-run rate still holds.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, rate=None):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if rate is not None:
+            self.rate = rate
+            self.capacity = max(rate * BURST_SECONDS, 1)
+
+    def take(self, size):
+        if self.rate <= 0 or self.tokens < min(size, self.capacity):
+            return False
+        self.tokens -= size
+        return True
+
+
+class GrowthSimulator:
+    def __init__(self, device, packages, rate_mb_s=None, duration_s=60, profile=None,
+                 sizes="fixed:1m", strategy=DEFAULT_STRATEGY, user=0, min_free_mb=None,
+                 seed=None, tick=TICK, report_interval=REPORT_INTERVAL):
+        if not packages:
+            raise ValueError("No packages to grow")
+        if rate_mb_s is None and not profile:
+            raise ValueError("Either a rate or a profile is required")
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown fill strategy '{strategy}', use one of {', '.join(STRATEGIES)}")
+        self.device = device
+        self.packages = list(packages)
+        self.rate_mb_s = rate_mb_s
+        self.profile = profile
+        self.duration_s = duration_s
+        self.sizes = sizes
+        self.strategy = strategy
+        self.user = user
+        self.min_free_mb = min_free_mb
+        self.tick = tick
+        self.report_interval = report_interval
+        self.rng = random.Random(seed)
+        self.next_size = size_sampler(sizes, self.rng)
+
+    def target_rate(self, elapsed):
+        """Target MB/s at elapsed seconds into the run."""
+        if self.profile:
+            return profile_rate(self.profile, elapsed)
+        return self.rate_mb_s
+
+    def free_kb(self):
+        out, err = run_adb(self.device, ["shell", "df", "/data"])
+        parsed = parse_df(out) if out and not err else None
+        return parsed[2] if parsed else None
+
+    def run(self, report=None):
+        """Grow the caches until the duration is over; return the totals.
+
+        report(dict) is called every report_interval with the live figures.
+        """
+        buckets = {pkg: TokenBucket(0, 1) for pkg in self.packages}
+        pending = {pkg: self.next_size() for pkg in self.packages}
+        stats = {pkg: {'files': 0, 'bytes': 0, 'failed': 0} for pkg in self.packages}
+        written = failed = files_written = 0
+        target_bytes = 0.0
+        window_bytes, window_start = 0, time.monotonic()
+        free_kb = self.free_kb()
+        stop_reason = 'duration'
+
+        started = last_tick = time.monotonic()
+        next_report = started + self.report_interval
+        while True:
+            now = time.monotonic()
+            elapsed = now - started
+            if elapsed >= self.duration_s:
+                break
+            rate = self.target_rate(elapsed)
+            target_bytes += rate * MB * (now - last_tick)
+            last_tick = now
+
+            share = rate * MB / len(self.packages)
+            files, owners = [], {}
+            for pkg, bucket in buckets.items():
+                bucket.refill(share)
+                while len(files) < MAX_FILES_PER_TICK and bucket.take(pending[pkg]):
+                    path = cache_file_path(self.device, pkg, generate_random_name(), self.user)
+                    files.append((path, pending[pkg]))
+                    owners[path] = pkg
+                    pending[pkg] = self.next_size()
+
+            if files:
+                with device_slot(self.device):
+                    result = fill_files(self.device, files, self.strategy)
+                sizes = dict(files)
+                for path in result['written']:
+                    stats[owners[path]]['files'] += 1
+                    stats[owners[path]]['bytes'] += sizes[path]
+                for path in result['failed']:
+                    stats[owners[path]]['failed'] += 1
+                written += result['bytes']
+                window_bytes += result['bytes']
+                files_written += len(result['written'])
+                failed += len(result['failed'])
+
+            now = time.monotonic()
+            if now >= next_report:
+                free_kb = self.free_kb()
+                if report:
+                    report({
+                        'device': self.device,
+                        'elapsed_s': round(now - started, 1),
+                        'duration_s': self.duration_s,
+                        'target_mb_per_s': round(rate, 2),
+                        'achieved_mb_per_s': round(window_bytes / MB / (now - window_start), 2),
+                        'average_mb_per_s': round(written / MB / (now - started), 2),
+                        'written_mb': round(written / MB, 2),
+                        'behind_mb': round(max(0.0, target_bytes - written) / MB, 2),
+                        'files': files_written,
+                        'failed': failed,
+                        'free_kb': free_kb
+                    })
+                window_bytes, window_start = 0, now
+                next_report = now + self.report_interval
+                if self.min_free_mb is not None and free_kb is not None and free_kb < self.min_free_mb * 1024:
+                    stop_reason = 'min_free'
+                    break
+            if not files:
+                time.sleep(max(0.0, min(self.tick, next_report - now)))
+
+        seconds = time.monotonic() - started
+        return {
+            'device': self.device,
+            'seconds': round(seconds, 1),
+            'stop_reason': stop_reason,
+            'sizes': self.sizes,
+            'strategy': self.strategy,
+            'target_mb': round(target_bytes / MB, 2),
+            'written_mb': round(written / MB, 2),
+            'average_mb_per_s': round(written / MB / seconds, 2) if seconds else 0.0,
+            'target_average_mb_per_s': round(target_bytes / MB / seconds, 2) if seconds else 0.0,
+            'files': files_written,
+            'failed': failed,
+            'free_kb': self.free_kb(),
+            'packages': stats
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grow package caches at a controlled rate")
+    parser.add_argument("packages", nargs="+", help="Packages whose cache to grow")
+    parser.add_argument("-s", "--device", default="",
+                        help="Device serial (default: the only connected device)")
+    parser.add_argument("-r", "--rate", type=float, help="Target growth in MB/s, shared by the packages")
+    parser.add_argument("-p", "--profile",
+                        help="JSON file with [[offset_s, mb_per_s], ...] or saved /api/history output")
+    parser.add_argument("-d", "--duration", type=float, default=60, help="Seconds to run (default: 60)")
+    parser.add_argument("--sizes", default="fixed:1m", help="File size distribution (default: fixed:1m)")
+    parser.add_argument("--strategy", default=DEFAULT_STRATEGY, choices=STRATEGIES)
+    parser.add_argument("-u", "--user", type=int, default=0, help="Android user id (default: 0)")
+    parser.add_argument("--min-free-mb", type=float, help="Stop once /data has less free space")
+    parser.add_argument("--seed", type=int, help="Random seed for reproducible runs")
+    args = parser.parse_args()
+
+    profile = None
+    if args.profile:
+        with open(args.profile) as f:
+            profile = load_profile(json.load(f))
+    if args.rate is None and not profile:
+        parser.error("either --rate or --profile is required")
+
+    simulator = GrowthSimulator(args.device, args.packages, args.rate, args.duration, profile,
+                                args.sizes, args.strategy, args.user, args.min_free_mb, args.seed)
+
+    def report(r):
+        free = f"{round(r['free_kb'] / 1024)} MB free" if r['free_kb'] is not None else "free space unknown"
+        print(f"⏱️  {r['elapsed_s']:>6}s  target {r['target_mb_per_s']} MB/s  "
+              f"achieved {r['achieved_mb_per_s']} MB/s  written {r['written_mb']} MB  {free}")
+
+    print(f"📈 Growing the cache of {len(args.packages)} package(s) for {args.duration}s ({args.sizes})...")
+    summary = simulator.run(report)
+    print(f"✅ {summary['written_mb']} of {summary['target_mb']} MB in {summary['seconds']}s: "
+          f"{summary['average_mb_per_s']} MB/s (target {summary['target_average_mb_per_s']} MB/s), "
+          f"{summary['files']} files, {summary['failed']} failed, stopped by {summary['stop_reason']}")
+
+
+if __name__ == "__main__":
+    main()
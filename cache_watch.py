@@ -0,0 +1,316 @@
+"""
+Event-driven cache size monitor.
+
+Instead of re-running `du -s` over the whole cache every 2 seconds, the
+cache tree is listed once and then kept up to date incrementally:
+
+* inotify mode streams `inotifyd` events for the cache directory and its
+  subdirectories through one long-lived `adb shell`. After a short debounce
+  only the entries named in the events are re-stat'ed, in one adb call.
+* poll mode is the fallback for devices without `inotifyd` (or with too
+  many directories to watch). Each tick lists only the entries newer than a
+  stamp file on the device (`find -newer`), plus the current contents of
+  directories whose listing changed, so deletions are noticed too.
+
+Sizes are tracked per entry in allocated KB (stat %b * %B / 1024), which
+adds up to what `du -s` reports. on_size is called only when the total
+changes.
+"""
+
+import os
+import subprocess
+import threading
+import time
+
+from adb_shell import AdbTimeout, DeviceUnavailable, adb_base, run_adb, shell_quote
+from device import get_device
+import metrics
+
+# inotifyd events: w closed after write, n created, m moved in, d deleted,
+# y moved out, D watched directory itself deleted
+WATCH_EVENTS = "wnmdyD"
+DEBOUNCE = 0.3
+POLL_INTERVAL = 2
+MAX_WATCHED_DIRS = 256
+RESTART_DELAY = 2
+STAT_FORMAT = "%F|%b|%B|%n"
+STAMP_DIR = "/data/local/tmp"
+
+
+def stat_entries_cmd(paths):
+    quoted = " ".join(shell_quote(p) for p in paths)
+    return f"find {quoted} -exec stat -c '{STAT_FORMAT}' {{}} + 2>/dev/null"
+
+
+def parse_stat_lines(out):
+    """Yield (is_dir, size_kb, path) from STAT_FORMAT lines."""
+    for line in out.splitlines():
+        parts = line.split("|", 3)
+        if len(parts) != 4 or not parts[1].isdigit() or not parts[2].isdigit():
+            continue
+        yield parts[0] == "directory", int(parts[1]) * int(parts[2]) // 1024, parts[3]
+
+
+class CacheWatcher:
+    """Keeps a running cache size for one package and reports changes."""
+
+    def __init__(self, device, package, on_size, mode="auto"):
+        self.device = device
+        self.package = package
+        self.root = get_device(device).cache_dir(package)
+        self.on_size = on_size
+        self.mode = mode
+        self.entries = {}
+        self.dirs = set()
+        self.size_kb = None
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._proc = None
+        self._rewatch = False
+        self._stamp = f"{STAMP_DIR}/.cm_stamp_{package}"
+
+    def start(self):
+        token = metrics.current_endpoint.set("monitor:cache_watch")
+        try:
+            self._full_scan()
+            if self.mode == "auto":
+                out, _ = run_adb(self.device, ["shell", "command -v inotifyd"])
+                self.mode = "inotify" if out and len(self.dirs) <= MAX_WATCHED_DIRS else "poll"
+        finally:
+            metrics.current_endpoint.reset(token)
+        target = self._inotify_loop if self.mode == "inotify" else self._poll_loop
+        thread = threading.Thread(target=target, name=f"cache-watch-{self.package}")
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._proc and self._proc.poll() is None:
+            self._proc.kill()
+
+    def _full_scan(self):
+        out, _ = run_adb(self.device, ["shell", stat_entries_cmd([self.root])
+                                       + f"; touch {self._stamp}"])
+        with self._lock:
+            self.entries.clear()
+            self.dirs.clear()
+            self._apply(out)
+        self._report()
+
+    def _apply(self, out):
+        for is_dir, size_kb, path in parse_stat_lines(out):
+            self.entries[path] = size_kb
+            if is_dir:
+                self.dirs.add(path)
+
+    def _forget(self, path):
+        prefix = path.rstrip("/") + "/"
+        for known in [p for p in self.entries if p == path or p.startswith(prefix)]:
+            del self.entries[known]
+            self.dirs.discard(known)
+
+    def _report(self):
+        with self._lock:
+            total = sum(self.entries.values())
+        if total != self.size_kb:
+            self.size_kb = total
+            self.on_size(total)
+
+    # inotify mode
+
+    def _inotify_loop(self):
+        metrics.current_endpoint.set("monitor:cache_watch")
+        worker = threading.Thread(target=self._process_events)
+        worker.daemon = True
+        worker.start()
+        failures = 0
+        while not self._stop.is_set():
+            with self._lock:
+                watched = sorted(self.dirs) or [self.root]
+            args = " ".join(shell_quote(f"{d}:{WATCH_EVENTS}") for d in watched)
+            self._proc = subprocess.Popen(
+                adb_base(self.device) + ["shell", f"inotifyd - {args}"],
+                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                text=True, errors="replace", bufsize=1,
+            )
+            started, events = time.time(), 0
+            for line in self._proc.stdout:
+                events += 1
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) < 2:
+                    continue
+                path = parts[1] if len(parts) == 2 else f"{parts[1].rstrip('/')}/{parts[2]}"
+                with self._lock:
+                    self._pending.add(path)
+                self._wake.set()
+            if self._rewatch:
+                self._rewatch = False
+                continue
+            if not events and time.time() - started < RESTART_DELAY:
+                failures += 1
+                if failures >= 3:
+                    # inotifyd keeps dying right away (no permission, bad
+                    # path, ...); poll instead of rescanning every restart.
+                    self.mode = "poll"
+                    self._poll_loop()
+                    return
+            else:
+                failures = 0
+            if not self._stop.is_set():
+                # inotifyd exits when new directories need watching or the
+                # cache directory itself went away; rescan and start over.
+                self._stop.wait(RESTART_DELAY)
+                if not self._stop.is_set():
+                    try:
+                        self._full_scan()
+                    except (AdbTimeout, DeviceUnavailable):
+                        # Device is unhealthy; the next restart tries again
+                        pass
+
+    def _process_events(self):
+        metrics.current_endpoint.set("monitor:cache_watch")
+        while not self._stop.is_set():
+            self._wake.wait()
+            self._stop.wait(DEBOUNCE)
+            self._wake.clear()
+            with self._lock:
+                paths, self._pending = self._pending, set()
+                known_dirs = len(self.dirs)
+            if not paths:
+                continue
+            try:
+                out, _ = run_adb(self.device, ["shell", stat_entries_cmd(sorted(paths))])
+            except (AdbTimeout, DeviceUnavailable):
+                # Keep the paths for the next attempt
+                with self._lock:
+                    self._pending |= paths
+                self._stop.wait(RESTART_DELAY)
+                self._wake.set()
+                continue
+            with self._lock:
+                for path in paths:
+                    self._forget(path)
+                self._apply(out)
+                new_dirs = len(self.dirs) != known_dirs
+            self._report()
+            if new_dirs and self._proc and self._proc.poll() is None:
+                # Restart inotifyd so the new directory set is watched; the
+                # tracked sizes are already current, so no rescan is needed.
+                self._rewatch = True
+                self._proc.kill()
+
+    # poll mode
+
+    def _poll_loop(self):
+        metrics.current_endpoint.set("monitor:cache_watch")
+        stamp = self._stamp
+        script = (
+            f"touch {stamp}.new; "
+            f"find {shell_quote(self.root)} -newer {stamp} -type d | while read d; do "
+            f"echo \"DIR|$d\"; find \"$d\" -maxdepth 1 -mindepth 1 -exec stat -c '{STAT_FORMAT}' {{}} +; done; "
+            f"find {shell_quote(self.root)} -newer {stamp} ! -type d -exec stat -c '{STAT_FORMAT}' {{}} +; "
+            f"mv {stamp}.new {stamp}"
+        )
+        while not self._stop.wait(POLL_INTERVAL):
+            try:
+                out, _ = run_adb(self.device, ["shell", script + " 2>/dev/null"])
+            except (AdbTimeout, DeviceUnavailable):
+                continue
+            if not out:
+                continue
+            relisted = {}
+            current = None
+            with self._lock:
+                for line in out.splitlines():
+                    if line.startswith("DIR|"):
+                        current = line[4:]
+                        relisted[current] = set()
+                        continue
+                    for is_dir, size_kb, path in parse_stat_lines(line):
+                        self.entries[path] = size_kb
+                        if is_dir:
+                            self.dirs.add(path)
+                        if current is not None and os.path.dirname(path) == current:
+                            relisted[current].add(path)
+                # Children missing from a relisted directory were deleted
+                for directory, seen in relisted.items():
+                    for child in [p for p in self.entries if os.path.dirname(p) == directory and p not in seen]:
+                        self._forget(child)
+            self._report()
+
+
+class CacheWatchRegistry:
+    """Reference-counted CacheWatchers shared by every client watching a package."""
+
+    def __init__(self, on_size):
+        self.on_size = on_size
+        self._watchers = {}
+        self._subscribers = {}
+        self._by_sid = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, sid, device, package, mode="auto"):
+        key = (device, package)
+        candidate = None
+        while True:
+            with self._lock:
+                previous = self._by_sid.get(sid)
+                if previous == key:
+                    return self._watchers[key]
+                watcher = self._watchers.get(key)
+                if watcher is not None or candidate is not None:
+                    if previous is not None:
+                        self._remove(sid, previous)
+                    self._by_sid[sid] = key
+                    self._subscribers.setdefault(key, set()).add(sid)
+                    if watcher is not None:
+                        # Another client started one meanwhile; ours is dropped unstarted
+                        if watcher.size_kb is not None:
+                            self.on_size(device, package, watcher.size_kb, [sid])
+                        return watcher
+                    watcher = self._watchers[key] = candidate
+                    break
+            # Resolving the cache dir may call adb, so the watcher is built
+            # outside the lock
+            candidate = CacheWatcher(
+                device, package,
+                lambda size_kb: self.on_size(device, package, size_kb, self.subscribers(key)),
+                mode)
+        try:
+            watcher.start()
+        except Exception:
+            self.unsubscribe(sid)
+            raise
+        return watcher
+
+    def unsubscribe(self, sid):
+        with self._lock:
+            key = self._by_sid.pop(sid, None)
+            if key is not None:
+                self._remove(sid, key)
+
+    def _remove(self, sid, key):
+        subscribers = self._subscribers.get(key, set())
+        subscribers.discard(sid)
+        if not subscribers:
+            self._subscribers.pop(key, None)
+            watcher = self._watchers.pop(key, None)
+            if watcher:
+                watcher.stop()
+
+    def subscribers(self, key):
+        with self._lock:
+            return list(self._subscribers.get(key, ()))
+
+    def watchers(self):
+        with self._lock:
+            return [{
+                'device': w.device,
+                'package': w.package,
+                'mode': w.mode,
+                'size_kb': w.size_kb,
+                'subscribers': len(self._subscribers.get(key, ()))
+            } for key, w in self._watchers.items()]
@@ -1,62 +1,147 @@
-import subprocess
 import argparse
 
+from adb_shell import list_devices
+from device import get_device
+from multi_device import run_on_devices, print_device_summary
+from package_index import index as package_index
+
 DEFAULT_TARGET = "."
 
-def run_adb(cmd):
-    result = subprocess.run(["adb", "shell"] + cmd, capture_output=True, text=True)
-    return result.stdout.strip()
+# Upper bound for one `adb shell` command line. Large package lists are sized
+# in several chunks so we never hit the device shell's argument limit.
+MAX_SHELL_CMD_LEN = 4000
+
+# Size of the first `du` chunk when streaming results, so the first sizes
+# come back after one short round trip
+STREAM_FIRST_CHUNK_LEN = 256
+
+def enable_root(device=""):
+    """Root adbd once per device; later calls reuse the remembered state."""
+    return get_device(device).ensure_root()
+
+def get_packages(target, device=""):
+    return package_index.filter(device, keyword=target)
+
+def chunk_args(args, base_len=0, limit=MAX_SHELL_CMD_LEN):
+    """Split args into lists whose joined length stays under limit."""
+    chunk, length = [], base_len
+    for arg in args:
+        if chunk and length + len(arg) + 1 > limit:
+            yield chunk
+            chunk, length = [], base_len
+        chunk.append(arg)
+        length += len(arg) + 1
+    if chunk:
+        yield chunk
+
+def parse_du_output(output, paths):
+    """Map `du -s` lines back to packages using the {path: package} dict.
+
+    Sizes of several paths belonging to one package are added up.
+    """
+    sizes = {}
+    for line in output.splitlines():
+        parts = line.split(None, 1)
+        if len(parts) != 2 or not parts[0].isdigit():
+            continue
+        pkg = paths.get(parts[1].strip().rstrip("/"))
+        if pkg is not None:
+            sizes[pkg] = sizes.get(pkg, 0) + int(parts[0])
+    return sizes
+
+def iter_cache_sizes(packages, device="", user=None, first_chunk_len=MAX_SHELL_CMD_LEN):
+    """Yield {package: size_kb} after every `du -s` round trip.
+
+    All cache paths of a package go into the same chunk, so every package is
+    reported once. Chunks start at first_chunk_len characters and double up
+    to MAX_SHELL_CMD_LEN, so a small first chunk answers quickly.
+    """
+    dev = get_device(device)
+    limit = min(first_chunk_len, MAX_SHELL_CMD_LEN)
+    chunk, paths, length = [], {}, len("du -s")
+    for pkg in packages:
+        pkg_paths = dev.cache_dirs(pkg, user)
+        pkg_len = sum(len(path) + 1 for path in pkg_paths)
+        if chunk and length + pkg_len > limit:
+            yield _du_chunk(dev, chunk, paths)
+            chunk, paths, length = [], {}, len("du -s")
+            limit = min(limit * 2, MAX_SHELL_CMD_LEN)
+        chunk.append(pkg)
+        paths.update((path, pkg) for path in pkg_paths)
+        length += pkg_len
+    if chunk:
+        yield _du_chunk(dev, chunk, paths)
 
-def enable_root():
-    print("🔑 Attempting to enable adb root...")
-    output = subprocess.run(["adb", "root"], capture_output=True, text=True)
-    print(output.stdout.strip())
+def _du_chunk(dev, packages, paths):
+    sizes = {pkg: 0 for pkg in packages}
+    # Without paths du would size the shell's working directory
+    if paths:
+        sizes.update(parse_du_output(dev.shell("du -s " + " ".join(paths)), paths))
+    return sizes
 
-def get_packages(target):
-    output = run_adb(["pm", "list", "packages"])
-    packages = [line.replace("package:", "").strip() for line in output.splitlines() if target in line]
-    return packages
+def get_cache_sizes(packages, device="", progress=None, user=None):
+    """Size the cache of every package with one `du -s` per chunk of paths.
 
-def get_cache_size(pkg):
-    output = run_adb(["du", "-s", f"/data/data/{pkg}/cache"])
-    try:
-        size_kb = int(output.split()[0])
-    except Exception:
-        size_kb = 0
-    return size_kb
+    Caches of all Android users are added up unless user is given.
+    progress(device, done, total, item) is called after every chunk.
+    """
+    sizes = {}
+    for chunk in iter_cache_sizes(packages, device, user):
+        sizes.update(chunk)
+        if progress:
+            progress(device, len(sizes), len(packages), list(chunk)[-1])
+    return sizes
+
+def get_cache_size(pkg, device="", user=None):
+    return get_cache_sizes([pkg], device, user=user).get(pkg, 0)
 
 def format_size(kb):
     mb = kb / 1024
     return f"{kb} KB ({mb:.2f} MB)"
 
-def print_sorted_by_cache(packages):
+def print_sorted_by_cache(packages, device=""):
     """Sort packages by cache size (descending) and print."""
-    package_sizes = [(pkg, get_cache_size(pkg)) for pkg in packages]
+    package_sizes = list(get_cache_sizes(packages, device).items())
     package_sizes.sort(key=lambda x: x[1], reverse=True)
 
     total = 0
-    print("\n📦 Cache sizes (sorted by size):\n")
+    print(f"\n📦 Cache sizes{' on ' + device if device else ''} (sorted by size):\n")
     for pkg, size in package_sizes:
         total += size
         print(f"{pkg:<50} {format_size(size)}")
     print("\n=====================================")
     print(f"Total cache size: {format_size(total)}")
+    return dict(package_sizes)
+
+def scan_device(device, target):
+    enable_root(device)
+    packages = get_packages(target, device)
+    if not packages:
+        print(f"No packages found containing '{target}'")
+        return {}
+    return print_sorted_by_cache(packages, device)
 
 def main():
     parser = argparse.ArgumentParser(description="Calculate cache size of apps matching a package string")
     parser.add_argument("-p", "--package", default=DEFAULT_TARGET,
                         help=f"Target string in package name (default: '{DEFAULT_TARGET}')")
+    parser.add_argument("-s", "--device", default="",
+                        help="Device serial (default: the only connected device)")
+    parser.add_argument("-a", "--all-devices", action="store_true",
+                        help="Scan every connected device concurrently")
     args = parser.parse_args()
 
     target = args.package
-    enable_root()
-
-    packages = get_packages(target)
-    if not packages:
-        print(f"No packages found containing '{target}'")
+    if not args.all_devices:
+        scan_device(args.device, target)
         return
 
-    print_sorted_by_cache(packages)
+    devices = list_devices()
+    if not devices:
+        print("No devices connected.")
+        return
+    results = run_on_devices(scan_device, devices, target)
+    print_device_summary(results)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,122 @@
+"""
+One Device object per serial, shared by every module.
+
+Device wraps the shared adb layer for a serial and remembers what is slow or
+disruptive to find out again:
+
+* whether adbd runs as root. `adb root` restarts adbd and stalls all other
+  traffic to the device, so it is issued at most once per connection.
+* where the data directory of every Android user lives. /data/user/0 is
+  normally a symlink to /data/data, so each physical directory is listed
+  once; secondary users get their own /data/user/<N> entry.
+
+Devices that disappear from `adb devices` are forgotten, so a reconnected or
+rebooted device is probed again.
+"""
+
+import threading
+
+from adb_shell import list_devices, reset_device, run_adb
+
+PRIMARY_DATA_DIR = "/data/data"
+USER_DATA_DIR = "/data/user"
+
+
+class Device:
+    def __init__(self, serial=""):
+        self.serial = serial
+        self._root = None
+        self._user_dirs = None
+        self._lock = threading.RLock()
+
+    def run(self, command):
+        """Run an adb command and return (stdout, stderr)."""
+        return run_adb(self.serial, command)
+
+    def shell(self, cmd):
+        """Run a shell command and return its stdout."""
+        out, _ = run_adb(self.serial, ["shell", cmd])
+        return out
+
+    def is_root(self):
+        return self.shell("id -u") == "0"
+
+    def ensure_root(self):
+        """Make sure adbd runs as root, restarting it at most once."""
+        with self._lock:
+            if self._root is None:
+                self._root = self.is_root() or self._enable_root()
+            return self._root
+
+    def _enable_root(self):
+        print(f"🔑 Attempting to enable adb root on {self.serial or 'default device'}...")
+        out, err = self.run(["root"])
+        print(out or err)
+        # adbd restarts as root; pooled connections still belong to the old one
+        reset_device(self.serial)
+        self.run(["wait-for-device"])
+        return self.is_root()
+
+    def user_dirs(self):
+        """{user_id: data directory}, one entry per physical directory."""
+        with self._lock:
+            if self._user_dirs is None:
+                self.ensure_root()
+                self._user_dirs = self._find_user_dirs()
+            return dict(self._user_dirs)
+
+    def _find_user_dirs(self):
+        out = self.shell(f"for d in {PRIMARY_DATA_DIR} {USER_DATA_DIR}/*; do "
+                         "[ -d \"$d\" ] && echo \"$d $(readlink -f \"$d\")\"; done 2>/dev/null")
+        dirs, seen = {}, set()
+        for line in out.splitlines():
+            parts = line.split()
+            if len(parts) != 2:
+                continue
+            path, real = parts
+            if path == PRIMARY_DATA_DIR:
+                user = 0
+            elif path.rsplit("/", 1)[-1].isdigit():
+                user = int(path.rsplit("/", 1)[-1])
+            else:
+                continue
+            # /data/data comes first, so user 0 keeps its usual path
+            if real in seen or user in dirs:
+                continue
+            seen.add(real)
+            dirs[user] = path
+        return dirs or {0: PRIMARY_DATA_DIR}
+
+    def users(self):
+        return sorted(self.user_dirs())
+
+    def cache_dirs(self, package, user=None):
+        """Cache directories of package for user, or for every user."""
+        return [f"{path}/{package}/cache" for uid, path in sorted(self.user_dirs().items())
+                if user is None or uid == user]
+
+    def cache_dir(self, package, user=0):
+        dirs = self.cache_dirs(package, user)
+        return dirs[0] if dirs else f"{USER_DATA_DIR}/{user}/{package}/cache"
+
+
+_devices = {}
+_lock = threading.Lock()
+
+
+def get_device(serial=""):
+    """The shared Device for serial."""
+    with _lock:
+        device = _devices.get(serial)
+        if device is None:
+            device = _devices[serial] = Device(serial)
+        return device
+
+
+def connected_devices():
+    """Serials of connected devices; forgets the state of the others."""
+    serials = list_devices()
+    with _lock:
+        for serial in [s for s in _devices if s and s not in serials]:
+            del _devices[serial]
+    return serials
@@ -0,0 +1,109 @@
+"""
+Per-device circuit breakers for adb calls.
+
+A device that keeps timing out or dropping its connection would otherwise
+tie up a request or monitor thread for the full deadline of every call.
+After FAILURE_THRESHOLD consecutive failures its breaker opens and calls to
+it fail at once with DeviceUnavailable. After a cooldown, one caller probes
+the device with a cheap command: success closes the breaker, failure keeps
+it open for twice as long (up to MAX_COOLDOWN).
+
+Only failures that say something about the device count: timeouts and
+transient transport errors (offline, closed connection). A command that
+simply failed on a responsive device leaves the breaker closed.
+"""
+
+import os
+import threading
+import time
+
+FAILURE_THRESHOLD = int(os.environ.get("ADB_BREAKER_FAILURES", 3))
+BASE_COOLDOWN = float(os.environ.get("ADB_BREAKER_COOLDOWN", 5))
+MAX_COOLDOWN = 60
+
+
+class DeviceUnavailable(Exception):
+    """The device's breaker is open; the call was not attempted."""
+
+
+class CircuitBreaker:
+    def __init__(self, serial):
+        self.serial = serial
+        self.state = "closed"
+        self.failures = 0
+        self.cooldown = BASE_COOLDOWN
+        self.open_until = 0.0
+        self.last_error = None
+        self.last_success = None
+        self.last_failure = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Return True if the caller must probe the device first; raise if it is unavailable."""
+        with self._lock:
+            if self.state == "closed":
+                return False
+            if self._probing or time.time() < self.open_until:
+                retry_in = max(0.0, self.open_until - time.time())
+                raise DeviceUnavailable(
+                    f"Device {self.serial or 'default device'} is unavailable after {self.failures} "
+                    f"failures ({self.last_error}); retrying in {retry_in:.0f}s")
+            self.state = "half_open"
+            self._probing = True
+            return True
+
+    def success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self.cooldown = BASE_COOLDOWN
+            self.last_success = time.time()
+            self._probing = False
+
+    def failure(self, error):
+        with self._lock:
+            self.failures += 1
+            self.last_error = str(error)
+            self.last_failure = time.time()
+            if self.state == "half_open":
+                # The probe failed: stay away for longer
+                self.cooldown = min(self.cooldown * 2, MAX_COOLDOWN)
+            if self.state == "half_open" or self.failures >= FAILURE_THRESHOLD:
+                self.state = "open"
+                self.open_until = time.time() + self.cooldown
+            self._probing = False
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'state': self.state,
+                'healthy': self.state == "closed",
+                'consecutive_failures': self.failures,
+                'last_error': self.last_error,
+                'last_success': self.last_success,
+                'last_failure': self.last_failure,
+                'retry_in_s': round(max(0.0, self.open_until - time.time()), 1) if self.state != "closed" else 0
+            }
+
+
+_breakers = {}
+_lock = threading.Lock()
+
+
+def breaker(serial):
+    with _lock:
+        found = _breakers.get(serial)
+        if found is None:
+            found = _breakers[serial] = CircuitBreaker(serial)
+        return found
+
+
+def health(serials=None):
+    """{serial: breaker state} for serials, or for every device seen so far."""
+    with _lock:
+        known = dict(_breakers)
+    if serials is None:
+        serials = [s for s in known if s]
+    return {serial: (known[serial].snapshot() if serial in known else CircuitBreaker(serial).snapshot())
+            for serial in serials}
@@ -11,6 +11,7 @@ module.exports = {
     env: {
       NODE_ENV: 'production',
       FLASK_ENV: 'production',
+      SERVER_MODE: 'eventlet',
       PORT: 5000
     },
     error_file: './logs/pm2-error.log',
@@ -0,0 +1,399 @@
+#!/usr/bin/env python3
+"""
+Simulated adb for benchmarking the panel without real phones.
+
+Every fake device is a directory tree under a work directory; device paths
+(/data, /sdcard, /storage) are mapped into it and the shell commands run in
+the host `sh`, so du, dd, rm, find and stat behave for real. `pm`, `df` and
+`id` are emulated by small wrappers. Each adb call or shell command can be
+slowed down by a fixed latency, and every call is logged with the bytes sent
+and received so benchmark.py can count them.
+
+    python fake_adb.py setup <workdir> [--devices N] [--packages N]
+                             [--capacity-mb N] [--latency S] [--rooted]
+
+prints the PATH entry to prepend; `adb` in that directory is this script.
+Only the parts of adb the panel uses are emulated: devices, root,
+wait-for-device, shell (one-shot and interactive) and exec-out. serve()
+answers the adb server's host protocol on a loopback port for the native
+backend (see adb_client): host:devices, features, transport and the shell,
+shell,v2 and exec services.
+
+Faults can be injected per device by creating a file in its directory:
+`.offline` makes every call fail with "error: device offline", `.hang`
+makes every call block until the file is removed.
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+
+CONFIG_FILE = "fake_adb.json"
+CALLS_LOG = "calls.log"
+DEVICE_PATHS = re.compile(r"(?<![\w/.-])(?=/(?:data|sdcard|storage)(?:/|\b))")
+TOOLS = ("pm", "df", "id")
+LOG_CHUNK = 64 * 1024
+
+
+def load_config(home):
+    with open(os.path.join(home, CONFIG_FILE)) as f:
+        return json.load(f)
+
+
+def device_root(home, serial):
+    return os.path.join(home, "devices", serial)
+
+
+def log_call(home, serial, kind, sent, received):
+    with open(os.path.join(home, CALLS_LOG), "a") as f:
+        f.write(f"{serial or '-'} {kind} {sent} {received}\n")
+
+
+def read_calls(home):
+    """Totals of the calls log: {'calls', 'bytes_sent', 'bytes_received'}."""
+    totals = {'calls': 0, 'bytes_sent': 0, 'bytes_received': 0}
+    path = os.path.join(home, CALLS_LOG)
+    if not os.path.exists(path):
+        return totals
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) != 4:
+                continue
+            if parts[1] != "out":
+                totals['calls'] += 1
+            totals['bytes_sent'] += int(parts[2])
+            totals['bytes_received'] += int(parts[3])
+    return totals
+
+
+def reset_calls(home):
+    open(os.path.join(home, CALLS_LOG), "w").close()
+
+
+def set_fault(home, serial, fault=None):
+    """Make serial "offline" or "hang", or clear its faults with None."""
+    root = device_root(home, serial)
+    for name in ("offline", "hang"):
+        path = os.path.join(root, "." + name)
+        if name == fault:
+            open(path, "w").close()
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+# setup
+
+def setup(home, devices=1, packages=100, capacity_mb=8192, latency=0.0, rooted=False):
+    """Create the fake devices under home and return the bin directory."""
+    home = os.path.abspath(home)
+    bin_dir = os.path.join(home, "bin")
+    os.makedirs(bin_dir, exist_ok=True)
+    script = os.path.abspath(__file__)
+    for name in ("adb",) + TOOLS:
+        path = os.path.join(bin_dir, name)
+        with open(path, "w") as f:
+            tool = "" if name == "adb" else f" --tool {name}"
+            f.write(f"#!/bin/sh\nFAKE_ADB_HOME=\"{home}\" exec \"{sys.executable}\" \"{script}\"{tool} \"$@\"\n")
+        os.chmod(path, 0o755)
+
+    serials = [f"emulator-{5554 + 2 * i}" for i in range(devices)]
+    for serial in serials:
+        root = device_root(home, serial)
+        shutil.rmtree(root, ignore_errors=True)
+        for directory in ("data/data", "data/user", "data/system", "data/local/tmp", "sdcard"):
+            os.makedirs(os.path.join(root, directory))
+        os.symlink("../data", os.path.join(root, "data/user/0"))
+        for i in range(packages):
+            os.makedirs(os.path.join(root, f"data/data/com.fake.app{i:04d}/cache"))
+        with open(os.path.join(root, "data/system/packages.xml"), "w") as f:
+            f.write(f"<packages count='{packages}'/>\n")
+        if rooted:
+            open(os.path.join(root, ".rooted"), "w").close()
+
+    with open(os.path.join(home, CONFIG_FILE), "w") as f:
+        json.dump({'devices': serials, 'capacity_kb': capacity_mb * 1024, 'latency': latency}, f)
+    reset_calls(home)
+    return bin_dir
+
+
+# device side
+
+def to_host(text, root):
+    return DEVICE_PATHS.sub(root, text)
+
+
+def to_device(text, root):
+    return text.replace(root, "")
+
+
+def shell_env(home, serial, root):
+    env = dict(os.environ)
+    env["PATH"] = os.path.join(home, "bin") + os.pathsep + env.get("PATH", "")
+    env["FAKE_ADB_HOME"] = home
+    env["FAKE_ADB_SERIAL"] = serial
+    env["FAKE_ADB_ROOT"] = root
+    return env
+
+
+def allocated_kb(root):
+    total = 0
+    for directory, _, files in os.walk(root):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(directory, name)).st_blocks // 2
+            except OSError:
+                pass
+    return total
+
+
+def run_tool(name, args):
+    home = os.environ["FAKE_ADB_HOME"]
+    root = os.environ["FAKE_ADB_ROOT"]
+    if name == "pm":
+        if args[:2] != ["list", "packages"]:
+            print(f"fake pm: unsupported command {' '.join(args)}", file=sys.stderr)
+            return 1
+        for package in sorted(os.listdir(os.path.join(root, "data/data"))):
+            print(f"package:{package}")
+    elif name == "df":
+        total = load_config(home)['capacity_kb']
+        used = min(allocated_kb(root), total)
+        print("Filesystem     1K-blocks    Used Available Use% Mounted on")
+        print(f"/dev/fuse {total} {used} {total - used} {used * 100 // total}% /storage/emulated")
+    elif name == "id":
+        rooted = os.path.exists(os.path.join(root, ".rooted"))
+        print(("0" if rooted else "2000") if "-u" in args else
+              ("uid=0(root) gid=0(root)" if rooted else "uid=2000(shell) gid=2000(shell)"))
+    return 0
+
+
+def _pump(home, serial, source, target, root):
+    received = 0
+    for line in iter(source.readline, b""):
+        data = to_device(line.decode("utf-8", "replace"), root).encode()
+        target.write(data)
+        target.flush()
+        received += len(data)
+        # ShellSession frames every command with __CM_ marker lines
+        if received >= LOG_CHUNK or line.startswith(b"__CM_"):
+            log_call(home, serial, "out", 0, received)
+            received = 0
+    if received:
+        log_call(home, serial, "out", 0, received)
+
+
+def interactive_shell(home, serial, root, latency):
+    """`adb shell` without a command: forward stdin lines to a host sh."""
+    proc = subprocess.Popen(["sh"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, env=shell_env(home, serial, root), cwd=root)
+    pumps = [threading.Thread(target=_pump, args=(home, serial, proc.stdout, sys.stdout.buffer, root)),
+             threading.Thread(target=_pump, args=(home, serial, proc.stderr, sys.stderr.buffer, root))]
+    for pump in pumps:
+        pump.start()
+    for line in sys.stdin.buffer:
+        text = line.decode("utf-8", "replace")
+        if text.startswith("sh -c "):
+            # one framed command from adb_shell.ShellSession
+            if os.path.exists(os.path.join(root, ".offline")):
+                break
+            while os.path.exists(os.path.join(root, ".hang")):
+                time.sleep(0.1)
+            time.sleep(latency)
+            log_call(home, serial, "session", len(line), 0)
+        proc.stdin.write(to_host(text, root).encode())
+        proc.stdin.flush()
+    proc.stdin.close()
+    proc.wait()
+    for pump in pumps:
+        pump.join()
+    return proc.returncode
+
+
+def run_command(home, serial, root, latency, command, kind):
+    """Run one device command in the host sh; return (stdout, stderr, exit code) bytes."""
+    time.sleep(latency)
+    result = subprocess.run(["sh", "-c", to_host(command, root)], capture_output=True,
+                            env=shell_env(home, serial, root), cwd=root)
+    if kind == "exec-out":
+        # Binary-safe: tar and other streams pass through untouched
+        out = result.stdout
+    else:
+        out = to_device(result.stdout.decode("utf-8", "replace"), root).encode()
+    err = to_device(result.stderr.decode("utf-8", "replace"), root).encode()
+    log_call(home, serial, kind, len(command), len(out) + len(err))
+    return out, err, result.returncode
+
+
+def one_shot(home, serial, root, latency, command, kind):
+    out, err, returncode = run_command(home, serial, root, latency, command, kind)
+    sys.stdout.buffer.write(out)
+    if kind == "shell":
+        sys.stderr.buffer.write(err)
+    return returncode
+
+
+# adb server protocol
+
+class _ServerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        home = self.server.home
+        config = load_config(home)
+        serial = None
+        while True:
+            length = self._recv(4)
+            if not length:
+                return
+            request = self._recv(int(length, 16)).decode("utf-8", "replace")
+            if request == "host:devices":
+                time.sleep(config['latency'])
+                log_call(home, "", "host", 0, 0)
+                return self._reply("".join(f"{name}\tdevice\n" for name in config['devices']))
+            if request == "host:features" or re.fullmatch(r"host-serial:.*:features", request):
+                return self._reply("shell_v2,cmd")
+            if request.startswith("host:transport"):
+                serial = request[len("host:transport:"):] if request != "host:transport-any" else ""
+                if not serial and len(config['devices']) == 1:
+                    serial = config['devices'][0]
+                if serial not in config['devices']:
+                    return self._fail(f"device '{serial}' not found")
+                root = device_root(home, serial)
+                if os.path.exists(os.path.join(root, ".offline")):
+                    return self._fail("device offline")
+                self.request.sendall(b"OKAY")
+                continue
+            if serial is None or not request.startswith(("shell:", "shell,", "exec:")):
+                return self._fail(f"unsupported request '{request}'")
+            while os.path.exists(os.path.join(root, ".hang")):
+                time.sleep(0.1)
+            service, _, command = request.partition(":")
+            self.request.sendall(b"OKAY")
+            out, err, returncode = run_command(home, serial, root, config['latency'], command,
+                                               "exec-out" if service == "exec" else "shell")
+            if service.startswith("shell,v2"):
+                for packet_id, data in ((1, out), (2, err), (3, bytes([returncode & 0xff]))):
+                    if data:
+                        self.request.sendall(struct.pack("<BI", packet_id, len(data)) + data)
+            elif service == "exec":
+                self.request.sendall(out)
+            else:
+                self.request.sendall(out + err)
+            return
+
+    def _recv(self, size):
+        data = b""
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                return data
+            data += chunk
+        return data
+
+    def _reply(self, text):
+        payload = text.encode()
+        self.request.sendall(b"OKAY%04x" % len(payload) + payload)
+
+    def _fail(self, message):
+        payload = message.encode()
+        self.request.sendall(b"FAIL%04x" % len(payload) + payload)
+
+
+def serve(home, port=0):
+    """Answer the adb server protocol for the fake devices under home.
+
+    Runs in a daemon thread on 127.0.0.1 and returns the port, to be put in
+    ANDROID_ADB_SERVER_PORT before adb_client is imported.
+    """
+    server = socketserver.ThreadingTCPServer(("127.0.0.1", port), _ServerHandler)
+    server.daemon_threads = True
+    server.home = os.path.abspath(home)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server.server_address[1]
+
+
+def main(argv):
+    if len(argv) > 2 and argv[0] == "--tool":
+        return run_tool(argv[1], argv[2:])
+    if argv and argv[0] == "setup":
+        parser = argparse.ArgumentParser(prog="fake_adb.py setup")
+        parser.add_argument("workdir")
+        parser.add_argument("--devices", type=int, default=1)
+        parser.add_argument("--packages", type=int, default=100)
+        parser.add_argument("--capacity-mb", type=int, default=8192)
+        parser.add_argument("--latency", type=float, default=0.0)
+        parser.add_argument("--rooted", action="store_true")
+        args = parser.parse_args(argv[1:])
+        print(setup(args.workdir, args.devices, args.packages, args.capacity_mb, args.latency, args.rooted))
+        return 0
+
+    home = os.environ["FAKE_ADB_HOME"]
+    config = load_config(home)
+    serial = ""
+    if len(argv) > 1 and argv[0] == "-s":
+        serial, argv = argv[1], argv[2:]
+    if not argv:
+        print("fake adb: no command", file=sys.stderr)
+        return 1
+    command = argv[0]
+
+    if command == "devices":
+        time.sleep(config['latency'])
+        log_call(home, serial, "host", 0, 0)
+        print("List of devices attached")
+        for name in config['devices']:
+            print(f"{name}\tdevice")
+        return 0
+    if command in ("start-server", "kill-server"):
+        return 0
+
+    if not serial:
+        if len(config['devices']) != 1:
+            print("adb: more than one device/emulator" if config['devices'] else "adb: no devices/emulators found",
+                  file=sys.stderr)
+            return 1
+        serial = config['devices'][0]
+    if serial not in config['devices']:
+        print(f"adb: device '{serial}' not found", file=sys.stderr)
+        return 1
+    root = device_root(home, serial)
+    if os.path.exists(os.path.join(root, ".offline")):
+        print("error: device offline", file=sys.stderr)
+        return 1
+    while os.path.exists(os.path.join(root, ".hang")):
+        time.sleep(0.1)
+
+    if command == "wait-for-device":
+        return 0
+    if command == "root":
+        time.sleep(config['latency'])
+        log_call(home, serial, "root", 0, 0)
+        flag = os.path.join(root, ".rooted")
+        if os.path.exists(flag):
+            print("adbd is already running as root")
+        else:
+            open(flag, "w").close()
+            print("restarting adbd as root")
+        return 0
+    if command == "shell":
+        if len(argv) == 1:
+            return interactive_shell(home, serial, root, config['latency'])
+        return one_shot(home, serial, root, config['latency'], " ".join(argv[1:]), "shell")
+    if command == "exec-out":
+        return one_shot(home, serial, root, config['latency'], " ".join(argv[1:]), "exec-out")
+    print(f"fake adb: unsupported command '{command}'", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main(sys.argv[1:]))
+    except BrokenPipeError:
+        sys.exit(0)
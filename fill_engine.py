@@ -0,0 +1,127 @@
+"""
+Fast file writer used by the cache and storage fill operations.
+
+Files are written in batches: one shell script creates several files and
+reports per file whether it worked, plus on-device timestamps around the
+writes so the achieved throughput can be reported back.
+
+Strategies:
+  dd        zeros in 1 MB blocks (never allocates a file-sized buffer)
+  random    incompressible data in 1 MB blocks, for f2fs compression
+  fallocate preallocate the blocks without writing them (falls back to dd)
+  truncate  sparse file; instant, but takes no real space on most filesystems
+"""
+
+import time
+
+from adb_shell import COMMAND_TIMEOUTS, run_adb, shell_quote
+from calculate_cache import MAX_SHELL_CMD_LEN
+
+STRATEGIES = ("dd", "random", "fallocate", "truncate")
+DEFAULT_STRATEGY = "dd"
+BLOCK_SIZE = 1024 * 1024
+
+# Keep each shell invocation reasonably short so progress and cancellation
+# are reported between batches
+MAX_BATCH_BYTES = 512 * 1024 * 1024
+
+# Batches larger than the script deadline allows are given this long per MB,
+# the write rate of a slow SD card
+MIN_MB_PER_S = 20
+
+
+def _dd_cmd(source, path, size_bytes):
+    blocks, rest = divmod(size_bytes, BLOCK_SIZE)
+    cmd = f"dd if={source} of={path} bs={BLOCK_SIZE} count={blocks} 2>/dev/null"
+    if rest:
+        cmd = (f"{{ {cmd} && dd if={source} bs={rest} count=1 2>/dev/null >> {path}; }}"
+               if blocks else f"dd if={source} of={path} bs={rest} count=1 2>/dev/null")
+    return cmd
+
+
+def write_file_cmd(path, size_bytes, strategy=DEFAULT_STRATEGY):
+    """Shell command creating path with size_bytes using strategy."""
+    path = shell_quote(path)
+    if strategy == "random":
+        return _dd_cmd("/dev/urandom", path, size_bytes)
+    if strategy == "fallocate":
+        return f"{{ fallocate -l {size_bytes} {path} 2>/dev/null || {_dd_cmd('/dev/zero', path, size_bytes)}; }}"
+    if strategy == "truncate":
+        return f"truncate -s {size_bytes} {path}"
+    return _dd_cmd("/dev/zero", path, size_bytes)
+
+
+def build_batch_script(files, strategy=DEFAULT_STRATEGY):
+    """Script writing [(path, size_bytes), ...] and reporting OK/ERR per file."""
+    lines = ["echo T0 $(date +%s%N)"]
+    for path, size_bytes in files:
+        lines.append(f"if {write_file_cmd(path, size_bytes, strategy)}; "
+                     f"then echo OK {shell_quote(path)}; else echo ERR {shell_quote(path)}; fi")
+    lines.append("echo T1 $(date +%s%N)")
+    return "\n".join(lines)
+
+
+def _batches(files, max_bytes=MAX_BATCH_BYTES):
+    batch, length, size = [], 0, 0
+    for path, size_bytes in files:
+        line_len = len(path) * 3 + 200
+        if batch and (length + line_len > MAX_SHELL_CMD_LEN or
+                      (max_bytes is not None and size + size_bytes > max_bytes)):
+            yield batch
+            batch, length, size = [], 0, 0
+        batch.append((path, size_bytes))
+        length += line_len
+        size += size_bytes
+    if batch:
+        yield batch
+
+
+def _device_seconds(out):
+    stamps = {}
+    for line in out.splitlines():
+        parts = line.split()
+        if len(parts) == 2 and parts[0] in ("T0", "T1") and parts[1].isdigit():
+            stamps[parts[0]] = int(parts[1])
+    if "T0" in stamps and "T1" in stamps and stamps["T1"] > stamps["T0"]:
+        return (stamps["T1"] - stamps["T0"]) / 1e9
+    return None
+
+
+def batch_timeout(size_bytes):
+    """Deadline for a script writing size_bytes: the script one, or longer for big batches."""
+    return max(COMMAND_TIMEOUTS["script"], size_bytes / BLOCK_SIZE / MIN_MB_PER_S)
+
+
+def fill_files(device, files, strategy=DEFAULT_STRATEGY, progress=None, max_batch_bytes=MAX_BATCH_BYTES):
+    """Write [(path, size_bytes), ...] on device in as few adb calls as possible.
+
+    Returns {'written': [paths], 'failed': [paths], 'bytes', 'seconds',
+    'mb_per_s'}. progress(device, done, total, item) is called per batch.
+    With max_batch_bytes=None batches are only split by command length.
+    """
+    if strategy not in STRATEGIES:
+        raise ValueError(f"Unknown fill strategy '{strategy}', use one of {', '.join(STRATEGIES)}")
+    report = {'written': [], 'failed': [], 'bytes': 0, 'seconds': 0.0}
+    sizes = dict(files)
+    for batch in _batches(files, max_batch_bytes):
+        started = time.time()
+        out, err = run_adb(device, ["shell", build_batch_script(batch, strategy)],
+                           timeout=batch_timeout(sum(size for _, size in batch)))
+        elapsed = _device_seconds(out) or (time.time() - started)
+        report['seconds'] += elapsed
+        reported = set()
+        for line in out.splitlines():
+            status, _, path = line.partition(" ")
+            if status in ("OK", "ERR") and path in sizes:
+                reported.add(path)
+                if status == "OK":
+                    report['written'].append(path)
+                    report['bytes'] += sizes[path]
+                else:
+                    report['failed'].append(path)
+        report['failed'].extend(path for path, _ in batch if path not in reported)
+        if progress:
+            progress(device, len(report['written']) + len(report['failed']), len(files), batch[-1][0])
+    report['seconds'] = round(report['seconds'], 3)
+    report['mb_per_s'] = round(report['bytes'] / BLOCK_SIZE / report['seconds'], 2) if report['seconds'] else 0.0
+    return report
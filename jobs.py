@@ -0,0 +1,136 @@
+"""
+Background jobs for long running device operations.
+
+Submitting a job returns immediately with its id; a bounded thread pool
+runs it. The job function receives a `progress(device, done, total, item)`
+callback which records progress, pushes a `job_progress` event through the
+supplied emit function and raises JobCancelled once the job was cancelled,
+so per-package loops stop at the next item.
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+
+# Finished jobs kept for status queries
+MAX_FINISHED_JOBS = 100
+
+
+class JobCancelled(Exception):
+    def __init__(self):
+        super().__init__("Job cancelled")
+
+
+class Job:
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.status = 'queued'
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'cancelled')
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'progress': self.progress,
+            'result': self.result,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobManager:
+    def __init__(self, max_workers=JOB_WORKERS, emit=None):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._emit = emit
+
+    def emit(self, event, data):
+        if self._emit:
+            self._emit(event, data)
+
+    def submit(self, kind, func, *args, params=None, **kwargs):
+        """Queue func(*args, progress=..., **kwargs) and return its Job."""
+        job = Job(kind, params or {})
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(metrics.run_in_context(self._run), job, func, args, kwargs)
+        return job
+
+    def _run(self, job, func, args, kwargs):
+        if job.cancel_event.is_set():
+            self._finish(job, 'cancelled')
+            return
+        job.status = 'running'
+        job.started_at = time.time()
+        self.emit('job_started', {'id': job.id, 'kind': job.kind})
+
+        def progress(device, done, total, item=None):
+            job.progress[device] = {'done': done, 'total': total}
+            self.emit('job_progress', {
+                'id': job.id,
+                'device': device,
+                'done': done,
+                'total': total,
+                'item': item
+            })
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+
+        try:
+            job.result = func(*args, progress=progress, **kwargs)
+            status = 'cancelled' if job.cancel_event.is_set() else 'done'
+        except JobCancelled:
+            status = 'cancelled'
+        except Exception as e:
+            job.error = str(e)
+            status = 'failed'
+        self._finish(job, status)
+
+    def _finish(self, job, status):
+        job.status = status
+        job.finished_at = time.time()
+        self.emit('job_finished', {'id': job.id, 'status': status, 'error': job.error})
+
+    def _prune(self):
+        finished = [j for j in self._jobs.values() if j.finished]
+        finished.sort(key=lambda j: j.finished_at)
+        for job in finished[:max(0, len(finished) - MAX_FINISHED_JOBS)]:
+            del self._jobs[job.id]
+
+    def get(self, job_id):
+        return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda j: j.created_at, reverse=True)
+
+    def cancel(self, job_id):
+        job = self._jobs.get(job_id)
+        if job is None or job.finished:
+            return False
+        job.cancel_event.set()
+        return True
@@ -0,0 +1,198 @@
+"""
+Room-scoped, batched delivery of monitor samples to Socket.IO clients.
+
+Every watched target (storage of a device, cache of a package on a device)
+is a Socket.IO room, and a client joins the room of each target it watches.
+A sample is therefore encoded once and sent only to the clients watching it.
+
+Samples are not sent as they arrive. The latest value of every room is kept
+and flushed every FLUSH_INTERVAL as a compact `monitor_batch` frame:
+
+    {"seq": 7, "u": [["storage", "emulator-5554", null, 1718000000.25, 8388608, 1024, 8387584]]}
+
+Each update is [metric, device, package, timestamp, *values], with the values
+in the order given by FIELDS; MB, GB and percentages are left to the client.
+A field ending in "*" holds a list that is spread over the rest of the row.
+Bursts of samples collapse into the latest one.
+
+Clients acknowledge every frame with a `monitor_ack` event. A client with
+MAX_UNACKED frames outstanding is skipped, so it never builds up a queue.
+Once it catches up, it gets one frame holding the latest value of every room
+it missed.
+"""
+
+import os
+import threading
+import time
+
+FLUSH_INTERVAL = float(os.environ.get("MONITOR_FLUSH_INTERVAL", 0.25))
+MAX_UNACKED = int(os.environ.get("MONITOR_MAX_UNACKED", 4))
+
+# Value columns of each metric's updates
+FIELDS = {
+    'storage': ('total_kb', 'used_kb', 'free_kb'),
+    'cache': ('size_kb',),
+    # The target's package is a comma separated list; one RSS per package
+    'memory': ('total_kb', 'available_kb', 'free_kb', 'cached_kb', 'swap_free_kb',
+               'psi_some_avg10', 'psi_some_avg60', 'psi_full_avg10', 'psi_full_avg60', 'rss_kb*'),
+}
+
+BATCH_EVENT = "monitor_batch"
+
+
+def room_name(metric, device, package=None):
+    return f"{metric}:{device}" if package is None else f"{metric}:{device}:{package}"
+
+
+class LiveUpdates:
+    def __init__(self, socketio, namespace="/", flush_interval=FLUSH_INTERVAL, max_unacked=MAX_UNACKED):
+        self.socketio = socketio
+        self.namespace = namespace
+        self.flush_interval = flush_interval
+        self.max_unacked = max_unacked
+        self._rooms_by_sid = {}
+        self._members = {}
+        self._latest = {}
+        self._dirty = set()
+        self._behind = {}
+        self._unacked = {}
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def join(self, sid, metric, device, package=None):
+        """Deliver (metric, device, package) to sid, replacing sid's previous room for metric."""
+        room = room_name(metric, device, package)
+        with self._cond:
+            rooms = self._rooms_by_sid.setdefault(sid, {})
+            previous = rooms.get(metric)
+            if previous == room:
+                return
+            if previous is not None:
+                self._leave(sid, previous)
+            rooms[metric] = room
+            self._members.setdefault(room, set()).add(sid)
+            self._unacked.setdefault(sid, 0)
+            if room in self._latest:
+                # A target other clients already watch: send its value right away
+                self._behind.setdefault(sid, set()).add(room)
+                self._cond.notify()
+        self.socketio.server.enter_room(sid, room, namespace=self.namespace)
+
+    def leave(self, sid, metric=None):
+        """Stop delivering metric, or everything, to sid."""
+        with self._cond:
+            rooms = self._rooms_by_sid.get(sid, {})
+            left = [rooms.pop(name) for name in ([metric] if metric else list(rooms)) if name in rooms]
+            for room in left:
+                self._leave(sid, room)
+            if not rooms:
+                self._rooms_by_sid.pop(sid, None)
+                self._behind.pop(sid, None)
+                self._unacked.pop(sid, None)
+        for room in left:
+            self.socketio.server.leave_room(sid, room, namespace=self.namespace)
+
+    def close(self, metric, device, package=None):
+        """Drop a target's room, e.g. after its sampling failed."""
+        room = room_name(metric, device, package)
+        with self._cond:
+            members = self._members.get(room, set())
+        for sid in list(members):
+            with self._cond:
+                rooms = self._rooms_by_sid.get(sid, {})
+                if rooms.get(metric) == room:
+                    del rooms[metric]
+                self._leave(sid, room)
+            self.socketio.server.leave_room(sid, room, namespace=self.namespace)
+
+    def _leave(self, sid, room):
+        members = self._members.get(room)
+        if members is not None:
+            members.discard(sid)
+            if not members:
+                del self._members[room]
+                self._latest.pop(room, None)
+                self._dirty.discard(room)
+        self._behind.get(sid, set()).discard(room)
+
+    def ack(self, sid):
+        """sid processed one frame."""
+        with self._cond:
+            if self._unacked.get(sid):
+                self._unacked[sid] -= 1
+                if self._behind.get(sid):
+                    self._cond.notify()
+
+    def publish(self, metric, device, package, payload):
+        """Queue a sample; only the latest one per room is sent."""
+        room = room_name(metric, device, package)
+        update = [metric, device, package, round(time.time(), 3)]
+        for field in FIELDS[metric]:
+            if field.endswith("*"):
+                update.extend(payload[field[:-1]])
+            else:
+                update.append(payload[field])
+        with self._cond:
+            if room not in self._members:
+                return
+            self._latest[room] = update
+            self._dirty.add(room)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="live-updates")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._dirty and not self._catch_up_ready():
+                    self._cond.wait()
+            # Let samples arriving in the meantime join this frame
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _catch_up_ready(self):
+        return any(rooms and self._unacked.get(sid, 0) < self.max_unacked
+                   for sid, rooms in self._behind.items())
+
+    def _frame(self, updates):
+        self._seq += 1
+        return {'seq': self._seq, 'u': updates}
+
+    def flush(self):
+        """Send every pending update; return the number of frames sent."""
+        broadcasts, direct = [], []
+        with self._cond:
+            for room in self._dirty:
+                members = self._members.get(room, ())
+                slow = [sid for sid in members if self._unacked.get(sid, 0) >= self.max_unacked]
+                for sid in slow:
+                    self._behind.setdefault(sid, set()).add(room)
+                ready = [sid for sid in members if sid not in slow]
+                for sid in ready:
+                    self._unacked[sid] += 1
+                    self._behind.get(sid, set()).discard(room)
+                if ready:
+                    broadcasts.append((room, self._frame([self._latest[room]]), slow))
+            self._dirty.clear()
+            for sid, rooms in self._behind.items():
+                if rooms and self._unacked.get(sid, 0) < self.max_unacked:
+                    self._unacked[sid] += 1
+                    direct.append((sid, self._frame([self._latest[room] for room in sorted(rooms)])))
+                    rooms.clear()
+
+        for room, frame, slow in broadcasts:
+            self.socketio.emit(BATCH_EVENT, frame, to=room, skip_sid=slow or None, namespace=self.namespace)
+        for sid, frame in direct:
+            self.socketio.emit(BATCH_EVENT, frame, to=sid, namespace=self.namespace)
+        return len(broadcasts) + len(direct)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'rooms': len(self._members),
+                'clients': len(self._rooms_by_sid),
+                'slow_clients': sum(1 for n in self._unacked.values() if n >= self.max_unacked)
+            }
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Load test the panel server against simulated devices (see fake_adb.py).
+
+Starts run.py in production mode with the given SERVER_MODE, then ramps up
+load level by level: M concurrent HTTP clients firing requests at the /api
+routes and N Socket.IO clients that start storage or cache monitors and
+acknowledge every frame like the browser does. For each level it reports
+throughput and latency percentiles of the HTTP requests, how late monitor
+updates arrive (event lag), and the server's OS thread count and RSS, so the
+saturation point shows up as the level where throughput stops rising or lag
+takes off. With a cooperative server, throughput should keep rising with
+concurrency while the thread count stays flat.
+
+Socket clients speak Engine.IO long-polling over urllib, so no client
+library is needed; every client holds one pending poll like a browser that
+cannot upgrade to WebSocket.
+
+    python load_test.py --mode eventlet --mode threading --concurrency 1,10,50,200
+    python load_test.py --endpoint mix --concurrency 5,10,20 --sockets 10,50,100 --save run.json
+    python load_test.py --endpoint mix --concurrency 5,10,20 --sockets 10,50,100 --compare run.json
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import fake_adb
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+STARTUP_TIMEOUT = 30
+
+# Seconds a socket client may take to get its monitor started
+SOCKET_START_TIMEOUT = 30
+
+# Engine.IO packets in one polling payload are separated by this character
+PACKET_SEPARATOR = "\x1e"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def proc_status(pid, field):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def os_threads(pid):
+    return proc_status(pid, "Threads")
+
+
+def rss_mb(pid):
+    kb = proc_status(pid, "VmRSS")
+    return round(kb / 1024, 1) if kb is not None else None
+
+
+def start_server(mode, port, env):
+    env = dict(env, FLASK_ENV="production", SERVER_MODE=mode, PORT=str(port))
+    proc = subprocess.Popen([sys.executable, "run.py"], cwd=HERE, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/api/devices", timeout=2).read()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise RuntimeError(f"{mode} server exited with status {proc.returncode}")
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{mode} server did not start in {STARTUP_TIMEOUT}s")
+
+
+def request(url, body):
+    data = json.dumps(body).encode() if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    started = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=120) as response:
+        ok = json.loads(response.read()).get('success', False)
+    return time.perf_counter() - started, ok
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+class SocketClient(threading.Thread):
+    """One simulated browser watching storage or a package's cache.
+
+    Every update's server timestamp is compared with its arrival time; the
+    lags land in the shared LagLog.
+    """
+
+    def __init__(self, port, device, lag_log, package=None):
+        super().__init__(daemon=True)
+        self.base = f"http://127.0.0.1:{port}/socket.io/?EIO=4&transport=polling"
+        self.device = device
+        self.package = package
+        self.lag_log = lag_log
+        self.sid = None
+        self.started = threading.Event()
+        self.start_latency = None
+        self.error = None
+        self.frames = 0
+        self._closing = threading.Event()
+
+    def _url(self):
+        return f"{self.base}&sid={self.sid}&t={time.time_ns()}" if self.sid else f"{self.base}&t={time.time_ns()}"
+
+    def _get(self):
+        with urllib.request.urlopen(self._url(), timeout=60) as response:
+            return response.read().decode()
+
+    def _send(self, *packets):
+        req = urllib.request.Request(self._url(), data=PACKET_SEPARATOR.join(packets).encode(),
+                                     headers={'Content-Type': 'text/plain;charset=UTF-8'})
+        with urllib.request.urlopen(req, timeout=60) as response:
+            response.read()
+
+    def _event(self, name, data):
+        return "42" + json.dumps([name, data])
+
+    def run(self):
+        requested = time.perf_counter()
+        try:
+            handshake = self._get()
+            self.sid = json.loads(handshake[1:])['sid']
+            self._send("40")
+            if self.package:
+                start = self._event('start_cache_monitoring', {'device': self.device, 'package_name': self.package})
+            else:
+                start = self._event('start_monitoring', {'device': self.device})
+            sent_start = False
+            while not self._closing.is_set():
+                replies = []
+                for packet in self._get().split(PACKET_SEPARATOR):
+                    if packet == "2":
+                        replies.append("3")
+                    elif packet.startswith("40") and not sent_start:
+                        replies.append(start)
+                        sent_start = True
+                    elif packet.startswith("42"):
+                        name, data = json.loads(packet[2:])[:2]
+                        replies.extend(self._on_event(name, data, requested))
+                    elif packet == "1":
+                        return
+                if replies and not self._closing.is_set():
+                    self._send(*replies)
+        except Exception as e:
+            if not self._closing.is_set():
+                self.error = str(e)
+                self.lag_log.error()
+        finally:
+            self.started.set()
+
+    def _on_event(self, name, data, requested):
+        if name in ('monitoring_started', 'cache_monitoring_started'):
+            self.start_latency = time.perf_counter() - requested
+            self.started.set()
+        elif name in ('monitoring_error', 'cache_monitoring_error') and not data.get('retrying'):
+            self.error = data.get('error')
+            self.lag_log.error()
+        elif name == 'monitor_batch':
+            self.frames += 1
+            if self.frames > 1:
+                # The first frame may be the room's latest sample, taken before joining
+                now = time.time()
+                self.lag_log.add([now - update[3] for update in data['u']])
+            return [self._event('monitor_ack', data['seq'])]
+        return []
+
+    def close(self):
+        self._closing.set()
+        if self.sid:
+            try:
+                self._send("41", "1")
+            except OSError:
+                pass
+
+
+class LagLog:
+    """Event lags and socket errors of every client, read per level."""
+
+    def __init__(self):
+        self.lags = []
+        self.frames = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add(self, lags):
+        with self._lock:
+            self.lags.extend(lags)
+            self.frames += 1
+
+    def error(self):
+        with self._lock:
+            self.errors += 1
+
+    def take(self):
+        with self._lock:
+            taken = (self.lags, self.frames, self.errors)
+            self.lags, self.frames, self.errors = [], 0, 0
+        return taken
+
+
+def connect_sockets(port, clients, count, devices, packages, lag_log):
+    """Grow clients to count; every other client watches a package's cache."""
+    new = []
+    for i in range(len(clients), count):
+        device = devices[i % len(devices)]
+        package = f"com.fake.app{(i // 2) % packages:04d}" if i % 2 else None
+        client = SocketClient(port, device, lag_log, package)
+        client.start()
+        new.append(client)
+    deadline = time.time() + SOCKET_START_TIMEOUT
+    for client in new:
+        client.started.wait(max(0, deadline - time.time()))
+    clients.extend(new)
+    return [c.start_latency for c in new if c.start_latency is not None]
+
+
+def run_level(port, pid, targets, concurrency, total, lag_log=None, min_seconds=0):
+    """Send total requests to targets [(path, body), ...] from concurrency client threads.
+
+    The level lasts at least min_seconds, so socket clients get time to
+    receive updates; returns the stats.
+    """
+    latencies, errors, peak = [], [0], {'threads': 0, 'rss': 0}
+    lock = threading.Lock()
+    counter = iter(range(total if concurrency else 0))
+    if lag_log:
+        lag_log.take()
+
+    def client():
+        for i in counter:
+            path, body = targets[i % len(targets)]
+            try:
+                elapsed, ok = request(f"http://127.0.0.1:{port}{path}", body)
+            except OSError:
+                elapsed, ok = None, False
+            with lock:
+                if elapsed is not None:
+                    latencies.append(elapsed)
+                errors[0] += not ok
+
+    def sample_server():
+        while any(t.is_alive() for t in clients) or time.perf_counter() - started < min_seconds:
+            peak['threads'] = max(peak['threads'], os_threads(pid) or 0)
+            peak['rss'] = max(peak['rss'], rss_mb(pid) or 0)
+            time.sleep(0.05)
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for t in clients:
+        t.start()
+    sampler = threading.Thread(target=sample_server)
+    sampler.start()
+    for t in clients:
+        t.join()
+    http_wall = time.perf_counter() - started
+    sampler.join()
+    wall = time.perf_counter() - started
+    lags, frames, socket_errors = lag_log.take() if lag_log else ([], 0, 0)
+    return {
+        'concurrency': concurrency,
+        'requests': len(latencies) + errors[0] if concurrency else 0,
+        'errors': errors[0],
+        'req_per_s': round(len(latencies) / http_wall, 1) if latencies else 0.0,
+        'p50_ms': ms(percentile(latencies, 50)) if latencies else None,
+        'p95_ms': ms(percentile(latencies, 95)) if latencies else None,
+        'p99_ms': ms(percentile(latencies, 99)) if latencies else None,
+        'frames_per_s': round(frames / wall, 1),
+        'lag_p50_ms': ms(percentile(lags, 50)) if lags else None,
+        'lag_p95_ms': ms(percentile(lags, 95)) if lags else None,
+        'socket_errors': socket_errors,
+        'peak_threads': peak['threads'],
+        'peak_rss_mb': peak['rss'],
+    }
+
+
+def http_targets(endpoint, devices):
+    """[(path, body), ...] cycled through by the HTTP clients."""
+    if endpoint == "devices":
+        return [('/api/devices', None)]
+    storage = [('/api/storage/free', {'device': device}) for device in devices]
+    if endpoint == "storage_free":
+        return storage
+    # mix: the read routes a dashboard polls, spread over the devices
+    targets = []
+    for device, free in zip(devices, storage):
+        targets += [('/api/devices', None), free,
+                    ('/api/cache/calculate', {'device': device, 'package_filter': '.', 'top_n': 5}),
+                    ('/api/monitors', None)]
+    return targets
+
+
+def saturation(levels, max_lag_ms):
+    """First level whose throughput no longer rises with load, or whose lag exceeds max_lag_ms."""
+    for previous, level in zip(levels, levels[1:]):
+        more_load = (level['concurrency'] > previous['concurrency']
+                     and previous['req_per_s'] and level['req_per_s'] < previous['req_per_s'] * 1.1)
+        if more_load or (level['lag_p95_ms'] or 0) > max_lag_ms:
+            return level
+    return None
+
+
+def regressions(baseline, results, tolerance):
+    """Levels where throughput fell or p95 latency or lag rose by more than tolerance."""
+    found = []
+    for mode, levels in results.items():
+        before = {(r['concurrency'], r.get('sockets', 0)): r for r in baseline.get(mode, [])}
+        for level in levels:
+            old = before.get((level['concurrency'], level['sockets']))
+            if not old:
+                continue
+            if old['req_per_s'] and level['req_per_s'] < old['req_per_s'] * (1 - tolerance):
+                found.append(f"{mode} {level['concurrency']}/{level['sockets']}: "
+                             f"{level['req_per_s']} req/s, was {old['req_per_s']}")
+            for key in ('p95_ms', 'lag_p95_ms'):
+                if old.get(key) and level[key] and level[key] > old[key] * (1 + tolerance):
+                    found.append(f"{mode} {level['concurrency']}/{level['sockets']}: "
+                                 f"{key} {level[key]}, was {old[key]}")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the panel server against simulated devices")
+    parser.add_argument("--mode", action="append", choices=["eventlet", "threading"],
+                        help="SERVER_MODE to test (repeatable, default: eventlet)")
+    parser.add_argument("--concurrency", default="1,10,50,100",
+                        help="Comma separated HTTP client counts per level (default: 1,10,50,100)")
+    parser.add_argument("--sockets", default="0",
+                        help="Comma separated Socket.IO client counts per level; the last one repeats "
+                             "(default: 0)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per level (default: 200)")
+    parser.add_argument("--endpoint", choices=["storage_free", "devices", "mix"], default="storage_free",
+                        help="Endpoint to load (default: storage_free, spread over all devices; "
+                             "mix cycles through the dashboard's read routes)")
+    parser.add_argument("--level-seconds", type=float, default=5,
+                        help="Minimum length of a level, for the monitors to deliver (default: 5)")
+    parser.add_argument("--devices", type=int, default=8, help="Number of fake devices (default: 8)")
+    parser.add_argument("--packages", type=int, default=20, help="Packages per fake device (default: 20)")
+    parser.add_argument("--latency", type=float, default=0.05,
+                        help="Seconds added to every adb call (default: 0.05)")
+    parser.add_argument("--max-lag-ms", type=float, default=2000,
+                        help="Event lag p95 that counts as saturated (default: 2000)")
+    parser.add_argument("--save", help="Write the results to this JSON file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run; exit 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative change counted as a regression (default: 0.2)")
+    args = parser.parse_args()
+    levels = [int(c) for c in args.concurrency.split(",")]
+    sockets = [int(c) for c in args.sockets.split(",")]
+    sockets += [sockets[-1]] * (len(levels) - len(sockets))
+
+    home = tempfile.mkdtemp(prefix="cache-load-")
+    bin_dir = fake_adb.setup(home, args.devices, args.packages, latency=args.latency, rooted=True)
+    devices = fake_adb.load_config(home)['devices']
+    env = dict(os.environ, PATH=bin_dir + os.pathsep + os.environ.get("PATH", ""),
+               SCAN_INDEX_DB=os.path.join(home, "scan_index.db"), HISTORY_DIR=os.path.join(home, "history"))
+    targets = http_targets(args.endpoint, devices)
+    print(f"🧪 {args.devices} fake device(s), {args.latency}s adb latency, {args.endpoint}, work dir {home}")
+
+    results = {}
+    for mode in args.mode or ["eventlet"]:
+        port = free_port()
+        server = start_server(mode, port, env)
+        print(f"\n🚀 {mode} server (pid {server.pid}, {os_threads(server.pid)} threads, "
+              f"{rss_mb(server.pid)} MB idle)")
+        print(f"{'clients':>8} {'sockets':>8} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} "
+              f"{'errors':>7} {'lag p50':>8} {'lag p95':>8} {'frames/s':>9} {'threads':>8} {'rss MB':>7}")
+        lag_log, socket_clients = LagLog(), []
+        try:
+            results[mode] = []
+            for concurrency, socket_count in zip(levels, sockets):
+                start_latencies = connect_sockets(port, socket_clients, socket_count, devices,
+                                                  args.packages, lag_log)
+                r = run_level(port, server.pid, targets, concurrency, max(args.requests, concurrency),
+                              lag_log, args.level_seconds if socket_clients else 0)
+                r['sockets'] = len(socket_clients)
+                r['socket_start_p95_ms'] = ms(percentile(start_latencies, 95)) if start_latencies else None
+                results[mode].append(r)
+                print(f"{r['concurrency']:>8} {r['sockets']:>8} {r['req_per_s']:>8} {str(r['p50_ms']):>9} "
+                      f"{str(r['p95_ms']):>9} {str(r['p99_ms']):>9} {r['errors'] + r['socket_errors']:>7} "
+                      f"{str(r['lag_p50_ms']):>8} {str(r['lag_p95_ms']):>8} {r['frames_per_s']:>9} "
+                      f"{r['peak_threads']:>8} {r['peak_rss_mb']:>7}")
+        finally:
+            for client in socket_clients:
+                client.close()
+            server.terminate()
+            server.wait()
+        saturated = saturation(results[mode], args.max_lag_ms)
+        if saturated:
+            print(f"📉 {mode} saturates at {saturated['concurrency']} clients / {saturated['sockets']} sockets")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({'settings': vars(args), 'results': results}, f, indent=2)
+        print(f"\n💾 Results saved to {args.save}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(json.load(f)['results'], results, args.tolerance)
+        for line in found:
+            print(f"⚠️  Regression: {line}")
+        if found:
+            sys.exit(1)
+        print(f"\n✅ No regressions against {args.compare}")
+
+
+if __name__ == "__main__":
+    main()
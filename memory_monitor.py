@@ -0,0 +1,93 @@
+"""
+Device memory and memory-pressure sampling for the live monitors.
+
+`dumpsys meminfo` walks every process through binder and takes seconds of
+CPU, enough to disturb the pressure it is supposed to measure. A sample here
+is one shell read of kernel files instead:
+
+    /proc/meminfo            total, free, available, cached and swap
+    /proc/pressure/memory    PSI: share of time tasks stalled on memory
+    /proc/<pid>/status       VmRSS of each watched package's main process
+
+Process ids come from one `pidof` per package, and the status files are
+read with shell builtins, so a sample costs a couple of short-lived
+processes on the device. Kernels without PSI report None for its fields.
+"""
+
+from adb_shell import COMMAND_TIMEOUTS, run_adb, shell_quote
+
+# Packages whose RSS one target can follow
+MAX_PACKAGES = 10
+
+# The sample is a multi-line script, whose kind would get the long "script"
+# deadline; it only reads /proc, so it is held to the df deadline instead
+SAMPLE_TIMEOUT = COMMAND_TIMEOUTS["df"]
+
+MEMINFO_FIELDS = {
+    'MemTotal': 'total_kb',
+    'MemFree': 'free_kb',
+    'MemAvailable': 'available_kb',
+    'Cached': 'cached_kb',
+    'SwapTotal': 'swap_total_kb',
+    'SwapFree': 'swap_free_kb',
+}
+
+PSI_FIELDS = ('psi_some_avg10', 'psi_some_avg60', 'psi_full_avg10', 'psi_full_avg60')
+
+
+def sample_command(packages=()):
+    """One shell script printing meminfo, PSI and the RSS of packages."""
+    lines = ["cat /proc/meminfo", "echo @PSI", "cat /proc/pressure/memory 2>/dev/null"]
+    for package in packages:
+        quoted = shell_quote(package)
+        lines.append(
+            f"rss=; for pid in $(pidof {quoted}); do "
+            f"while read -r key value unit; do [ \"$key\" = VmRSS: ] && rss=$value; done < /proc/$pid/status; "
+            f"break; done; echo @RSS {quoted} $rss")
+    return "\n".join(lines)
+
+
+def parse_sample(out, packages=()):
+    """Numeric memory figures from sample_command output.
+
+    rss_kb lists the RSS of packages in order, None for packages that are
+    not running.
+    """
+    sample = {name: None for name in list(MEMINFO_FIELDS.values()) + list(PSI_FIELDS)}
+    rss = {}
+    section = "meminfo"
+    for line in out.splitlines():
+        parts = line.split()
+        if not parts:
+            continue
+        if parts[0] == "@PSI":
+            section = "psi"
+        elif parts[0] == "@RSS":
+            if len(parts) > 2 and parts[2].isdigit():
+                rss[parts[1]] = int(parts[2])
+        elif section == "meminfo":
+            name = MEMINFO_FIELDS.get(parts[0].rstrip(":"))
+            if name and len(parts) > 1 and parts[1].isdigit():
+                sample[name] = int(parts[1])
+        elif parts[0] in ("some", "full"):
+            averages = dict(part.split("=", 1) for part in parts[1:] if "=" in part)
+            for window in ("avg10", "avg60"):
+                if window in averages:
+                    sample[f"psi_{parts[0]}_{window}"] = float(averages[window])
+    if sample['available_kb'] is None and sample['free_kb'] is not None:
+        # Kernels before 3.14 have no MemAvailable
+        sample['available_kb'] = sample['free_kb'] + (sample['cached_kb'] or 0)
+    sample['rss_kb'] = [rss.get(package) for package in packages]
+    return sample
+
+
+def read_memory(device, packages=()):
+    """Memory figures of device, or None if /proc/meminfo could not be read.
+
+    Raises AdbTimeout if the device does not answer within SAMPLE_TIMEOUT.
+    """
+    out, err = run_adb(device, ["shell", sample_command(packages)], timeout=SAMPLE_TIMEOUT)
+    sample = parse_sample(out, packages)
+    if sample['total_kb'] is None:
+        return None
+    return sample
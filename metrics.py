@@ -0,0 +1,185 @@
+"""
+In-process metrics in the Prometheus text format.
+
+Every adb invocation is timed and counted by device, command kind (du, df,
+pm, dd, rm, ...) and the endpoint that caused it. The endpoint travels in a
+context variable: app.py sets it per request, multi_device and jobs copy the
+context into their worker threads, and the monitors set their own name.
+Each request also collects a summary of its adb calls and time.
+
+Only counters, gauges and histograms are implemented, which is all the
+/metrics endpoint needs; no client library is required.
+"""
+
+import contextvars
+import os
+import threading
+import time
+
+ADB_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+REQUEST_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+CALL_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Shell commands that get their own kind label; anything else is "other",
+# and multi-command scripts are "script"
+KNOWN_KINDS = {"du", "df", "pm", "dd", "rm", "stat", "find", "ls", "id", "touch",
+               "truncate", "fallocate", "cat", "tar", "inotifyd", "getprop", "dumpsys"}
+SCRIPT_WORDS = {"for", "if", "while", "echo", "set", "{", "(", "sh"}
+
+current_endpoint = contextvars.ContextVar("endpoint", default="-")
+current_summary = contextvars.ContextVar("summary", default=None)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{_labels(self.label_names, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=ADB_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # per-bucket counts, then sum and count
+                counts = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def _render_value(self, key, counts):
+        lines = []
+        for bound, count in zip(self.buckets, counts):
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', bound)])} {count}")
+        lines.append(f"{self.name}_bucket{_labels(self.label_names, key, [('le', '+Inf')])} {counts[-1]}")
+        lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {round(counts[-2], 6)}")
+        lines.append(f"{self.name}_count{_labels(self.label_names, key)} {counts[-1]}")
+        return lines
+
+
+adb_commands = Counter("cache_panel_adb_commands_total", "adb invocations",
+                       ("device", "kind", "endpoint", "status"))
+adb_seconds = Histogram("cache_panel_adb_command_seconds", "adb invocation latency",
+                        ("device", "kind", "endpoint"))
+http_requests = Counter("cache_panel_http_requests_total", "HTTP requests", ("endpoint", "status"))
+http_seconds = Histogram("cache_panel_http_request_seconds", "HTTP request latency",
+                         ("endpoint",), REQUEST_BUCKETS)
+request_adb_calls = Histogram("cache_panel_request_adb_calls", "adb calls made by one HTTP request",
+                              ("endpoint",), CALL_BUCKETS)
+request_adb_seconds = Histogram("cache_panel_request_adb_seconds", "adb time spent by one HTTP request",
+                                ("endpoint",), REQUEST_BUCKETS)
+result_cache = Counter("cache_panel_result_cache_total", "Read results served fresh, from cache or shared in flight",
+                       ("name", "outcome"))
+monitor_lag = Gauge("cache_panel_monitor_lag_seconds", "How late the last monitor poll started",
+                    ("metric",))
+monitor_poll_seconds = Histogram("cache_panel_monitor_poll_seconds", "Monitor sample duration",
+                                 ("metric",))
+monitor_targets = Gauge("cache_panel_monitor_targets", "Targets polled by the monitor scheduler")
+process_start = Gauge("cache_panel_process_start_time_seconds", "Start time of the process")
+process_start.set(time.time())
+
+
+class RequestSummary:
+    """adb calls and time collected for one request."""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.calls += 1
+            self.seconds += seconds
+
+
+def command_kind(command):
+    """Short label for an adb argv like ["shell", "du -s ..."]."""
+    if not command:
+        return "other"
+    if command[0] not in ("shell", "exec-out"):
+        return command[0]
+    words = " ".join(command[1:]).split()
+    if not words:
+        return "shell"
+    first = os.path.basename(words[0])
+    if first in SCRIPT_WORDS or "\n" in " ".join(command[1:]):
+        return "script"
+    return first if first in KNOWN_KINDS else "other"
+
+
+def observe_adb(device, command, seconds, ok=True):
+    endpoint = current_endpoint.get()
+    kind = command_kind(command)
+    adb_commands.inc(device or "-", kind, endpoint, "ok" if ok else "error")
+    adb_seconds.observe(seconds, device or "-", kind, endpoint)
+    summary = current_summary.get()
+    if summary is not None:
+        summary.add(seconds)
+
+
+def run_in_context(func):
+    """Wrap func so it runs in a copy of the caller's context (endpoint label)."""
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(func, *args, **kwargs)
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
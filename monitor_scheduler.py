@@ -0,0 +1,196 @@
+"""
+Shared polling scheduler for the live monitors.
+
+Every watched target is keyed by (device, metric, package) and polled once
+no matter how many clients watch it. Clients hold reference-counted
+subscriptions; a target stops being polled when its last subscriber leaves.
+One scheduler thread decides what is due and hands the polls to a small
+worker pool, so a slow device cannot hold up the others.
+
+The poll interval adapts per target: it backs off while the sampled value
+stays the same and snaps back to the base interval as soon as it changes.
+
+A target whose device times out or is unavailable (see device_health)
+keeps its subscribers and is retried at the longest interval; its clients
+get one error event with "retrying": true. Any other error ends the target.
+
+With a LiveUpdates instance, samples are published to the target's room
+once instead of being emitted to every subscriber.
+"""
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from adb_shell import AdbTimeout, DeviceUnavailable
+
+BASE_INTERVAL = float(os.environ.get("MONITOR_INTERVAL", 2))
+MAX_INTERVAL = float(os.environ.get("MONITOR_MAX_INTERVAL", 10))
+BACKOFF = 1.5
+MONITOR_WORKERS = int(os.environ.get("MONITOR_WORKERS", 4))
+
+
+class Metric:
+    def __init__(self, name, sample, event, error_event):
+        self.name = name
+        self.sample = sample
+        self.event = event
+        self.error_event = error_event
+
+
+class _Target:
+    def __init__(self, key):
+        self.key = key
+        self.subscribers = set()
+        self.interval = BASE_INTERVAL
+        self.next_due = time.time()
+        self.last_value = None
+        self.in_flight = False
+        self.failing = False
+
+
+def _comparable(payload):
+    return {k: v for k, v in payload.items() if k != 'timestamp'}
+
+
+class MonitorScheduler:
+    def __init__(self, emit, base_interval=BASE_INTERVAL, max_interval=MAX_INTERVAL, workers=MONITOR_WORKERS,
+                 live=None):
+        self.emit = emit
+        self.live = live
+        self.base_interval = base_interval
+        self.max_interval = max_interval
+        self._metrics = {}
+        self._targets = {}
+        self._by_sid = {}
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="monitor")
+        self._thread = None
+
+    def register(self, name, sample, event, error_event):
+        """sample(device, package) returns the payload dict to emit."""
+        self._metrics[name] = Metric(name, sample, event, error_event)
+
+    def subscribe(self, sid, device, metric, package=None):
+        """Watch (device, metric, package) for sid, replacing sid's previous target for metric."""
+        key = (device, metric, package)
+        with self._cond:
+            subscriptions = self._by_sid.setdefault(sid, {})
+            previous = subscriptions.get(metric)
+            if previous == key:
+                return
+            if previous is not None:
+                self._remove(sid, previous)
+            target = self._targets.get(key)
+            if target is None:
+                target = self._targets[key] = _Target(key)
+                target.interval = self.base_interval
+            target.subscribers.add(sid)
+            subscriptions[metric] = key
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="monitor-scheduler")
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def unsubscribe(self, sid, metric=None):
+        """Drop sid's subscription for metric, or all of them."""
+        with self._cond:
+            subscriptions = self._by_sid.get(sid, {})
+            for name in [metric] if metric else list(subscriptions):
+                key = subscriptions.get(name)
+                if key is not None:
+                    self._remove(sid, key)
+            if not subscriptions:
+                self._by_sid.pop(sid, None)
+
+    def _remove(self, sid, key):
+        target = self._targets.get(key)
+        if target is not None:
+            target.subscribers.discard(sid)
+            if not target.subscribers:
+                del self._targets[key]
+        subscriptions = self._by_sid.get(sid, {})
+        if subscriptions.get(key[1]) == key:
+            del subscriptions[key[1]]
+
+    def targets(self):
+        with self._cond:
+            return [{
+                'device': t.key[0],
+                'metric': t.key[1],
+                'package': t.key[2],
+                'subscribers': len(t.subscribers),
+                'interval_s': round(t.interval, 2)
+            } for t in self._targets.values()]
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                now = time.time()
+                metrics.monitor_targets.set(len(self._targets))
+                waiting = [t for t in self._targets.values() if not t.in_flight]
+                for target in waiting:
+                    if target.next_due <= now:
+                        target.in_flight = True
+                        self._pool.submit(self._poll, target)
+                pending = [t.next_due for t in waiting if not t.in_flight]
+                self._cond.wait(timeout=max(0, min(pending) - now) if pending else None)
+
+    def _poll(self, target):
+        device, name, package = target.key
+        metric = self._metrics[name]
+        metrics.current_endpoint.set(f"monitor:{name}")
+        metrics.current_summary.set(None)
+        started = time.time()
+        metrics.monitor_lag.set(round(max(0.0, started - target.next_due), 3), name)
+        try:
+            payload = metric.sample(device, package)
+        except (AdbTimeout, DeviceUnavailable) as e:
+            with self._cond:
+                notify = not target.failing
+                target.failing = True
+                target.interval = self.max_interval
+                target.in_flight = False
+                target.next_due = time.time() + target.interval
+                subscribers = list(target.subscribers)
+                self._cond.notify()
+            if notify:
+                for sid in subscribers:
+                    self.emit(metric.error_event, {'error': str(e), 'retrying': True}, to=sid)
+            return
+        except Exception as e:
+            with self._cond:
+                subscribers = list(target.subscribers)
+                for sid in subscribers:
+                    self._remove(sid, target.key)
+            if self.live:
+                self.live.close(name, device, package)
+            for sid in subscribers:
+                self.emit(metric.error_event, {'error': str(e)}, to=sid)
+            return
+        metrics.monitor_poll_seconds.observe(time.time() - started, name)
+
+        with self._cond:
+            target.failing = False
+            if payload is not None:
+                value = _comparable(payload)
+                if value == target.last_value:
+                    target.interval = min(target.interval * BACKOFF, self.max_interval)
+                else:
+                    target.interval = self.base_interval
+                target.last_value = value
+            target.in_flight = False
+            target.next_due = time.time() + target.interval
+            subscribers = list(target.subscribers)
+            self._cond.notify()
+
+        if payload is None:
+            return
+        if self.live:
+            self.live.publish(name, device, package, payload)
+            return
+        for sid in subscribers:
+            self.emit(metric.event, payload, to=sid)
@@ -0,0 +1,130 @@
+"""
+Run device operations across many devices concurrently.
+
+A shared thread pool caps how many device operations run at once in the
+whole process, and a per-device slot caps how many of them may hit the
+same phone at the same time. Results are collected per device.
+
+Work for a busy device waits in that device's queue and is only handed to
+the pool once a slot frees up, so it never ties up a pool worker that an
+idle device could use.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+# Target accepted by the API in place of a serial to fan out to every device
+ALL_DEVICES = "all"
+
+MAX_PARALLEL_DEVICES = int(os.environ.get("MAX_PARALLEL_DEVICES", 16))
+MAX_OPS_PER_DEVICE = int(os.environ.get("MAX_OPS_PER_DEVICE", 1))
+
+_executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_DEVICES, thread_name_prefix="device")
+_device_slots = {}
+_slots_lock = threading.Lock()
+
+
+class DeviceSlot:
+    """Limits concurrent operations on one device.
+
+    Use it as a context manager to wait for a slot in the calling thread, or
+    submit() work to run on the shared pool once a slot is free.
+    """
+
+    def __init__(self, limit):
+        self._semaphore = threading.BoundedSemaphore(limit)
+        self._pending = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self, blocking=True, timeout=None):
+        return self._semaphore.acquire(blocking, timeout)
+
+    def release(self):
+        with self._lock:
+            task = self._pending.popleft() if self._pending else None
+            if task is None:
+                self._semaphore.release()
+                return
+        # Hand the slot straight to the next queued task
+        self._start(task)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def submit(self, fn, *args):
+        """Future of fn(*args), run on the pool while holding the slot."""
+        future = Future()
+
+        def task():
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(fn(*args))
+                except BaseException as e:
+                    future.set_exception(e)
+
+        with self._lock:
+            if not self._semaphore.acquire(blocking=False):
+                self._pending.append(task)
+                return future
+        self._start(task)
+        return future
+
+    def _start(self, task):
+        _executor.submit(self._run, task)
+
+    def _run(self, task):
+        try:
+            task()
+        finally:
+            self.release()
+
+
+def device_slot(device):
+    """Slot limiting concurrent operations on one device."""
+    with _slots_lock:
+        if device not in _device_slots:
+            _device_slots[device] = DeviceSlot(MAX_OPS_PER_DEVICE)
+        return _device_slots[device]
+
+
+def _run_one(func, device, args, kwargs):
+    started = time.time()
+    try:
+        result = func(device, *args, **kwargs)
+        outcome = {'success': True, 'result': result}
+    except Exception as e:
+        outcome = {'success': False, 'error': str(e)}
+    outcome['elapsed_s'] = round(time.time() - started, 3)
+    return outcome
+
+
+def run_on_devices(func, devices, *args, per_device_slot=True, **kwargs):
+    """Call func(device, *args, **kwargs) for every device concurrently.
+
+    Returns {device: {'success', 'result' or 'error', 'elapsed_s'}} in the
+    order the devices were given. Long running functions that take the
+    device slot themselves, around each step, pass per_device_slot=False.
+    """
+    # One context copy per device: a Context can't be entered by two threads at once
+    futures = {device: (device_slot(device) if per_device_slot else _executor).submit(
+                   metrics.run_in_context(_run_one), func, device, args, kwargs)
+               for device in devices}
+    return {device: future.result() for device, future in futures.items()}
+
+
+def print_device_summary(results):
+    print("\n📱 Per-device results:")
+    for device, outcome in results.items():
+        if outcome['success']:
+            print(f"✅ {device}: done in {outcome['elapsed_s']}s")
+        else:
+            print(f"❌ {device}: {outcome['error']} ({outcome['elapsed_s']}s)")
@@ -0,0 +1,103 @@
+"""
+Per-device cache of installed packages.
+
+`pm list packages` is one of the slowest shell commands on Android, so the
+package list is fetched once per device and kept in memory. Before reusing
+it, a cheap `stat` of the package manager's state files is compared with the
+stamp taken at fetch time; the list is only refetched when that changes.
+Keyword and include/exclude filtering happen host-side on the cached list.
+"""
+
+import threading
+import time
+
+from adb_shell import run_adb
+
+# Package manager state files; their mtime/size change on install, removal
+# and update. Reading them needs root, which the panel enables anyway.
+PACKAGE_STATE_FILES = ["/data/system/packages.xml", "/data/system/packages.list"]
+
+# Without a readable stamp, reuse the cached list for this long
+FALLBACK_TTL = 60
+
+# Don't re-check the stamp more often than this
+STAMP_CHECK_INTERVAL = 2
+
+
+class _Entry:
+    def __init__(self, packages, stamp):
+        self.packages = packages
+        self.stamp = stamp
+        self.fetched_at = time.time()
+        self.checked_at = self.fetched_at
+
+
+class PackageIndex:
+    """In-memory package lists keyed by device serial."""
+
+    def __init__(self):
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def _device_lock(self, device):
+        with self._lock:
+            return self._locks.setdefault(device, threading.Lock())
+
+    def _stamp(self, device):
+        cmd = "stat -c '%n %Y %s' " + " ".join(PACKAGE_STATE_FILES) + " 2>/dev/null"
+        out, _ = run_adb(device, ["shell", cmd])
+        return out or None
+
+    def _fetch(self, device):
+        out, _ = run_adb(device, ["shell", "pm", "list", "packages"])
+        return [line.replace("package:", "").strip() for line in out.splitlines() if line.startswith("package:")]
+
+    def _fresh(self, device, entry):
+        now = time.time()
+        if now - entry.checked_at < STAMP_CHECK_INTERVAL:
+            return True
+        if entry.stamp is None:
+            return now - entry.fetched_at < FALLBACK_TTL
+        stamp = self._stamp(device)
+        entry.checked_at = now
+        return stamp == entry.stamp
+
+    def packages(self, device=""):
+        """Return every installed package on device, fetching only on change.
+
+        An empty or failed fetch (pm not ready, device gone) is not cached,
+        so the next call asks the device again.
+        """
+        with self._device_lock(device):
+            entry = self._entries.get(device)
+            if entry is None or not self._fresh(device, entry):
+                self._entries.pop(device, None)
+                stamp = self._stamp(device)
+                packages = self._fetch(device)
+                if not packages:
+                    return []
+                entry = _Entry(packages, stamp)
+                self._entries[device] = entry
+            return list(entry.packages)
+
+    def filter(self, device="", keyword="", include="", exclude=""):
+        """Packages containing keyword and include, and not containing exclude."""
+        packages = self.packages(device)
+        if keyword:
+            packages = [p for p in packages if keyword in p]
+        if include:
+            packages = [p for p in packages if include in p]
+        if exclude:
+            packages = [p for p in packages if exclude not in p]
+        return packages
+
+    def invalidate(self, device=None):
+        with self._lock:
+            if device is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(device, None)
+
+
+index = PackageIndex()
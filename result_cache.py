@@ -0,0 +1,114 @@
+"""
+Short-lived host-side cache of read results, with single-flight coalescing.
+
+Dashboards tend to refresh together, which used to send the same
+`adb devices`, `df` or `du` to a phone once per browser. Results are now
+kept for a per-endpoint TTL, and identical calls that arrive while one is
+running wait for it instead of starting their own.
+
+Every entry belongs to a device (or to no device). Operations that change a
+device invalidate it: its entries are dropped, calls in flight are not
+joined anymore, and results that were being computed during the change are
+not stored. Entries for "all" devices are dropped with any single device.
+"""
+
+import threading
+import time
+
+import metrics
+
+ALL_DEVICES = "all"
+
+# Expired entries are swept once the cache holds more than this
+MAX_ENTRIES = 256
+
+
+class _Call:
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResultCache:
+    def __init__(self):
+        self._entries = {}
+        self._calls = {}
+        self._generations = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    def _generation(self, device):
+        return (self._epoch, self._generations.get(device, 0))
+
+    def get(self, key, device, ttl, compute, cacheable=None):
+        """compute() for key, or a value shared with an identical recent or running call.
+
+        key is a tuple of hashable values starting with the name of the
+        result (its metrics label) and must include every argument that
+        changes it; cacheable(value) decides whether a value may be reused
+        (errors usually should not be).
+        """
+        name = key[0]
+        key = (device,) + tuple(key)
+        with self._lock:
+            generation = self._generation(device)
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.time() and entry[2] == generation:
+                metrics.result_cache.inc(name, "hit")
+                return entry[0]
+            call = self._calls.get(key)
+            if call is not None and call.generation == generation:
+                leader = False
+            else:
+                call = self._calls[key] = _Call(generation)
+                leader = True
+        metrics.result_cache.inc(name, "miss" if leader else "shared")
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            call.value = compute()
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+                unchanged = self._generation(device) == call.generation
+                if call.error is None and unchanged and (cacheable is None or cacheable(call.value)):
+                    self._entries[key] = (call.value, time.time() + ttl, call.generation)
+                    if len(self._entries) > MAX_ENTRIES:
+                        self._sweep()
+            call.done.set()
+
+    def _sweep(self):
+        now = time.time()
+        for key in [k for k, entry in self._entries.items() if entry[1] <= now]:
+            del self._entries[key]
+
+    def invalidate(self, device=None):
+        """Forget results for device (and for all devices), or everything."""
+        with self._lock:
+            if device is None:
+                self._entries.clear()
+                self._epoch += 1
+                return
+            for name in (device, ALL_DEVICES):
+                self._generations[name] = self._generations.get(name, 0) + 1
+            for key in [k for k in self._entries if k[0] in (device, ALL_DEVICES)]:
+                del self._entries[key]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'in_flight': len(self._calls)
+            }
@@ -2,11 +2,37 @@
 """
 Cache Management Web Panel
 Run this script to start the Flask web application
+
+SERVER_MODE selects the server:
+  eventlet  - cooperative server (default in production). The process is
+              monkey patched before the app is imported, so adb subprocesses,
+              pooled shell pipes and adb server sockets all yield to other
+              green threads instead of pinning an OS thread per wait.
+  threading - Werkzeug with one OS thread per request (default in development)
 """
 
 import os
 import sys
 
+# Worker limits for eventlet mode; green threads are cheap, so the pools that
+# bound concurrent adb work can be much larger than with OS threads
+GREEN_WORKER_DEFAULTS = {
+    'MAX_PARALLEL_DEVICES': '64',
+    'JOB_WORKERS': '16',
+    'MONITOR_WORKERS': '64',
+    'ADB_SESSIONS_PER_DEVICE': '4',
+    'ADB_POOL_SIZE': '4',
+}
+
+
+def server_mode(debug_mode):
+    mode = os.environ.get('SERVER_MODE') or ('threading' if debug_mode else 'eventlet')
+    if mode not in ('eventlet', 'threading'):
+        print(f"❌ Unknown SERVER_MODE '{mode}' (use eventlet or threading)")
+        sys.exit(1)
+    return mode
+
+
 def main():
     print("🚀 Starting Cache Management Web Panel...")
     print("📱 Make sure your Android device is connected via ADB")
@@ -17,9 +43,10 @@ def main():
     
     # Check if running in production mode
     debug_mode = os.environ.get('FLASK_ENV', 'development') != 'production'
+    mode = server_mode(debug_mode)
     
     if not debug_mode:
-        print("🔒 Running in production mode")
+        print(f"🔒 Running in production mode ({mode} server)")
     else:
         print("⏹️  Press Ctrl+C to stop the server")
     
@@ -31,12 +58,21 @@ def main():
     else:
         print("⚠️  Warning: Not running in a virtual environment")
     
+    if mode == 'eventlet':
+        # Must happen before anything imports socket, subprocess or threading
+        import eventlet
+        eventlet.monkey_patch()
+        for name, value in GREEN_WORKER_DEFAULTS.items():
+            os.environ.setdefault(name, value)
+    
     # Start the Flask application
     from app import app, socketio
     
-    # For production mode, allow unsafe werkzeug (required by Flask-SocketIO)
-    # Note: For true production, consider using gunicorn with gevent workers
-    if not debug_mode:
+    if mode == 'eventlet':
+        # Werkzeug is not used; eventlet.wsgi serves HTTP and WebSocket
+        socketio.run(app, debug=False, host='0.0.0.0', port=port, log_output=debug_mode)
+    elif not debug_mode:
+        # Threaded Werkzeug, kept for environments without eventlet
         socketio.run(app, debug=False, host='0.0.0.0', port=port, 
                     allow_unsafe_werkzeug=True)
     else:
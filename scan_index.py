@@ -0,0 +1,237 @@
+"""
+Incremental cache scans backed by a local SQLite index.
+
+The index keeps the last known cache size of every package per device. A
+rescan first asks the device which cache trees changed since the previous
+scan, using one `find -type d -newer <stamp>` per chunk of cache
+directories. Directories get a new mtime whenever an entry is created,
+removed or renamed in them, and `-type d` lets find skip stat'ing plain
+files. Only packages with a changed (or missing) directory are sized with
+`du` again; all others are answered from the index.
+
+Files that only grow in place do not touch any directory mtime, so every
+entry is also re-sized once it is older than FULL_RESCAN_AGE, and callers
+can force a full scan.
+
+The stamp is shared by every package filter of a device and user, so it
+only moves forward after a scan that covered every installed package in the
+index. Otherwise a scan of one filter would hide changes from the next scan
+of a different filter. Rows of uninstalled packages are dropped, so they do
+not hold the stamp back forever.
+
+Each size change is appended to a history table, which backs the trend
+queries (growth since the previous scan, top growers over a period).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from calculate_cache import MAX_SHELL_CMD_LEN, chunk_args, iter_cache_sizes
+from device import get_device
+from package_index import index as package_index
+
+SCAN_INDEX_DB = os.environ.get("SCAN_INDEX_DB") or os.path.join(
+    os.path.expanduser("~"), ".cache_panel", "scan_index.db")
+FULL_RESCAN_AGE = int(os.environ.get("SCAN_FULL_RESCAN_AGE", 3600))
+STAMP_DIR = "/data/local/tmp"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS sizes (
+    device TEXT, scope TEXT, package TEXT,
+    size_kb INTEGER, previous_kb INTEGER, scanned_at REAL, changed_at REAL,
+    PRIMARY KEY (device, scope, package)
+);
+CREATE TABLE IF NOT EXISTS history (
+    device TEXT, scope TEXT, package TEXT, ts REAL, size_kb INTEGER
+);
+CREATE INDEX IF NOT EXISTS history_lookup ON history (device, scope, package, ts);
+"""
+
+
+def _scope(user):
+    return "all" if user is None else str(user)
+
+
+def _package_of(line, data_dirs, packages):
+    """Package whose cache tree a find output or error line refers to."""
+    for root in data_dirs:
+        start = line.find(root + "/")
+        if start < 0:
+            continue
+        package = line[start + len(root) + 1:].split("/", 1)[0].strip("'\": ")
+        if package in packages:
+            return package
+    return None
+
+
+class ScanIndex:
+    def __init__(self, path=SCAN_INDEX_DB):
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(SCHEMA)
+        self._lock = threading.Lock()
+        row = self._db.execute("SELECT value FROM meta WHERE key = 'id'").fetchone()
+        if row is None:
+            row = (uuid.uuid4().hex[:12],)
+            self._db.execute("INSERT INTO meta VALUES ('id', ?)", row)
+            self._db.commit()
+        # The device-side stamp belongs to this index; another index (or a
+        # copy that was reset) must not trust it
+        self.id = row[0]
+
+    def _stamp(self, scope):
+        return f"{STAMP_DIR}/.cm_scan_{self.id}_{scope}"
+
+    def known(self, device, scope):
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT package, size_kb, scanned_at FROM sizes WHERE device = ? AND scope = ?",
+                (device, scope)).fetchall()
+        return {package: (size_kb, scanned_at) for package, size_kb, scanned_at in rows}
+
+    def changed_packages(self, device, packages, user=None):
+        """Packages whose cache tree changed since the stamp; None if there is no stamp.
+
+        Also starts the next stamp, so changes made while scanning are seen
+        by the following scan.
+        """
+        dev = get_device(device)
+        stamp = self._stamp(_scope(user))
+        if dev.shell(f"touch {stamp}.new; [ -f {stamp} ] && echo yes") != "yes":
+            return None
+        data_dirs = [path for uid, path in dev.user_dirs().items() if user is None or uid == user]
+        dirs = [d for pkg in packages for d in dev.cache_dirs(pkg, user)]
+        wanted, changed = set(packages), set()
+        for chunk in chunk_args(dirs, base_len=len(stamp) + 40):
+            out = dev.shell(f"find {' '.join(chunk)} -type d -newer {stamp} 2>&1")
+            for line in out.splitlines():
+                package = _package_of(line, data_dirs, wanted)
+                if package:
+                    changed.add(package)
+        return changed
+
+    def scan(self, device, packages, user=None, progress=None, full=False):
+        """Cache sizes of packages, re-sizing only what changed.
+
+        Returns (sizes, stats) where stats counts 'rescanned' and 'reused'
+        packages.
+        """
+        sizes, stats = {}, {'rescanned': 0, 'reused': 0}
+        for chunk, reused in self.scan_iter(device, packages, user, full):
+            sizes.update(chunk)
+            stats['reused' if reused else 'rescanned'] += len(chunk)
+            if progress and not reused:
+                progress(device, len(sizes), len(packages), list(chunk)[-1])
+        return sizes, stats
+
+    def scan_iter(self, device, packages, user=None, full=False, first_chunk_len=MAX_SHELL_CMD_LEN):
+        """Yield ({package: size_kb}, reused) as results become available.
+
+        Sizes served from the index come first in one batch, then one batch
+        per `du` round trip (see iter_cache_sizes). The index is updated
+        with whatever was measured, even if the caller stops early.
+        """
+        scope = _scope(user)
+        stamp = self._stamp(scope)
+        installed = set(package_index.packages(device))
+        known = self.known(device, scope)
+        if installed:
+            self._prune(device, scope, [pkg for pkg in known if pkg not in installed])
+            known = {pkg: value for pkg, value in known.items() if pkg in installed}
+        now = time.time()
+        if full or not known:
+            get_device(device).shell(f"touch {stamp}.new")
+            changed = None
+        else:
+            changed = self.changed_packages(device, packages, user)
+        if changed is None:
+            dirty = list(packages)
+        else:
+            dirty = [pkg for pkg in packages
+                     if pkg in changed or pkg not in known or now - known[pkg][1] > FULL_RESCAN_AGE]
+
+        dirty_set = set(dirty)
+        reused = {pkg: known[pkg][0] for pkg in packages if pkg not in dirty_set}
+        if reused:
+            yield reused, True
+
+        fresh = {}
+        try:
+            for chunk in iter_cache_sizes(dirty, device, user, first_chunk_len):
+                fresh.update(chunk)
+                yield chunk, False
+            # Only a complete scan of every indexed package may move the stamp forward
+            if set(known) <= set(packages):
+                get_device(device).shell(f"mv {stamp}.new {stamp}")
+        finally:
+            self._store(device, scope, fresh, known, now)
+
+    def _prune(self, device, scope, packages):
+        if not packages:
+            return
+        with self._lock:
+            self._db.executemany("DELETE FROM sizes WHERE device = ? AND scope = ? AND package = ?",
+                                 [(device, scope, pkg) for pkg in packages])
+            self._db.commit()
+
+    def _store(self, device, scope, fresh, known, now):
+        with self._lock:
+            for pkg, size_kb in fresh.items():
+                previous = known.get(pkg, (None, None))[0]
+                if previous != size_kb:
+                    self._db.execute("INSERT INTO history VALUES (?, ?, ?, ?, ?)",
+                                     (device, scope, pkg, now, size_kb))
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO sizes VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (device, scope, pkg, size_kb, previous, now, now))
+                else:
+                    self._db.execute(
+                        "UPDATE sizes SET scanned_at = ? WHERE device = ? AND scope = ? AND package = ?",
+                        (now, device, scope, pkg))
+            self._db.commit()
+
+    def trends(self, device, user=None, since=None, limit=10):
+        """Packages ordered by cache growth.
+
+        Without since, growth is the change seen by each package's latest
+        scan; with since (epoch seconds) it is measured against the size
+        recorded at that time.
+        """
+        scope = _scope(user)
+        with self._lock:
+            current = self._db.execute(
+                "SELECT package, size_kb, previous_kb, scanned_at, changed_at FROM sizes "
+                "WHERE device = ? AND scope = ?",
+                (device, scope)).fetchall()
+            baseline = {}
+            if since is not None:
+                baseline = dict(self._db.execute(
+                    "SELECT package, size_kb FROM history h WHERE device = ? AND scope = ? AND ts = "
+                    "(SELECT MAX(ts) FROM history WHERE device = h.device AND scope = h.scope "
+                    "AND package = h.package AND ts <= ?)",
+                    (device, scope, since)).fetchall())
+        growers = []
+        for package, size_kb, previous_kb, scanned_at, changed_at in current:
+            if since is None:
+                changed_last_scan = changed_at >= scanned_at and previous_kb is not None
+                base = previous_kb if changed_last_scan else size_kb
+            else:
+                base = baseline.get(package, 0 if changed_at > since else size_kb)
+            growers.append({
+                'package': package,
+                'size_kb': size_kb,
+                'growth_kb': size_kb - base,
+                'changed_at': changed_at
+            })
+        growers.sort(key=lambda g: g['growth_kb'], reverse=True)
+        return growers[:limit] if limit else growers
+
+    def forget(self, device):
+        with self._lock:
+            self._db.execute("DELETE FROM sizes WHERE device = ?", (device,))
+            self._db.commit()
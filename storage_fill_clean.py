@@ -1,41 +1,34 @@
 import os
 import random
 import string
-import subprocess
 import sys
 
-DEVICE_CMD = "adb"
+from adb_shell import run_adb, list_devices
+from multi_device import run_on_devices, print_device_summary
+from fill_engine import DEFAULT_STRATEGY, fill_files
 
 FILL_FILE_PREFIX = "fillfile_"
 FILL_DIR = "/sdcard/"
-
-def run_adb(device, command):
-    full_cmd = [DEVICE_CMD, "-s", device] + command
-    result = subprocess.run(full_cmd, capture_output=True, text=True)
-    return result.stdout.strip(), result.stderr.strip()
-
-def list_devices():
-    out, _ = run_adb("", ["devices"])
-    devices = []
-    for line in out.splitlines()[1:]:
-        if line.strip() and "device" in line:
-            devices.append(line.split()[0])
-    return devices
+# Target fills are split into files of this size (FAT-formatted cards cap
+# files at 4 GB) and stop correcting once within TARGET_TOLERANCE_KB
+FILL_CHUNK_MB = 1024
+TARGET_TOLERANCE_KB = 1024
+MAX_CORRECTIONS = 3
 
 def generate_random_name():
     return FILL_FILE_PREFIX + "".join(random.choices(string.ascii_lowercase + string.digits, k=6))
 
-def fill_storage(device, size_mb):
-    file_name = generate_random_name()
+def fill_storage(device, size_mb, strategy=DEFAULT_STRATEGY, count=1, progress=None):
+    """Write count fill files of size_mb each, batched into few shell calls."""
     size_bytes = size_mb * 1024 * 1024
-    file_path = os.path.join(FILL_DIR, file_name)
-    print(f"Filling storage on {device} with file {file_path} ({size_mb} MB)...")
-    cmd = f"dd if=/dev/zero of={file_path} bs={size_bytes} count=1"
-    out, err = run_adb(device, ["shell", cmd])
-    if err:
-        print(f"Error: {err}")
+    files = [(os.path.join(FILL_DIR, generate_random_name()), size_bytes) for _ in range(count)]
+    print(f"Filling storage on {device} with {count} file(s) of {size_mb} MB ({strategy})...")
+    report = fill_files(device, files, strategy, progress)
+    if report['failed']:
+        print(f"Error: could not write {', '.join(report['failed'])}")
     else:
-        print(f"Filled {file_path} successfully.")
+        print(f"Filled {len(report['written'])} file(s) successfully at {report['mb_per_s']} MB/s.")
+    return report
 
 def clean_storage(device):
     print(f"Cleaning storage on {device}...")
@@ -46,13 +39,91 @@ def clean_storage(device):
     else:
         print("Cleaned all fill files successfully.")
 
+def parse_df(out):
+    """Return (total_kb, used_kb, free_kb) from `df` output, or None."""
+    lines = out.strip().split("\n")
+    if len(lines) >= 2:
+        # Second line contains the actual data
+        data_line = lines[1].split()
+        if len(data_line) >= 4:
+            return int(data_line[1]), int(data_line[2]), int(data_line[3])
+    return None
+
+def read_df(device):
+    out, _ = run_adb(device, ["shell", "df", FILL_DIR])
+    return parse_df(out)
+
+def target_free_kb(total_kb, target_free_mb=None, target_percent=None):
+    """Free KB to leave, from either a free MB amount or a used percentage."""
+    if target_percent is not None:
+        return int(total_kb * (100 - float(target_percent)) / 100)
+    return int(float(target_free_mb) * 1024)
+
+def fill_to_target(device, target_free_mb=None, target_percent=None, strategy=DEFAULT_STRATEGY, progress=None):
+    """Fill storage until target_free_mb is left or target_percent is used.
+
+    df is read once to size the fill, which is written in FILL_CHUNK_MB
+    files by a single shell script; afterwards df is re-read and the difference is written (or the
+    last file shrunk) until the result is within TARGET_TOLERANCE_KB.
+    Returns a report with the fill_files totals plus before/after df.
+    """
+    if strategy == "truncate":
+        raise ValueError("truncate creates sparse files, which do not use up space")
+    before = read_df(device)
+    if not before:
+        raise RuntimeError("Could not read free storage")
+    total_kb, _, free_kb = before
+    goal_kb = target_free_kb(total_kb, target_free_mb, target_percent)
+    print(f"Filling storage on {device} from {free_kb // 1024} MB to {goal_kb // 1024} MB free ({strategy})...")
+
+    report = {'written': [], 'failed': [], 'bytes': 0, 'seconds': 0.0, 'corrections': 0}
+    chunk_kb = FILL_CHUNK_MB * 1024
+    last_file, last_kb = None, 0
+    after = before
+    for attempt in range(MAX_CORRECTIONS + 1):
+        delta_kb = free_kb - goal_kb
+        if abs(delta_kb) <= TARGET_TOLERANCE_KB:
+            break
+        if attempt:
+            report['corrections'] += 1
+        if delta_kb < 0:
+            # Overshot: give back space by shrinking the last file written
+            if not last_file or last_kb <= -delta_kb:
+                break
+            last_kb += delta_kb
+            run_adb(device, ["shell", f"truncate -s {last_kb * 1024} {last_file}"])
+        else:
+            sizes = [chunk_kb] * (delta_kb // chunk_kb)
+            if delta_kb % chunk_kb:
+                sizes.append(delta_kb % chunk_kb)
+            files = [(os.path.join(FILL_DIR, generate_random_name()), kb * 1024) for kb in sizes]
+            written = fill_files(device, files, strategy, progress, max_batch_bytes=None)
+            for key in ('written', 'failed', 'bytes', 'seconds'):
+                report[key] += written[key]
+            if written['failed']:
+                after = read_df(device) or after
+                break
+            last_file, last_kb = files[-1][0], sizes[-1]
+        after = read_df(device) or after
+        free_kb = after[2]
+
+    report['seconds'] = round(report['seconds'], 3)
+    report['mb_per_s'] = round(report['bytes'] / 1024 / 1024 / report['seconds'], 2) if report['seconds'] else 0.0
+    report['before'] = before
+    report['after'] = after
+    report['target_free_kb'] = goal_kb
+    report['reached'] = abs(after[2] - goal_kb) <= TARGET_TOLERANCE_KB
+    print(f"Free storage on {device} is now {after[2] // 1024} MB "
+          f"({'target reached' if report['reached'] else 'target not reached'}).")
+    return report
+
 def show_free_storage(device):
     out, _ = run_adb(device, ["shell", "df", "/sdcard"])
     print(f"Free storage on {device}:\n{out}")
 
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python storage_fill_clean.py [fill <MB> | clean | free]")
+        print("Usage: python storage_fill_clean.py [fill <MB> [strategy] | fill-to <free MB>|<used %>% [strategy] | clean | free]")
         sys.exit(1)
 
     action = sys.argv[1]
@@ -61,16 +132,28 @@ if __name__ == "__main__":
         print("No devices connected.")
         sys.exit(1)
 
-    for device in devices:
-        if action == "fill":
-            if len(sys.argv) < 3:
-                print("Specify size in MB for fill.")
-                sys.exit(1)
-            size_mb = int(sys.argv[2])
-            fill_storage(device, size_mb)
-        elif action == "clean":
-            clean_storage(device)
-        elif action == "free":
-            show_free_storage(device)
+    if action == "fill":
+        if len(sys.argv) < 3:
+            print("Specify size in MB for fill.")
+            sys.exit(1)
+        size_mb = int(sys.argv[2])
+        strategy = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_STRATEGY
+        results = run_on_devices(fill_storage, devices, size_mb, strategy)
+    elif action == "fill-to":
+        if len(sys.argv) < 3:
+            print("Specify the free MB to leave, or the used percentage (e.g. 95%).")
+            sys.exit(1)
+        target = sys.argv[2]
+        strategy = sys.argv[3] if len(sys.argv) > 3 else DEFAULT_STRATEGY
+        if target.endswith("%"):
+            results = run_on_devices(fill_to_target, devices, target_percent=float(target[:-1]), strategy=strategy)
         else:
-            print("Unknown action. Use fill, clean, or free.")
+            results = run_on_devices(fill_to_target, devices, target_free_mb=float(target), strategy=strategy)
+    elif action == "clean":
+        results = run_on_devices(clean_storage, devices)
+    elif action == "free":
+        results = run_on_devices(show_free_storage, devices)
+    else:
+        print("Unknown action. Use fill, clean, or free.")
+        sys.exit(1)
+    print_device_summary(results)
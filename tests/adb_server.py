@@ -0,0 +1,110 @@
+"""Loopback stand-in for the adb server's host protocol, for adb_client tests."""
+
+import socket
+import struct
+import threading
+import time
+
+
+class FakeAdbServer:
+    """Answers host:devices, host-serial:*:features, host:transport:* and the
+    shell, shell,v2 and exec services of its devices.
+
+    shell(command) returns (stdout, stderr, exit_code) and exec(command) the
+    stream's bytes. A request starting with one of the hang prefixes gets
+    no answer, and trickle sends one byte of output every trickle seconds,
+    forever, instead of running the service.
+    """
+
+    def __init__(self, devices=(("emulator-5554", "device"),), features="shell_v2,cmd",
+                 shell=None, exec=None, hang=(), trickle=None):
+        self.devices = list(devices)
+        self.features = features
+        self.shell = shell or (lambda command: (command.encode(), b"", 0))
+        self.exec = exec or (lambda command: command.encode())
+        self.hang = hang
+        self.trickle = trickle
+        self.requests = []
+        self._stopped = threading.Event()
+        self._listener = socket.socket()
+        self._listener.bind(("127.0.0.1", 0))
+        self._listener.listen()
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def close(self):
+        self._stopped.set()
+        self._listener.close()
+
+    def _accept(self):
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+
+    def _serve(self, conn):
+        try:
+            serial = None
+            while True:
+                length = self._recv(conn, 4)
+                if length is None:
+                    return
+                request = self._recv(conn, int(length, 16)).decode()
+                self.requests.append(request)
+                if request.startswith(tuple(self.hang)):
+                    self._stopped.wait()
+                    return
+                if request.startswith("host:transport:"):
+                    serial = request.split(":", 2)[2]
+                    if serial not in dict(self.devices):
+                        return self._fail(conn, f"device '{serial}' not found")
+                    conn.sendall(b"OKAY")
+                elif request == "host:devices":
+                    self._reply(conn, "".join(f"{s}\t{state}\n" for s, state in self.devices))
+                elif request.startswith("host-serial:") and request.endswith(":features"):
+                    self._reply(conn, self.features)
+                elif serial and request.startswith(("shell", "exec:")):
+                    return self._service(conn, request)
+                else:
+                    return self._fail(conn, f"unknown request {request}")
+        finally:
+            conn.close()
+
+    def _service(self, conn, request):
+        kind, _, command = request.partition(":")
+        conn.sendall(b"OKAY")
+        if self.trickle is not None:
+            packet = struct.pack("<BI", 1, 1) + b"." if kind.startswith("shell,v2") else b"."
+            while not self._stopped.is_set():
+                conn.sendall(packet)
+                time.sleep(self.trickle)
+            return
+        if kind == "exec":
+            conn.sendall(self.exec(command))
+            return
+        out, err, exit_code = self.shell(command)
+        if not kind.startswith("shell,v2"):
+            conn.sendall(out + err)
+            return
+        for packet_id, data in ((1, out), (2, err), (3, bytes([exit_code]))):
+            if data:
+                conn.sendall(struct.pack("<BI", packet_id, len(data)) + data)
+
+    def _reply(self, conn, text):
+        payload = text.encode()
+        conn.sendall(b"OKAY" + b"%04x" % len(payload) + payload)
+
+    def _fail(self, conn, message):
+        payload = message.encode()
+        conn.sendall(b"FAIL" + b"%04x" % len(payload) + payload)
+
+    def _recv(self, conn, size):
+        data = b""
+        while len(data) < size:
+            chunk = conn.recv(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+        return data
@@ -0,0 +1,41 @@
+"""
+Shared setup: every test runs against simulated devices (see fake_adb.py).
+
+The environment is prepared before any panel module is imported, because
+adb_shell and scan_index read their settings at import time.
+"""
+
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import fake_adb  # noqa: E402
+
+HOME = tempfile.mkdtemp(prefix="cache-panel-tests-")
+BIN_DIR = fake_adb.setup(HOME, devices=1, packages=60, rooted=True)
+SERIAL = fake_adb.load_config(HOME)['devices'][0]
+
+os.environ["PATH"] = BIN_DIR + os.pathsep + os.environ.get("PATH", "")
+os.environ.setdefault("ADB_BACKEND", "subprocess")
+os.environ["SCAN_INDEX_DB"] = os.path.join(HOME, "scan_index.db")
+os.environ["HISTORY_DIR"] = os.path.join(HOME, "history")
+
+
+@pytest.fixture
+def fake_home():
+    return HOME
+
+
+@pytest.fixture
+def serial():
+    return SERIAL
+
+
+def cache_dir(package):
+    """Host path of package's cache on the fake device."""
+    return os.path.join(fake_adb.device_root(HOME, SERIAL), "data", "data", package, "cache")
@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+import fake_adb
+from adb_client import AdbClient, AdbProtocolError, AdbTimeout, read_all
+from adb_server import FakeAdbServer
+
+SERIAL = "emulator-5554"
+
+
+@pytest.fixture
+def server_factory():
+    servers = []
+
+    def start(**kwargs):
+        server = FakeAdbServer(**kwargs)
+        servers.append(server)
+        return server, AdbClient(port=server.port)
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def test_devices(server_factory):
+    server, client = server_factory(devices=[(SERIAL, "device"), ("emulator-5556", "offline")])
+    assert client.devices() == [(SERIAL, "device"), ("emulator-5556", "offline")]
+    assert server.requests == ["host:devices"]
+
+
+def test_shell_v2_over_transport(server_factory):
+    server, client = server_factory(shell=lambda command: (b"out\n", b"err\n", 3))
+    assert client.shell(SERIAL, "ls /data") == ("out\n", "err\n", 3)
+    assert f"host:transport:{SERIAL}" in server.requests
+    assert "shell,v2,raw:ls /data" in server.requests
+
+
+def test_shell_without_v2_merges_output(server_factory):
+    server, client = server_factory(features="", shell=lambda command: (b"out\n", b"err\n", 3))
+    assert client.shell(SERIAL, "ls") == ("out\nerr\n", "", None)
+    assert "shell:ls" in server.requests
+
+
+def test_fail_is_raised_with_the_server_message(server_factory):
+    server, client = server_factory()
+    with pytest.raises(AdbProtocolError, match="device 'emulator-9999' not found"):
+        client.shell("emulator-9999", "echo ok")
+
+
+def test_exec_out_is_binary_safe(server_factory):
+    payload = bytes(range(256)) * 64 + b"\r\n\0"
+    server, client = server_factory(exec=lambda command: payload)
+    sock = client.exec_out(SERIAL, "tar -c .")
+    try:
+        assert read_all(sock) == payload
+    finally:
+        sock.close()
+    assert "exec:tar -c ." in server.requests
+
+
+def test_against_fake_devices(tmp_path):
+    fake_adb.setup(str(tmp_path), devices=1, packages=3)
+    client = AdbClient(port=fake_adb.serve(str(tmp_path)))
+    assert client.devices() == [(SERIAL, "device")]
+    out, err, exit_code = client.shell(SERIAL, "ls /data/data")
+    assert out.split() == ["com.fake.app0000", "com.fake.app0001", "com.fake.app0002"]
+    assert exit_code == 0
+    assert client.shell(SERIAL, "ls /data/missing")[2] != 0
+
+
+@pytest.mark.parametrize("hang", ["host-serial:", "host:transport:", "shell,v2"])
+def test_shell_times_out_on_a_hung_server(server_factory, hang):
+    server, client = server_factory(hang=(hang,))
+    started = time.monotonic()
+    with pytest.raises(AdbTimeout):
+        client.shell(SERIAL, "echo ok", timeout=0.5)
+    assert time.monotonic() - started < 2
+
+
+@pytest.mark.parametrize("features", ["shell_v2", ""])
+def test_deadline_covers_the_whole_read(server_factory, features):
+    # Every recv gets a byte well within the timeout; only a deadline kept
+    # across reads stops the call
+    server, client = server_factory(features=features, trickle=0.05)
+    started = time.monotonic()
+    with pytest.raises(AdbTimeout):
+        client.shell(SERIAL, "cat /dev/zero", timeout=0.5)
+    assert time.monotonic() - started < 2
+
+
+def test_exec_out_open_times_out(server_factory):
+    server, client = server_factory(hang=("exec:",))
+    with pytest.raises(AdbTimeout):
+        client.exec_out(SERIAL, "tar -c .", timeout=0.5)
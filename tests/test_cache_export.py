@@ -0,0 +1,68 @@
+import io
+import json
+import tarfile
+
+import pytest
+
+from cache_export import MANIFEST_NAME, TarIndex, _manifest_member
+
+
+def make_tar():
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w", format=tarfile.GNU_FORMAT) as tar:
+        for name, size in [("data/com.a/cache/f", 700), ("data/com.b/cache/" + "long" * 40, 1500)]:
+            info = tarfile.TarInfo(name)
+            info.size = size
+            tar.addfile(info, io.BytesIO(b"x" * size))
+    return buffer.getvalue()
+
+
+ARCHIVE = make_tar()
+# Members end where the first zero block of the end-of-archive marker starts
+MEMBERS_END = 512 + 1024 + 512 * 2 + 512 + 1536
+
+
+def feed_in_chunks(data, sizes):
+    index, kept, pos = TarIndex(), [], 0
+    for size in sizes:
+        kept.append(index.feed(data[pos:pos + size]))
+        pos += size
+    while pos < len(data) and not index.ended:
+        kept.append(index.feed(data[pos:pos + 4096]))
+        pos += 4096
+    return index, b"".join(kept)
+
+
+@pytest.mark.parametrize("split", [1, 100, 511, 513, MEMBERS_END - 1, MEMBERS_END + 100, MEMBERS_END + 600])
+def test_members_survive_any_split(split):
+    index, kept = feed_in_chunks(ARCHIVE, [split])
+
+    assert index.ended
+    assert kept == ARCHIVE[:MEMBERS_END]
+    assert [e['path'] for e in index.entries] == ["/data/data/com.a/cache/f",
+                                                  "/data/data/com.b/cache/" + "long" * 40]
+
+
+def test_manifest_is_readable_after_unaligned_chunks():
+    index, kept = feed_in_chunks(ARCHIVE, [333] * 20)
+    archive = kept + _manifest_member({'files': len(index.entries)}, index.entries)
+
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        assert tar.getnames()[-1] == MANIFEST_NAME
+        assert json.load(tar.extractfile(MANIFEST_NAME))['files'] == 2
+
+
+def test_export_from_device(serial):
+    from cache_export import CacheExport
+    from conftest import cache_dir
+
+    with open(cache_dir("com.fake.app0010") + "/blob", "wb") as f:
+        f.write(bytes(range(256)) * 40)
+
+    archive = b"".join(CacheExport(serial, ["com.fake.app0010"]))
+
+    with tarfile.open(fileobj=io.BytesIO(archive)) as tar:
+        blob = [m for m in tar.getmembers() if m.name.endswith("/blob")][0]
+        assert tar.extractfile(blob).read() == bytes(range(256)) * 40
+        manifest = json.load(tar.extractfile(MANIFEST_NAME))
+    assert manifest['packages']['com.fake.app0010']['bytes'] == 10240
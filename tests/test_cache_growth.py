@@ -0,0 +1,32 @@
+import threading
+import time
+
+import app
+from cache_growth import TokenBucket
+
+
+def test_token_bucket_holds_the_rate():
+    bucket = TokenBucket(0, 1)
+    bucket.refill(1000)
+    bucket.tokens = 1000
+    assert bucket.take(600)
+    assert not bucket.take(600)
+    # A file larger than the bucket is allowed once it is full, then owes
+    assert bucket.take(400) and not bucket.take(1)
+
+
+def test_grow_job_leaves_the_device_usable(serial):
+    client = app.app.test_client()
+    job = client.post('/api/cache/grow', json={
+        'device': serial, 'packages': ['com.fake.app0020'], 'rate_mb_s': 2, 'duration_s': 4}).json
+    assert job['success']
+    time.sleep(0.5)
+
+    responses = []
+    request = threading.Thread(target=lambda: responses.append(
+        client.post('/api/storage/free', json={'device': serial}).json), daemon=True)
+    request.start()
+    request.join(2)
+    assert responses and responses[0]['success']
+
+    client.post(f"/api/jobs/{job['job_id']}/cancel")
@@ -0,0 +1,55 @@
+import threading
+
+import cache_watch
+from cache_watch import CacheWatchRegistry
+
+
+class SlowDevice:
+    """Device whose cache_dir lookup for slow_package waits for release."""
+
+    def __init__(self, slow_package=None):
+        self.slow_package = slow_package
+        self.resolving = threading.Event()
+        self.release = threading.Event()
+
+    def cache_dir(self, package):
+        if package == self.slow_package:
+            self.resolving.set()
+            self.release.wait(5)
+        return f"/data/data/{package}/cache"
+
+
+def test_cache_dir_is_resolved_outside_the_registry_lock(monkeypatch):
+    device = SlowDevice("com.fake.app0001")
+    monkeypatch.setattr(cache_watch, "get_device", lambda serial: device)
+    monkeypatch.setattr(cache_watch.CacheWatcher, "start", lambda self: None)
+    registry = CacheWatchRegistry(on_size=lambda *args: None)
+
+    subscriber = threading.Thread(target=registry.subscribe, args=("a", "emulator-5554", "com.fake.app0001"))
+    subscriber.start()
+    assert device.resolving.wait(5)
+    # Other clients are not held up while the slow device answers
+    assert registry._lock.acquire(timeout=1)
+    registry._lock.release()
+    registry.subscribe("b", "emulator-5554", "com.fake.app0002")
+    device.release.set()
+    subscriber.join(5)
+
+    assert sorted(w['package'] for w in registry.watchers()) == ["com.fake.app0001", "com.fake.app0002"]
+
+
+def test_concurrent_subscribers_share_one_watcher(monkeypatch):
+    device = SlowDevice()
+    monkeypatch.setattr(cache_watch, "get_device", lambda serial: device)
+    monkeypatch.setattr(cache_watch.CacheWatcher, "start", lambda self: None)
+    registry = CacheWatchRegistry(on_size=lambda *args: None)
+
+    threads = [threading.Thread(target=registry.subscribe, args=(sid, "emulator-5554", "com.fake.app0001"))
+               for sid in "abcd"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert registry.watchers() == [{'device': "emulator-5554", 'package': "com.fake.app0001",
+                                    'mode': "auto", 'size_kb': None, 'subscribers': 4}]
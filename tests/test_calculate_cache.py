@@ -0,0 +1,44 @@
+import json
+
+from app import app
+from calculate_cache import get_cache_sizes
+from device import get_device
+
+
+def test_unknown_user_sends_no_bare_du(monkeypatch, serial):
+    dev = get_device(serial)
+    commands = []
+    shell = dev.shell
+
+    def recording_shell(command):
+        commands.append(command)
+        return shell(command)
+
+    dev.users()
+    monkeypatch.setattr(dev, "shell", recording_shell)
+    sizes = get_cache_sizes(["com.fake.app0001", "com.fake.app0002"], serial, user=7)
+
+    assert sizes == {"com.fake.app0001": 0, "com.fake.app0002": 0}
+    assert not any(command.startswith("du") for command in commands)
+
+
+def test_calculate_rejects_unknown_user(serial):
+    client = app.test_client()
+    for body in ({'device': serial, 'user': 7}, {'device': serial, 'user': 7, 'stream': True}):
+        result = client.post('/api/cache/calculate', json=body).get_json()
+        assert not result['success']
+        assert "user 7" in result['error']
+
+    result = client.post('/api/cache/calculate', json={'device': serial, 'user': 0}).get_json()
+    assert result['success']
+
+
+def test_stream_top_n_skips_ties_with_the_smallest(serial):
+    # app0030..app0039 all have empty caches of the same size
+    response = app.test_client().post('/api/cache/calculate', json={
+        'device': serial, 'package_filter': 'app003', 'stream': True, 'top_n': 2, 'full': True})
+    events = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+    streamed = [e['package'] for e in events if e['type'] == 'package']
+    assert len(streamed) == 2
+    assert len(events[-1]['packages']) == 2
@@ -0,0 +1,28 @@
+import time
+
+import pytest
+
+import app
+
+
+def batches(client, seconds):
+    deadline = time.time() + seconds
+    updates = []
+    while time.time() < deadline and not updates:
+        time.sleep(0.2)
+        for message in client.get_received():
+            if message['name'] == 'monitor_batch':
+                updates.extend(message['args'][0]['u'])
+    return updates
+
+
+@pytest.mark.parametrize("mode", ["du", "delta"])
+def test_cache_monitor_delivers_initial_size(serial, mode):
+    client = app.socketio.test_client(app.app)
+    try:
+        client.emit('start_cache_monitoring', {'device': serial, 'package_name': 'com.fake.app0003', 'mode': mode})
+        updates = batches(client, 5)
+        assert updates and updates[0][:3] == ['cache', serial, 'com.fake.app0003']
+    finally:
+        client.emit('stop_cache_monitoring')
+        client.disconnect()
@@ -0,0 +1,17 @@
+import memory_monitor
+from adb_shell import COMMAND_TIMEOUTS
+
+
+def test_sample_uses_short_deadline(monkeypatch, serial):
+    calls = []
+
+    def fake_run_adb(device, command, timeout=None):
+        calls.append(timeout)
+        return "MemTotal: 2048 kB\nMemFree: 1024 kB\n", ""
+
+    monkeypatch.setattr(memory_monitor, "run_adb", fake_run_adb)
+    sample = memory_monitor.read_memory(serial, ["com.fake.app0001"])
+
+    assert sample['total_kb'] == 2048
+    assert calls == [COMMAND_TIMEOUTS["df"]]
+    assert calls[0] < COMMAND_TIMEOUTS["script"]
@@ -0,0 +1,77 @@
+import threading
+import time
+
+import multi_device
+from multi_device import device_slot, run_on_devices
+
+
+def test_busy_device_does_not_hold_pool_workers():
+    release = threading.Event()
+
+    def work(device):
+        if device == "busy":
+            release.wait(5)
+        return device
+
+    # Fill every pool worker's worth of queue on one device
+    waiting = []
+    for _ in range(multi_device.MAX_PARALLEL_DEVICES * 2):
+        thread = threading.Thread(target=run_on_devices, args=(work, ["busy"]))
+        thread.start()
+        waiting.append(thread)
+    time.sleep(0.2)
+
+    started = time.time()
+    result = run_on_devices(work, ["idle"])
+    assert result["idle"]['result'] == "idle"
+    assert time.time() - started < 1
+
+    release.set()
+    for thread in waiting:
+        thread.join(5)
+
+
+def test_slot_is_shared_with_direct_users():
+    slot = device_slot("direct")
+    order = []
+    with slot:
+        future = slot.submit(order.append, "queued")
+        time.sleep(0.1)
+        order.append("direct")
+    future.result(5)
+    assert order == ["direct", "queued"]
+
+
+def test_direct_users_wait_for_the_slot():
+    slot = device_slot("exclusive")
+    inside = []
+
+    def hold():
+        with slot:
+            inside.append(len(inside))
+            time.sleep(0.2)
+            inside.append(None)
+
+    threads = [threading.Thread(target=hold) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    # The second holder only got in after the first left
+    assert inside == [0, None, 2, None]
+
+
+def test_devices_run_concurrently():
+    barrier = threading.Barrier(3, timeout=5)
+
+    def work(device):
+        # Only returns once all three devices are running at the same time
+        barrier.wait()
+        return device
+
+    results = run_on_devices(work, ["one", "two", "three"])
+    assert {device: r['result'] for device, r in results.items() if r['success']} == {
+        "one": "one", "two": "two", "three": "three"}
+
+    results = run_on_devices(work, ["one", "two", "three"], per_device_slot=False)
+    assert all(r['success'] for r in results.values())
@@ -0,0 +1,36 @@
+import pytest
+
+from package_index import PackageIndex
+
+
+class FakeIndex(PackageIndex):
+    def __init__(self, results):
+        super().__init__()
+        self.results = list(results)
+        self.fetches = 0
+
+    def _stamp(self, device):
+        return "packages.xml 1 100"
+
+    def _fetch(self, device):
+        self.fetches += 1
+        result = self.results.pop(0)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+def test_empty_fetch_is_not_cached():
+    index = FakeIndex([[], ["com.example.app"]])
+    assert index.packages("emulator-5554") == []
+    assert index.packages("emulator-5554") == ["com.example.app"]
+    assert index.packages("emulator-5554") == ["com.example.app"]
+    assert index.fetches == 2
+
+
+def test_failed_fetch_is_not_cached():
+    index = FakeIndex([RuntimeError("device gone"), ["com.example.app"]])
+    with pytest.raises(RuntimeError):
+        index.packages("emulator-5554")
+    assert "emulator-5554" not in index._entries
+    assert index.packages("emulator-5554") == ["com.example.app"]
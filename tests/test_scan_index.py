@@ -0,0 +1,62 @@
+import os
+import shutil
+import time
+
+from conftest import cache_dir
+from package_index import index as package_index
+from scan_index import ScanIndex
+
+
+def write_file(package, name, size):
+    with open(os.path.join(cache_dir(package), name), "wb") as f:
+        f.write(b"x" * size)
+
+
+def packages_matching(keyword):
+    return [f"com.fake.app{i:04d}" for i in range(60) if keyword in f"com.fake.app{i:04d}"]
+
+
+def test_filtered_scan_does_not_hide_changes_from_other_filters(tmp_path, serial):
+    index = ScanIndex(str(tmp_path / "index.db"))
+    index.scan(serial, packages_matching("app00"), full=True)
+
+    time.sleep(0.05)
+    write_file("com.fake.app0050", "grown", 2 * 1024 * 1024)
+
+    # A scan of another filter must not move the shared stamp past the change
+    index.scan(serial, packages_matching("app001"))
+    sizes, stats = index.scan(serial, packages_matching("app005"))
+
+    assert sizes["com.fake.app0050"] >= 2048
+    assert stats['rescanned'] >= 1
+
+
+def test_covering_scan_reuses_unchanged_packages(tmp_path, serial):
+    index = ScanIndex(str(tmp_path / "index.db"))
+    packages = packages_matching("app002")
+    index.scan(serial, packages, full=True)
+
+    sizes, stats = index.scan(serial, packages)
+
+    assert stats == {'rescanned': 0, 'reused': len(packages)}
+
+
+def test_uninstalled_package_does_not_freeze_the_stamp(tmp_path, serial):
+    extra = cache_dir("com.fake.app0099")
+    os.makedirs(extra)
+    package_index.invalidate(serial)
+    index = ScanIndex(str(tmp_path / "index.db"))
+    index.scan(serial, package_index.packages(serial), full=True)
+
+    shutil.rmtree(os.path.dirname(extra))
+    package_index.invalidate(serial)
+    time.sleep(0.05)
+    write_file("com.fake.app0010", "grown", 4096)
+
+    installed = package_index.packages(serial)
+    sizes, stats = index.scan(serial, installed)
+    assert stats['rescanned'] == 1
+    assert "com.fake.app0099" not in index.known(serial, "all")
+    for _ in range(3):
+        sizes, stats = index.scan(serial, installed)
+        assert stats == {'rescanned': 0, 'reused': len(installed)}
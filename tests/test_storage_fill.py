@@ -0,0 +1,25 @@
+import fill_engine
+import storage_fill_clean
+
+
+def test_fill_to_target_writes_in_one_script(monkeypatch, serial):
+    # Three files adding up to more than MAX_BATCH_BYTES, which a byte-capped
+    # fill would split over several calls
+    monkeypatch.setattr(storage_fill_clean, "FILL_CHUNK_MB", 300)
+    scripts = []
+    run_adb = fill_engine.run_adb
+
+    def counting_run_adb(device, command, timeout=None):
+        scripts.append(command[-1])
+        return run_adb(device, command, timeout)
+
+    monkeypatch.setattr(fill_engine, "run_adb", counting_run_adb)
+    free_kb = storage_fill_clean.read_df(serial)[2]
+    try:
+        report = storage_fill_clean.fill_to_target(serial, target_free_mb=free_kb // 1024 - 601)
+    finally:
+        storage_fill_clean.clean_storage(serial)
+
+    assert report['reached']
+    assert len(report['written']) == 3
+    assert len(scripts) == 1
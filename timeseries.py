@@ -0,0 +1,225 @@
+"""
+Compact history of monitor samples.
+
+Each (device, metric) series lives in one flat buffer of unsigned 32-bit
+words: timestamps are epoch seconds and values are KB, so a sample costs
+8 bytes instead of a dict. Three ring-buffer tiers keep the data bounded:
+
+    raw   2 s samples for the last hour            (ts, value)
+    1m    1 minute min/max/avg buckets for a day   (ts, min, max, avg)
+    10m   10 minute min/max/avg buckets for a week (ts, min, max, avg)
+
+A series is about 53 KB, so dozens of devices fit in a few MB. When a
+history directory is configured the buffer is a memory-mapped file, which
+makes the history survive restarts without any explicit saving.
+"""
+
+import mmap
+import os
+import re
+import threading
+
+MAGIC = 0x43414348  # "CACH"
+VERSION = 1
+HEADER_WORDS = 16
+MAX_VALUE = 0xFFFFFFFF
+
+# (name, bucket seconds, capacity, words per row); bucket 0 means raw samples
+TIERS = [
+    ("raw", 0, 1800, 2),
+    ("1m", 60, 1440, 4),
+    ("10m", 600, 1008, 4),
+]
+
+SERIES_WORDS = HEADER_WORDS + sum(capacity * width for _, _, capacity, width in TIERS)
+SERIES_BYTES = SERIES_WORDS * 4
+
+
+class _Ring:
+    """Fixed-capacity ring of rows stored in a shared uint32 buffer."""
+
+    def __init__(self, words, base, capacity, width, slot):
+        self.words = words
+        self.base = base
+        self.capacity = capacity
+        self.width = width
+        self.slot = slot
+
+    @property
+    def head(self):
+        return self.words[self.slot]
+
+    @property
+    def count(self):
+        return self.words[self.slot + 1]
+
+    def append(self, row):
+        head = self.head
+        start = self.base + head * self.width
+        for i, value in enumerate(row):
+            self.words[start + i] = min(max(int(value), 0), MAX_VALUE)
+        self.words[self.slot] = (head + 1) % self.capacity
+        self.words[self.slot + 1] = min(self.count + 1, self.capacity)
+
+    def rows(self, start=0, end=MAX_VALUE):
+        """Rows with start <= ts <= end, oldest first."""
+        first = (self.head - self.count) % self.capacity
+        for n in range(self.count):
+            offset = self.base + ((first + n) % self.capacity) * self.width
+            ts = self.words[offset]
+            if start <= ts <= end:
+                yield tuple(self.words[offset:offset + self.width])
+
+    def oldest(self):
+        if not self.count:
+            return None
+        first = (self.head - self.count) % self.capacity
+        return self.words[self.base + first * self.width]
+
+
+class _Bucket:
+    """Open min/max/avg bucket that is flushed into the next tier when it closes."""
+
+    def __init__(self, start, low, high, total, n):
+        self.start = start
+        self.low = low
+        self.high = high
+        self.total = total
+        self.n = n
+
+    def add(self, low, high, total, n):
+        self.low = min(self.low, low)
+        self.high = max(self.high, high)
+        self.total += total
+        self.n += n
+
+    def row(self):
+        return (self.start, self.low, self.high, round(self.total / self.n))
+
+
+class Series:
+    def __init__(self, path=None):
+        self.path = path
+        self._file = None
+        if path:
+            exists = os.path.exists(path) and os.path.getsize(path) == SERIES_BYTES
+            self._file = open(path, "r+b" if exists else "w+b")
+            if not exists:
+                self._file.truncate(SERIES_BYTES)
+            self.buffer = mmap.mmap(self._file.fileno(), SERIES_BYTES)
+        else:
+            self.buffer = bytearray(SERIES_BYTES)
+        self.words = memoryview(self.buffer).cast("I")
+        if self.words[0] != MAGIC or self.words[1] != VERSION:
+            for i in range(HEADER_WORDS):
+                self.words[i] = 0
+            self.words[0] = MAGIC
+            self.words[1] = VERSION
+
+        self.tiers = []
+        base = HEADER_WORDS
+        for i, (name, bucket, capacity, width) in enumerate(TIERS):
+            self.tiers.append(_Ring(self.words, base, capacity, width, 2 + i * 2))
+            base += capacity * width
+        self._open = [None] * len(TIERS)
+
+    def append(self, ts, value):
+        ts = int(ts)
+        self.tiers[0].append((ts, value))
+        self._feed(1, ts, value, value, value, 1)
+
+    def _feed(self, level, ts, low, high, total, n):
+        if level >= len(TIERS):
+            return
+        start = ts - ts % TIERS[level][1]
+        bucket = self._open[level]
+        if bucket is not None and bucket.start != start:
+            row = bucket.row()
+            self.tiers[level].append(row)
+            self._feed(level + 1, bucket.start, bucket.low, bucket.high, bucket.total, bucket.n)
+            bucket = None
+        if bucket is None:
+            self._open[level] = _Bucket(start, low, high, total, n)
+        else:
+            bucket.add(low, high, total, n)
+
+    def query(self, start=0, end=MAX_VALUE, resolution="auto"):
+        """Return (resolution, columns) for samples in [start, end]."""
+        if resolution == "auto":
+            resolution = self._auto_resolution(start)
+        level = [name for name, _, _, _ in TIERS].index(resolution)
+        rows = list(self.tiers[level].rows(start, end))
+        bucket = self._open[level] if level else None
+        if bucket is not None and start <= bucket.start <= end:
+            rows.append(bucket.row())
+        names = ("t", "v") if level == 0 else ("t", "min", "max", "avg")
+        return resolution, {name: [row[i] for row in rows] for i, name in enumerate(names)}
+
+    def _auto_resolution(self, start):
+        """Finest tier reaching back to start, else the coarsest one with data."""
+        with_data = []
+        for (name, _, _, _), ring in zip(TIERS, self.tiers):
+            oldest = ring.oldest()
+            if oldest is None:
+                continue
+            if oldest <= start:
+                return name
+            with_data.append(name)
+        return with_data[-1] if with_data else TIERS[0][0]
+
+    def close(self):
+        if self._file:
+            self.words.release()
+            self.buffer.flush()
+            self.buffer.close()
+            self._file.close()
+
+
+def _file_name(device, metric):
+    return re.sub(r"[^A-Za-z0-9._-]", "_", f"{device}__{metric}") + ".ts"
+
+
+class HistoryStore:
+    """Series keyed by (device, metric), optionally persisted under directory."""
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _get(self, device, metric, create):
+        key = (device, metric)
+        series = self._series.get(key)
+        if series is None:
+            path = os.path.join(self.directory, _file_name(device, metric)) if self.directory else None
+            if not create and not (path and os.path.exists(path)):
+                return None
+            series = self._series[key] = Series(path)
+        return series
+
+    def record(self, device, metric, ts, value_kb):
+        with self._lock:
+            self._get(device, metric, True).append(ts, value_kb)
+
+    def query(self, device, metric, start=0, end=MAX_VALUE, resolution="auto"):
+        with self._lock:
+            series = self._get(device, metric, False)
+            if series is None:
+                return resolution, None
+            return series.query(start, end, resolution)
+
+    def keys(self):
+        with self._lock:
+            return list(self._series)
+
+    def close(self):
+        with self._lock:
+            for series in self._series.values():
+                series.close()
+            self._series.clear()
+
+
+def resolutions():
+    return [name for name, _, _, _ in TIERS]